@@ -0,0 +1,135 @@
+import os
+import threading
+import logging
+from collections import OrderedDict
+from time import time
+import numpy as np
+import metrics
+
+logger = logging.getLogger('gunicorn.error')
+
+
+class SemanticAnswerCache:
+    """In-process cache of LLM answers looked up by question embedding similarity.
+
+    Answers are only shared between couriers with the same country, contract type
+    and vehicle type, because those profile fields change the generated answer.
+    The prompt also has the courier's first name and age, which are not part of the
+    key: Rag stores the first name as a placeholder and fills in the name of the
+    courier a cached answer is served to. Answers are assumed not to depend on the
+    age, an answer that repeats it is served as is.
+    """
+    SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+    TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+    MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+    VERSION_CHECK_INTERVAL = float(os.getenv("ANSWER_CACHE_VERSION_CHECK_INTERVAL", "30"))
+
+    def __init__(self, version_provider=None, similarity_threshold=None, ttl=None, max_entries=None):
+        # version_provider() returns the current FAQ ingestion version, the cache is
+        # cleared whenever it changes.
+        self.version_provider = version_provider
+        self.similarity_threshold = similarity_threshold or self.SIMILARITY_THRESHOLD
+        self.ttl = ttl or self.TTL
+        self.max_entries = max_entries or self.MAX_ENTRIES
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # entry_id -> (bucket_key, created, answer_data), in LRU order
+        self._buckets = {}  # bucket_key -> {"ids": [...], "vectors": [...], "matrix": np.ndarray | None}
+        self._next_id = 0
+        self._version = None
+        self._version_checked_at = 0
+        metrics.register_gauge_callback(self._report_gauges)
+
+    @staticmethod
+    def _bucket_key(courier):
+        return (courier['country'], courier['contract_type'], courier['vehicle_type'])
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, question_vector, courier):
+        self._check_version()
+        vector = self._normalize(question_vector)
+
+        with self._lock:
+            bucket = self._buckets.get(self._bucket_key(courier))
+            entry_id = self._best_match(bucket, vector) if bucket else None
+            if entry_id is None:
+                metrics.inc("answer_cache_misses_total", help_text="Semantic answer cache misses")
+                return None
+
+            self._entries.move_to_end(entry_id)
+            answer_data = self._entries[entry_id][2]
+
+        metrics.inc("answer_cache_hits_total", help_text="Semantic answer cache hits")
+        return answer_data
+
+    def put(self, question_vector, courier, answer_data):
+        self._check_version()
+        vector = self._normalize(question_vector)
+        key = self._bucket_key(courier)
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (key, time(), answer_data)
+            bucket = self._buckets.setdefault(key, {"ids": [], "vectors": [], "matrix": None})
+            bucket["ids"].append(entry_id)
+            bucket["vectors"].append(vector)
+            bucket["matrix"] = None
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def _best_match(self, bucket, vector):
+        now = time()
+        while True:
+            if bucket["matrix"] is None:
+                bucket["matrix"] = np.vstack(bucket["vectors"]) if bucket["vectors"] else np.empty((0, len(vector)), dtype=np.float32)
+            if not len(bucket["ids"]):
+                return None
+
+            scores = bucket["matrix"] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+
+            entry_id = bucket["ids"][best]
+            if now - self._entries[entry_id][1] <= self.ttl:
+                return entry_id
+            # expired, drop it and look for the next best match
+            self._remove(entry_id)
+
+    def _remove(self, entry_id):
+        key, _, _ = self._entries.pop(entry_id)
+        bucket = self._buckets[key]
+        index = bucket["ids"].index(entry_id)
+        del bucket["ids"][index]
+        del bucket["vectors"][index]
+        bucket["matrix"] = None
+        if not bucket["ids"]:
+            del self._buckets[key]
+
+    def _check_version(self):
+        if self.version_provider is None or time() - self._version_checked_at < self.VERSION_CHECK_INTERVAL:
+            return
+        self._version_checked_at = time()
+        try:
+            version = self.version_provider()
+        except Exception as e:
+            logger.warning(f"Could not read FAQ ingestion version: {e}")
+            return
+        if version != self._version:
+            if self._version is not None:
+                logger.info(f"FAQ data was re-ingested ({self._version} -> {version}), clearing answer cache.")
+            self.clear()
+            self._version = version
+
+    def _report_gauges(self):
+        metrics.set_gauge("answer_cache_entries", len(self._entries), help_text="Answers in the semantic answer cache")
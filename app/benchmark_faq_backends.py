@@ -0,0 +1,96 @@
+"""Compares latency and results of the Qdrant and the local NumPy FAQ retrieval backends.
+
+Run from the root folder with Qdrant running: python app/benchmark_faq_backends.py
+"""
+import os
+import json
+import argparse
+from time import perf_counter
+import numpy as np
+from faq_repository import FaqRepository
+from embedding_cache import EmbeddingCache
+
+
+def latency_stats(latencies):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "mean_ms": round(float(latencies_ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+    }
+
+
+def run_backend(faq_db, queries, score_threshold, limit, repeat):
+    results, latencies = [], []
+    for _ in range(repeat):
+        results = []
+        for question, country, vector in queries:
+            start_time = perf_counter()
+            hits = faq_db.search_hits(question, country, score_threshold, limit, query_vector=vector)
+            latencies.append(perf_counter() - start_time)
+            results.append(hits)
+    return results, latency_stats(latencies)
+
+
+def compare_results(qdrant_results, local_results):
+    same_ids, overlap, score_diffs = 0, [], []
+    for qdrant_hits, local_hits in zip(qdrant_results, local_results):
+        qdrant_ids = [hit[0] for hit in qdrant_hits]
+        local_ids = [hit[0] for hit in local_hits]
+        same_ids += qdrant_ids == local_ids
+        union = set(qdrant_ids) | set(local_ids)
+        overlap.append(len(set(qdrant_ids) & set(local_ids)) / len(union) if union else 1.0)
+        local_scores = {hit[0]: hit[1] for hit in local_hits}
+        score_diffs += [abs(score - local_scores[point_id]) for point_id, score, _ in qdrant_hits if point_id in local_scores]
+
+    return {
+        "identical_result_lists": same_ids / len(qdrant_results),
+        "mean_jaccard_overlap": float(np.mean(overlap)),
+        "max_score_difference": float(max(score_diffs)) if score_diffs else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ground-truth", default="notebooks/evaluation_ground_truth.json")
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--score-threshold", type=float, default=0.7)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="passes over all questions per backend")
+    args = parser.parse_args()
+
+    qd_server = os.environ.get("QD_SERVER", "localhost:6333")
+    embedding_cache = EmbeddingCache(FaqRepository.EMBEDDING_DIMENSIONALITY, max_entries=args.questions)
+    qdrant_faq_db = FaqRepository(qd_server, "courier_faq", embedding_cache=embedding_cache, backend="qdrant")
+    local_faq_db = FaqRepository(qd_server, "courier_faq", embedding_cache=embedding_cache, backend="local")
+
+    with open(args.ground_truth) as f:
+        ground_truth = json.load(f)[:args.questions]
+
+    # Embeddings are computed once up front so only the retrieval itself is measured.
+    queries = [
+        (record["generated_question"], record["ground_truth_courier"]["country"], qdrant_faq_db.embed_question(record["generated_question"]))
+        for record in ground_truth
+    ]
+
+    load_start = perf_counter()
+    local_faq_db._get_local_index()
+    local_load_time = perf_counter() - load_start
+
+    qdrant_results, qdrant_latency = run_backend(qdrant_faq_db, queries, args.score_threshold, args.limit, args.repeat)
+    local_results, local_latency = run_backend(local_faq_db, queries, args.score_threshold, args.limit, args.repeat)
+
+    report = {
+        "questions": len(queries),
+        "score_threshold": args.score_threshold,
+        "limit": args.limit,
+        "qdrant": qdrant_latency,
+        "local": {**local_latency, "index_load_s": round(local_load_time, 3)},
+        "agreement": compare_results(qdrant_results, local_results),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
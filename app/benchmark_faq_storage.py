@@ -0,0 +1,148 @@
+"""Compares recall, memory and latency of the FAQ vector storage modes (float32, int8, binary).
+
+Hit rate and MRR are computed on the ground truth questions at the server's score
+threshold and limit, the latency per search is measured with the embeddings
+computed up front. The local index is always compared, with --qdrant every mode
+is also loaded into a temporary Qdrant collection with its quantization config.
+Run from the root folder with Qdrant running: python app/benchmark_faq_storage.py
+"""
+import os
+import json
+import argparse
+from time import perf_counter
+import numpy as np
+from qdrant_client import models
+from faq_repository import FaqRepository
+from faq_storage import FaqVectorStorage
+from local_faq_index import LocalFaqIndex
+from embedding_cache import EmbeddingCache
+from evaluate_retrieval import candidate_ranks
+from benchmark_faq_backends import latency_stats, compare_results
+
+
+def run_searches(search, queries, repeat):
+    results, latencies = [], []
+    for _ in range(repeat):
+        results = []
+        for country, vector in queries:
+            start_time = perf_counter()
+            results.append(search(vector, country))
+            latencies.append(perf_counter() - start_time)
+    return results, latency_stats(latencies)
+
+
+def recall(results, ground_truth_ids, limit):
+    # The searches already applied the score threshold and the limit.
+    ranks, _ = candidate_ranks(results, ground_truth_ids, limit)
+    found = ranks < limit
+    return {"hit_rate": float(found.mean()), "mrr": float(np.where(found, 1.0 / (ranks + 1), 0.0).mean())}
+
+
+def compare_to_float32(modes):
+    # Differences of every mode to the float32 baseline, memory as a ratio.
+    if "float32" not in modes:
+        return
+    baseline = modes["float32"]
+    for mode in modes.values():
+        mode["vs_float32"] = {
+            "hit_rate": round(mode["hit_rate"] - baseline["hit_rate"], 4),
+            "mrr": round(mode["mrr"] - baseline["mrr"], 4),
+            "p95_ms": round(mode["latency"]["p95_ms"] - baseline["latency"]["p95_ms"], 3),
+            "memory_ratio": {key: round(value / baseline["memory_bytes"][key], 3) if baseline["memory_bytes"][key] else None
+                             for key, value in mode["memory_bytes"].items()},
+        }
+
+
+def qdrant_memory(storage, points, dimensions):
+    # Estimated vector bytes in RAM and on disk, without the HNSW graph and payloads.
+    original_bytes = points * dimensions * 4
+    quantized_bytes = {"float32": 0, "int8": points * dimensions, "binary": points * dimensions // 8}[storage.mode]
+    on_disk = storage.on_disk and storage.quantized
+    return {"ram": quantized_bytes + (0 if on_disk else original_bytes), "disk": original_bytes if on_disk else 0}
+
+
+def create_benchmark_collection(qd_client, collection_name, storage, index, batch_size=256):
+    if qd_client.collection_exists(collection_name=collection_name):
+        qd_client.delete_collection(collection_name=collection_name)
+    qd_client.create_collection(
+        collection_name=collection_name,
+        vectors_config=storage.vectors_config(index.vectors.shape[1]),
+        quantization_config=storage.quantization_config(),
+        hnsw_config=storage.hnsw_config(),
+    )
+    qd_client.create_payload_index(collection_name=collection_name, field_name="country", field_schema="keyword")
+    for start in range(0, len(index), batch_size):
+        qd_client.upsert(collection_name=collection_name, wait=True, points=[
+            models.PointStruct(id=index.ids[i].item(), vector=index.vectors[i].tolist(), payload=index.payloads[i])
+            for i in range(start, min(start + batch_size, len(index)))
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ground-truth", default="notebooks/evaluation_ground_truth.json")
+    parser.add_argument("--questions", type=int, default=None, help="use only the first N questions")
+    parser.add_argument("--score-threshold", type=float, default=0.7)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="passes over all questions per mode")
+    parser.add_argument("--modes", default=",".join(FaqVectorStorage.MODES))
+    parser.add_argument("--index-file", default=None, help="FAQ vectors exported with local_faq_index.py, loaded from Qdrant otherwise")
+    parser.add_argument("--qdrant", action="store_true", help="also compare temporary Qdrant collections per mode")
+    parser.add_argument("--report", default="tmp_datastore/faq_storage_report.json")
+    args = parser.parse_args()
+
+    with open(args.ground_truth) as f:
+        ground_truth = json.load(f)[:args.questions]
+    ground_truth_ids = [record["ground_truth_faq_id"] for record in ground_truth]
+
+    qd_server = os.environ.get("QD_SERVER", "localhost:6333")
+    faq_db = FaqRepository(qd_server, "courier_faq", embedding_cache=EmbeddingCache(FaqRepository.EMBEDDING_DIMENSIONALITY, max_entries=len(ground_truth)))
+    vectors = faq_db.embed_questions([record["generated_question"] for record in ground_truth])
+    queries = [(record["ground_truth_courier"]["country"], vector) for record, vector in zip(ground_truth, vectors)]
+
+    float32 = FaqVectorStorage("float32")
+    if args.index_file:
+        base_index = LocalFaqIndex.load(args.index_file, storage=float32)
+    else:
+        base_index = LocalFaqIndex.from_qdrant(faq_db.qd_client, "courier_faq", storage=float32)
+
+    report = {"questions": len(queries), "points": len(base_index), "score_threshold": args.score_threshold, "limit": args.limit, "local": {}, "qdrant": {}}
+    baseline = {}
+    for mode in args.modes.split(","):
+        storage = FaqVectorStorage(mode)
+        index = LocalFaqIndex(base_index.ids, base_index.vectors, base_index.payloads, storage)
+        results, latency = run_searches(lambda vector, country: index.search(vector, country, args.score_threshold, args.limit),
+                                        queries, args.repeat)
+        baseline.setdefault("local", results)
+        report["local"][mode] = {
+            **recall(results, ground_truth_ids, args.limit),
+            "latency": latency,
+            "memory_bytes": index.memory_usage(),
+            "agreement_with_first_mode": compare_results(baseline["local"], results),
+        }
+
+        if args.qdrant:
+            collection_name = f"courier_faq_benchmark_{mode}"
+            create_benchmark_collection(faq_db.qd_client, collection_name, storage, base_index)
+            mode_db = FaqRepository(qd_server, collection_name, backend="qdrant", storage=storage)
+            results, latency = run_searches(lambda vector, country: mode_db.search_hits(None, country, args.score_threshold, args.limit, query_vector=vector),
+                                            queries, args.repeat)
+            baseline.setdefault("qdrant", results)
+            report["qdrant"][mode] = {
+                **recall(results, ground_truth_ids, args.limit),
+                "latency": latency,
+                "memory_bytes": qdrant_memory(storage, len(base_index), base_index.vectors.shape[1]),
+                "agreement_with_first_mode": compare_results(baseline["qdrant"], results),
+            }
+            faq_db.qd_client.delete_collection(collection_name=collection_name)
+
+    compare_to_float32(report["local"])
+    compare_to_float32(report["qdrant"])
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
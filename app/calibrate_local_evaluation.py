@@ -0,0 +1,80 @@
+"""Calibrates the thresholds of the local relevance evaluator against LLM evaluated conversations.
+
+The question/answer similarity of every conversation evaluated by the LLM judge is
+computed once, then all threshold pairs of the grid are scored by their agreement
+with the LLM relevance. Prints the LOCAL_EVALUATION_THRESHOLDS value to use.
+Run from the root folder with Postgres running: python app/calibrate_local_evaluation.py
+"""
+import json
+import argparse
+import numpy as np
+from fastembed import TextEmbedding
+from faq_repository import FaqRepository
+from conversation_repository import ConversationRepository
+
+LABELS = ("NON_RELEVANT", "PARTLY_RELEVANT", "RELEVANT")
+
+
+def similarities(questions, answers, batch_size=256):
+    model = TextEmbedding(FaqRepository.MODEL_HANDLE)
+    question_vectors = np.array(list(model.embed(questions, batch_size=batch_size)), dtype=np.float32)
+    answer_vectors = np.array(list(model.embed(answers, batch_size=batch_size)), dtype=np.float32)
+    norms = np.linalg.norm(question_vectors, axis=1) * np.linalg.norm(answer_vectors, axis=1)
+    return np.einsum("ij,ij->i", question_vectors, answer_vectors) / np.maximum(norms, 1e-12)
+
+
+def calibrate(similarity, labels, grid):
+    # labels are indexes into LABELS. For every (relevant, partly_relevant) threshold
+    # pair with partly_relevant <= relevant, the predicted label is the number of
+    # thresholds the similarity reaches.
+    relevant, partly_relevant = np.meshgrid(grid, grid, indexing="ij")
+    valid = partly_relevant <= relevant
+    predicted = (similarity[None, None, :] >= relevant[..., None]).astype(np.int64) \
+        + (similarity[None, None, :] >= partly_relevant[..., None]).astype(np.int64)
+    accuracy = np.where(valid, (predicted == labels[None, None, :]).mean(axis=2), -1.0)
+    i, j = np.unravel_index(np.argmax(accuracy), accuracy.shape)
+    return float(relevant[i, j]), float(partly_relevant[i, j]), float(accuracy[i, j]), predicted[i, j]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--limit", type=int, default=5000, help="number of most recent LLM evaluated conversations")
+    parser.add_argument("--min", type=float, default=0.3, help="lowest threshold of the grid")
+    parser.add_argument("--max", type=float, default=0.95, help="highest threshold of the grid")
+    parser.add_argument("--step", type=float, default=0.01)
+    parser.add_argument("--report", default=None, help="write the calibration to this JSON file")
+    args = parser.parse_args()
+
+    conversations = ConversationRepository().get_llm_evaluated_conversations(limit=args.limit)
+    if not conversations:
+        print("No LLM evaluated conversations found.")
+        return
+    print(f"Calibrating on {len(conversations)} LLM evaluated conversations")
+
+    similarity = similarities([c["question"] for c in conversations], [c["answer"] for c in conversations])
+    labels = np.array([LABELS.index(c["relevance"]) for c in conversations])
+    grid = np.round(np.arange(args.min, args.max + args.step / 2, args.step), 4)
+    relevant, partly_relevant, accuracy, predicted = calibrate(similarity, labels, grid)
+
+    confusion = {
+        llm_label: {label: int(np.sum((labels == i) & (predicted == j))) for j, label in enumerate(LABELS)}
+        for i, llm_label in enumerate(LABELS)
+    }
+    print(f"Agreement with the LLM judge: {accuracy:.3f}")
+    for llm_label, row in confusion.items():
+        print(f"  LLM {llm_label:16s} -> local {row}")
+    print(f"LOCAL_EVALUATION_THRESHOLDS={relevant:g},{partly_relevant:g}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({
+                "conversations": len(conversations),
+                "relevant_threshold": relevant,
+                "partly_relevant_threshold": partly_relevant,
+                "accuracy": accuracy,
+                "confusion": confusion,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import os
+import re
+import tiktoken
+import metrics
+
+
+class ContextAssembler:
+    """Builds the FAQ CONTEXT of the answer prompt within a token budget.
+
+    FAQ entries are taken best score first. Entries with the same answer as an
+    entry already in the context, or with nearly the same words, are dropped.
+    Entries that don't fit in the remaining budget are skipped.
+    """
+    token_budget: int
+    similarity_threshold: float
+
+    TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+    SIMILARITY_THRESHOLD = float(os.getenv("CONTEXT_DEDUPE_SIMILARITY", "0.8"))
+    # Tokenizer of gpt-4o and gpt-4o-mini
+    ENCODING = "o200k_base"
+
+    def __init__(self, token_budget=None, similarity_threshold=None):
+        self.token_budget = token_budget or self.TOKEN_BUDGET
+        self.similarity_threshold = similarity_threshold or self.SIMILARITY_THRESHOLD
+        self.encoding = tiktoken.get_encoding(self.ENCODING)
+
+    def count_tokens(self, text):
+        return len(self.encoding.encode(text))
+
+    @staticmethod
+    def format_entry(doc):
+        return f"country: {doc['country']}\nquestion: {doc['question']}\nanswer: {doc['answer']}\n\n"
+
+    @staticmethod
+    def _words(doc):
+        return set(re.findall(r"\w+", f"{doc['question']} {doc['answer']}".casefold()))
+
+    def _is_redundant(self, doc, selected):
+        answer = " ".join(doc['answer'].split()).casefold()
+        words = self._words(doc)
+        for selected_doc, selected_answer, selected_words in selected:
+            if answer == selected_answer:
+                return True
+            union = words | selected_words
+            if union and len(words & selected_words) / len(union) >= self.similarity_threshold:
+                return True
+        return False
+
+    def assemble(self, related_faq):
+        # Returns the context and the number of tokens saved compared to using all FAQ entries.
+        entries = [(doc, self.format_entry(doc)) for doc in related_faq]
+        entry_tokens = [self.count_tokens(entry) for _, entry in entries]
+
+        # vector_search adds the score, without it the retrieval order is kept
+        order = sorted(range(len(entries)), key=lambda i: -entries[i][0].get("score", 0.0))
+        selected, parts, budget = [], [], self.token_budget
+        for i in order:
+            doc, entry = entries[i]
+            if self._is_redundant(doc, selected) or entry_tokens[i] > budget:
+                continue
+            selected.append((doc, " ".join(doc['answer'].split()).casefold(), self._words(doc)))
+            parts.append(entry)
+            budget -= entry_tokens[i]
+
+        tokens_saved = sum(entry_tokens) - (self.token_budget - budget)
+        metrics.inc("context_tokens_saved_total", tokens_saved, help_text="Prompt tokens saved by the context assembler")
+        metrics.inc("context_faq_entries_dropped_total", len(entries) - len(parts), help_text="FAQ entries left out of the prompt context")
+        return "".join(parts), tokens_saved
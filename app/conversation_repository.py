@@ -1,18 +1,146 @@
 import os
+import json
+import base64
+import logging
+import threading
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
+from db_pool import ConnectionPool
+from time import perf_counter, monotonic
+import metrics
+import stage_timer
+
+logger = logging.getLogger('gunicorn.error')
 
 class ConversationRepository:
 
-    RUN_TIMEZONE_CHECK = os.getenv('RUN_TIMEZONE_CHECK', '1') == '1'
+    APP_ENV = os.getenv("APP_ENV", "development")
+    # check_timezone() inserts and deletes a test row, the servers skip it in production
+    RUN_TIMEZONE_CHECK = os.getenv('RUN_TIMEZONE_CHECK', '0' if APP_ENV == "production" else '1') == '1'
 
     TZ_INFO = os.getenv("TZ", "Europe/Berlin")
     tz = ZoneInfo(TZ_INFO)
 
+    POOL_SIZE = int(os.getenv("POSTGRES_POOL_SIZE", "10"))
+    POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", "5"))
+
+    # answer_data keys stored with every conversation, with defaults for optional ones
+    REQUIRED = object()
+    CONVERSATION_FIELDS = [
+        ("answer", REQUIRED),
+        ("model_used", REQUIRED),
+        ("response_time", REQUIRED),
+        ("relevance", REQUIRED),
+        ("relevance_explanation", REQUIRED),
+        ("prompt_tokens", REQUIRED),
+        ("completion_tokens", REQUIRED),
+        ("total_tokens", REQUIRED),
+        ("eval_prompt_tokens", REQUIRED),
+        ("eval_completion_tokens", REQUIRED),
+        ("eval_total_tokens", REQUIRED),
+        ("openai_cost", REQUIRED),
+        ("cache_hit", False),
+        ("time_to_first_token", None),
+        ("context_tokens_saved", 0),
+        ("cached_tokens", 0),
+        ("eval_cached_tokens", 0),
+        ("fast_path", False),
+        ("evaluation_policy", "full"),
+    ]
+    CONVERSATION_COLUMNS = ["id", "question", "timestamp"] + [field for field, _ in CONVERSATION_FIELDS]
+
+    INSERT_CONVERSATION_SQL = "INSERT INTO conversations ({}) VALUES ({})".format(
+        ", ".join(CONVERSATION_COLUMNS),
+        ", ".join(f"${i + 1}" for i in range(len(CONVERSATION_COLUMNS))),
+    )
+
+    # Per-minute rollups read by the Grafana dashboard, refreshed by refresh_rollups().
+    # Buckets of the last ROLLUP_LOOKBACK_MINUTES are recomputed on every refresh, which
+    # also picks up relevance updates of answers evaluated in the background.
+    ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "30"))
+    ROLLUP_LOOKBACK_MINUTES = int(os.getenv("ROLLUP_LOOKBACK_MINUTES", "15"))
+
+    CONVERSATION_ROLLUP_COLUMNS = [
+        ("conversations", "COUNT(*)"),
+        ("relevant", "COUNT(*) FILTER (WHERE relevance = 'RELEVANT')"),
+        ("partly_relevant", "COUNT(*) FILTER (WHERE relevance = 'PARTLY_RELEVANT')"),
+        ("non_relevant", "COUNT(*) FILTER (WHERE relevance = 'NON_RELEVANT')"),
+        ("pending", "COUNT(*) FILTER (WHERE relevance = 'PENDING')"),
+        ("cache_hits", "COUNT(*) FILTER (WHERE cache_hit)"),
+        ("fast_paths", "COUNT(*) FILTER (WHERE fast_path)"),
+        ("llm_evaluations", "COUNT(*) FILTER (WHERE evaluation_policy IN ('full', 'sampled', 'low_score', 'flagged'))"),
+        ("local_evaluations", "COUNT(*) FILTER (WHERE evaluation_policy = 'local')"),
+        ("prompt_tokens", "SUM(prompt_tokens)"),
+        ("completion_tokens", "SUM(completion_tokens)"),
+        ("total_tokens", "SUM(total_tokens)"),
+        ("eval_total_tokens", "SUM(eval_total_tokens)"),
+        ("cached_tokens", "SUM(cached_tokens)"),
+        ("eval_prompt_tokens", "SUM(eval_prompt_tokens)"),
+        ("eval_cached_tokens", "SUM(eval_cached_tokens)"),
+        ("context_tokens_saved", "SUM(context_tokens_saved)"),
+        ("openai_cost", "SUM(openai_cost)"),
+        ("response_time_sum", "SUM(response_time)"),
+        ("response_time_p50", "PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY response_time)"),
+        ("response_time_p95", "PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY response_time)"),
+        ("response_time_p99", "PERCENTILE_CONT(0.99) WITHIN GROUP (ORDER BY response_time)"),
+        ("time_to_first_token_p95", "PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY time_to_first_token)"),
+    ]
+    FEEDBACK_ROLLUP_COLUMNS = [
+        ("thumbs_up", "COUNT(*) FILTER (WHERE feedback > 0)"),
+        ("thumbs_down", "COUNT(*) FILTER (WHERE feedback < 0)"),
+    ]
+    STAGE_ROLLUP_COLUMNS = [
+        ("count", "COUNT(*)"),
+        ("duration_sum", "SUM(s.duration)"),
+        ("duration_p95", "PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY s.duration)"),
+    ]
+
+    # All-time counters of /stats in stats_counters, incremented in the transaction that
+    # stores the conversation, evaluation or feedback, so reading them doesn't depend on
+    # the table sizes. Relevance counters are named "relevance:<relevance>".
+    # reconcile_stats() recomputes them from the tables every STATS_RECONCILE_INTERVAL
+    # seconds and corrects drift, e.g. from rows changed outside of this repository.
+    STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "5"))
+    STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", "3600"))
+    CONVERSATION_STATS_COLUMNS = [
+        ("conversations", "COUNT(*)"),
+        ("cache_hits", "COUNT(*) FILTER (WHERE cache_hit)"),
+        ("fast_paths", "COUNT(*) FILTER (WHERE fast_path)"),
+        ("prompt_tokens", "SUM(prompt_tokens)"),
+        ("completion_tokens", "SUM(completion_tokens)"),
+        ("total_tokens", "SUM(total_tokens)"),
+        ("cached_tokens", "SUM(cached_tokens)"),
+        ("eval_prompt_tokens", "SUM(eval_prompt_tokens)"),
+        ("eval_completion_tokens", "SUM(eval_completion_tokens)"),
+        ("eval_total_tokens", "SUM(eval_total_tokens)"),
+        ("openai_cost", "SUM(openai_cost)"),
+    ]
+    FEEDBACK_STATS_COLUMNS = FEEDBACK_ROLLUP_COLUMNS
+    EVALUATION_STATS_FIELDS = ["eval_prompt_tokens", "eval_completion_tokens", "eval_total_tokens"]
+
+    # Conversation history pages are ordered by (timestamp, id), newest first, and continue
+    # after the (timestamp, id) of the previous page's last row, so every page is an index
+    # range scan no matter how deep it is. The filters have their own composite indexes.
+    CONVERSATIONS_PAGE_SIZE = int(os.getenv("CONVERSATIONS_PAGE_SIZE", "50"))
+    CONVERSATIONS_MAX_PAGE_SIZE = int(os.getenv("CONVERSATIONS_MAX_PAGE_SIZE", "500"))
+    # (index name, table and columns)
+    INDEXES = [
+        ("conversations_timestamp_id_idx", "conversations (timestamp, id)"),
+        ("conversations_relevance_timestamp_id_idx", "conversations (relevance, timestamp, id)"),
+        ("conversations_model_timestamp_id_idx", "conversations (model_used, timestamp, id)"),
+        ("feedback_timestamp_idx", "feedback (timestamp)"),
+        # latest feedback of a conversation
+        ("feedback_conversation_timestamp_idx", "feedback (conversation_id, timestamp, id)"),
+    ]
+
     def __init__(self):
-        if self.RUN_TIMEZONE_CHECK: self.check_timezone()
+        # Connections are opened on first use, per process (see ConnectionPool).
+        self.pool = ConnectionPool(self._get_db_connection, max_size=self.POOL_SIZE, timeout=self.POOL_TIMEOUT)
+        self._stats = None
+        self._stats_time = 0.0
+        self._stats_lock = threading.Lock()
 
 
     def _get_db_connection(self):
@@ -26,9 +154,13 @@ class ConversationRepository:
 
 
     def init_db(self):
-        conn = self._get_db_connection()
-        try:
+        with self.pool.connection() as conn:
             with conn.cursor() as cur:
+                cur.execute("DROP TABLE IF EXISTS conversation_rollups_minute")
+                cur.execute("DROP TABLE IF EXISTS feedback_rollups_minute")
+                cur.execute("DROP TABLE IF EXISTS stage_rollups_minute")
+                cur.execute("DROP TABLE IF EXISTS stats_counters")
+                cur.execute("DROP TABLE IF EXISTS conversation_stages")
                 cur.execute("DROP TABLE IF EXISTS feedback")
                 cur.execute("DROP TABLE IF EXISTS conversations")
 
@@ -48,7 +180,14 @@ class ConversationRepository:
                         eval_completion_tokens INTEGER NOT NULL,
                         eval_total_tokens INTEGER NOT NULL,
                         openai_cost FLOAT NOT NULL,
-                        timestamp TIMESTAMP WITH TIME ZONE NOT NULL
+                        timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+                        cache_hit BOOLEAN NOT NULL DEFAULT FALSE,
+                        time_to_first_token FLOAT,
+                        context_tokens_saved INTEGER NOT NULL DEFAULT 0,
+                        cached_tokens INTEGER NOT NULL DEFAULT 0,
+                        eval_cached_tokens INTEGER NOT NULL DEFAULT 0,
+                        fast_path BOOLEAN NOT NULL DEFAULT FALSE,
+                        evaluation_policy TEXT NOT NULL DEFAULT 'full'
                     )
                 """)
                 cur.execute("""
@@ -59,143 +198,540 @@ class ConversationRepository:
                         timestamp TIMESTAMP WITH TIME ZONE NOT NULL
                     )
                 """)
+                cur.execute("""
+                    CREATE TABLE conversation_stages (
+                        conversation_id TEXT REFERENCES conversations(id) ON DELETE CASCADE,
+                        stage TEXT NOT NULL,
+                        duration FLOAT NOT NULL,
+                        PRIMARY KEY (conversation_id, stage)
+                    )
+                """)
+
+                for name, definition in self.INDEXES:
+                    cur.execute(f"CREATE INDEX {name} ON {definition}")
+
+                cur.execute("""
+                    CREATE TABLE conversation_rollups_minute (
+                        bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+                        model_used TEXT NOT NULL,
+                        conversations INTEGER NOT NULL,
+                        relevant INTEGER NOT NULL,
+                        partly_relevant INTEGER NOT NULL,
+                        non_relevant INTEGER NOT NULL,
+                        pending INTEGER NOT NULL,
+                        cache_hits INTEGER NOT NULL,
+                        fast_paths INTEGER NOT NULL,
+                        llm_evaluations INTEGER NOT NULL,
+                        local_evaluations INTEGER NOT NULL,
+                        prompt_tokens BIGINT NOT NULL,
+                        completion_tokens BIGINT NOT NULL,
+                        total_tokens BIGINT NOT NULL,
+                        eval_total_tokens BIGINT NOT NULL,
+                        cached_tokens BIGINT NOT NULL,
+                        eval_prompt_tokens BIGINT NOT NULL,
+                        eval_cached_tokens BIGINT NOT NULL,
+                        context_tokens_saved BIGINT NOT NULL,
+                        openai_cost FLOAT NOT NULL,
+                        response_time_sum FLOAT NOT NULL,
+                        response_time_p50 FLOAT NOT NULL,
+                        response_time_p95 FLOAT NOT NULL,
+                        response_time_p99 FLOAT NOT NULL,
+                        time_to_first_token_p95 FLOAT,
+                        PRIMARY KEY (bucket, model_used)
+                    )
+                """)
+                cur.execute("""
+                    CREATE TABLE feedback_rollups_minute (
+                        bucket TIMESTAMP WITH TIME ZONE PRIMARY KEY,
+                        thumbs_up INTEGER NOT NULL,
+                        thumbs_down INTEGER NOT NULL
+                    )
+                """)
+                cur.execute("""
+                    CREATE TABLE stage_rollups_minute (
+                        bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+                        stage TEXT NOT NULL,
+                        count INTEGER NOT NULL,
+                        duration_sum FLOAT NOT NULL,
+                        duration_p95 FLOAT NOT NULL,
+                        PRIMARY KEY (bucket, stage)
+                    )
+                """)
+                cur.execute("""
+                    CREATE TABLE stats_counters (
+                        name TEXT PRIMARY KEY,
+                        value DOUBLE PRECISION NOT NULL
+                    )
+                """)
             conn.commit()
-        finally:
-            conn.close()
 
 
-    def save_conversation(self, conversation_id, question, answer_data, timestamp=None):
+    def save_conversation(self, conversation_id, question, answer_data, timestamp=None, stages=None):
+        # stages is an optional {stage name: seconds} dict stored in conversation_stages,
+        # together with the duration of this insert as "save_conversation".
         if timestamp is None:
             timestamp = datetime.now(self.tz)
 
-        conn = self._get_db_connection()
-        try:
+        with self.pool.connection() as conn:
             with conn.cursor() as cur:
+                start_time = perf_counter()
+                self.pool.prepare(cur, "insert_conversation", self.INSERT_CONVERSATION_SQL)
+                cur.execute(
+                    "EXECUTE insert_conversation ({})".format(", ".join(["%s"] * len(self.CONVERSATION_COLUMNS))),
+                    self._conversation_row(conversation_id, question, answer_data, timestamp),
+                )
+                save_time = perf_counter() - start_time
+                stage_timer.record("save_conversation", save_time)
+
+                if stages:
+                    execute_values(
+                        cur,
+                        "INSERT INTO conversation_stages (conversation_id, stage, duration) VALUES %s",
+                        [(conversation_id, stage, duration) for stage, duration in {**stages, "save_conversation": save_time}.items()],
+                    )
+
+                self._increment_stats(cur, self._conversation_stats(answer_data))
+            conn.commit()
+
+
+    def save_conversations(self, conversations, timestamp=None):
+        # conversations is a list of (conversation_id, question, answer_data), stored with one multi-row INSERT
+        if not conversations:
+            return
+        if timestamp is None:
+            timestamp = datetime.now(self.tz)
+
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    "INSERT INTO conversations ({}) VALUES %s".format(", ".join(self.CONVERSATION_COLUMNS)),
+                    [self._conversation_row(conversation_id, question, answer_data, timestamp)
+                     for conversation_id, question, answer_data in conversations],
+                    page_size=max(len(conversations), 100),
+                )
+
+                counters = {}
+                for _, _, answer_data in conversations:
+                    for name, value in self._conversation_stats(answer_data).items():
+                        counters[name] = counters.get(name, 0) + value
+                self._increment_stats(cur, counters)
+            conn.commit()
+
+
+    def _conversation_row(self, conversation_id, question, answer_data, timestamp):
+        row = [conversation_id, question, timestamp]
+        for field, default in self.CONVERSATION_FIELDS:
+            row.append(answer_data[field] if default is self.REQUIRED else answer_data.get(field, default))
+        return tuple(row)
+
+
+    def _conversation_stats(self, answer_data):
+        counters = {
+            "conversations": 1,
+            f"relevance:{answer_data['relevance']}": 1,
+            "cache_hits": int(bool(answer_data.get("cache_hit", False))),
+            "fast_paths": int(bool(answer_data.get("fast_path", False))),
+        }
+        for name, expression in self.CONVERSATION_STATS_COLUMNS:
+            if expression.startswith("SUM("):
+                counters[name] = answer_data.get(name, 0)
+        return counters
+
+
+    def _increment_stats(self, cur, counters):
+        # Rows are upserted in name order, so concurrent transactions lock the
+        # counter rows in the same order and can't deadlock.
+        rows = sorted((name, value) for name, value in counters.items() if value)
+        if rows:
+            execute_values(
+                cur,
+                "INSERT INTO stats_counters (name, value) VALUES %s "
+                "ON CONFLICT (name) DO UPDATE SET value = stats_counters.value + EXCLUDED.value",
+                rows,
+            )
+
+
+    def update_evaluation(self, conversation_id, eval_data):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                # The previous values are returned to move the counters from the old relevance to the new one.
                 cur.execute(
                     """
-                    INSERT INTO conversations 
-                    (id, question, answer, model_used, response_time, relevance, 
-                    relevance_explanation, prompt_tokens, completion_tokens, total_tokens, 
-                    eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, openai_cost, timestamp)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    UPDATE conversations c
+                    SET relevance = %s, relevance_explanation = %s,
+                    eval_prompt_tokens = %s, eval_completion_tokens = %s, eval_total_tokens = %s,
+                    eval_cached_tokens = %s, openai_cost = c.openai_cost + %s,
+                    evaluation_policy = %s
+                    FROM (SELECT id, relevance, eval_prompt_tokens, eval_completion_tokens, eval_total_tokens
+                          FROM conversations WHERE id = %s FOR UPDATE) old
+                    WHERE c.id = old.id
+                    RETURNING old.relevance, old.eval_prompt_tokens, old.eval_completion_tokens, old.eval_total_tokens
                     """,
                     (
+                        eval_data["relevance"],
+                        eval_data["relevance_explanation"],
+                        eval_data["eval_prompt_tokens"],
+                        eval_data["eval_completion_tokens"],
+                        eval_data["eval_total_tokens"],
+                        eval_data.get("eval_cached_tokens", 0),
+                        eval_data["eval_openai_cost"],
+                        eval_data.get("evaluation_policy", "full"),
                         conversation_id,
-                        question,
-                        answer_data["answer"],
-                        answer_data["model_used"],
-                        answer_data["response_time"],
-                        answer_data["relevance"],
-                        answer_data["relevance_explanation"],
-                        answer_data["prompt_tokens"],
-                        answer_data["completion_tokens"],
-                        answer_data["total_tokens"],
-                        answer_data["eval_prompt_tokens"],
-                        answer_data["eval_completion_tokens"],
-                        answer_data["eval_total_tokens"],
-                        answer_data["openai_cost"],
-                        timestamp
                     ),
                 )
+                old = cur.fetchone()
+                if old is not None:
+                    new_relevance = f"relevance:{eval_data['relevance']}"
+                    counters = {f"relevance:{old[0]}": -1, "openai_cost": eval_data["eval_openai_cost"]}
+                    counters[new_relevance] = counters.get(new_relevance, 0) + 1
+                    for name, old_value in zip(self.EVALUATION_STATS_FIELDS, old[1:]):
+                        counters[name] = eval_data[name] - old_value
+                    self._increment_stats(cur, counters)
             conn.commit()
-        finally:
-            conn.close()
 
 
     def save_feedback(self, conversation_id, feedback, timestamp=None):
         if timestamp is None:
             timestamp = datetime.now(self.tz)
 
-        conn = self._get_db_connection()
-        try:
+        with self.pool.connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     "INSERT INTO feedback (conversation_id, feedback, timestamp) VALUES (%s, %s, COALESCE(%s, CURRENT_TIMESTAMP))",
                     (conversation_id, feedback, timestamp),
                 )
+                self._increment_stats(cur, {"thumbs_up": int(feedback > 0), "thumbs_down": int(feedback < 0)})
             conn.commit()
+
+
+    def create_indexes(self):
+        # Adds the indexes of INDEXES missing in a database created by an older init_db(),
+        # run once with migrate_db.py. CREATE INDEX CONCURRENTLY doesn't block writes but
+        # can't run in a transaction, so it uses its own autocommit connection.
+        conn = self._get_db_connection()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                for name, definition in self.INDEXES:
+                    cur.execute("""
+                        SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                        WHERE c.relname = %s
+                    """, (name,))
+                    row = cur.fetchone()
+                    if row is not None and row[0]:
+                        print(f"Index {name} exists.")
+                        continue
+                    if row is not None:
+                        # left invalid by an interrupted concurrent build
+                        print(f"Dropping invalid index {name}.")
+                        cur.execute(f"DROP INDEX CONCURRENTLY {name}")
+                    print(f"Creating index {name} on {definition}.")
+                    cur.execute(f"CREATE INDEX CONCURRENTLY {name} ON {definition}")
         finally:
             conn.close()
 
 
     def get_recent_conversations(self, limit=5, relevance=None):
-        conn = self._get_db_connection()
-        try:
+        return self.get_conversations(limit=limit, relevance=relevance)[0]
+
+
+    def get_conversations(self, limit=None, after=None, relevance=None, model=None, since=None, until=None):
+        # Returns (rows, next) with the conversations newest first, each with its latest
+        # feedback. after and next are the (timestamp, id) of the last row of a page,
+        # next is None on the last page. since and until are timestamps, until exclusive.
+        if limit is None:
+            limit = self.CONVERSATIONS_PAGE_SIZE
+        if limit < 1:
+            raise ValueError("'limit' must be a positive integer")
+        limit = min(limit, self.CONVERSATIONS_MAX_PAGE_SIZE)
+        conditions, params = [], []
+        if after is not None:
+            conditions.append("(c.timestamp, c.id) < (%s, %s)")
+            params += list(after)
+        if relevance:
+            conditions.append("c.relevance = %s")
+            params.append(relevance)
+        if model:
+            conditions.append("c.model_used = %s")
+            params.append(model)
+        if since is not None:
+            conditions.append("c.timestamp >= %s")
+            params.append(since)
+        if until is not None:
+            conditions.append("c.timestamp < %s")
+            params.append(until)
+
+        with self.pool.connection() as conn:
             with conn.cursor(cursor_factory=DictCursor) as cur:
-                query = """
-                    SELECT c.*, f.feedback
+                cur.execute(
+                    """
+                    SELECT c.*, f.feedback, f.timestamp AS feedback_timestamp
                     FROM conversations c
-                    LEFT JOIN feedback f ON c.id = f.conversation_id
-                """
-                if relevance:
-                    query += f" WHERE c.relevance = '{relevance}'"
-                query += " ORDER BY c.timestamp DESC LIMIT %s"
+                    LEFT JOIN LATERAL (
+                        SELECT feedback, timestamp FROM feedback
+                        WHERE conversation_id = c.id
+                        ORDER BY timestamp DESC, id DESC
+                        LIMIT 1
+                    ) f ON TRUE
+                    {}
+                    ORDER BY c.timestamp DESC, c.id DESC
+                    LIMIT %s
+                    """.format("WHERE " + " AND ".join(conditions) if conditions else ""),
+                    params + [limit + 1],
+                )
+                rows = cur.fetchall()
 
-                cur.execute(query, (limit,))
-                return cur.fetchall()
-        finally:
-            conn.close()
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, (rows[-1]["timestamp"], rows[-1]["id"])
 
 
-    def get_feedback_stats(self):
-        conn = self._get_db_connection()
+    def get_conversations_page(self, limit=None, cursor=None, relevance=None, model=None, since=None, until=None):
+        # JSON ready page for the /conversations endpoint. limit, cursor, since and until
+        # are strings, ValueError is raised for invalid ones.
+        rows, next_key = self.get_conversations(
+            limit=self._parse_limit(limit) if limit is not None else None,
+            after=self.decode_cursor(cursor) if cursor else None,
+            relevance=relevance,
+            model=model,
+            since=self._parse_timestamp(since) if since else None,
+            until=self._parse_timestamp(until) if until else None,
+        )
+        conversations = []
+        for row in rows:
+            conversation = dict(row)
+            for key in ("timestamp", "feedback_timestamp"):
+                if conversation[key] is not None:
+                    conversation[key] = conversation[key].isoformat()
+            conversations.append(conversation)
+        return {"conversations": conversations, "next_cursor": self.encode_cursor(next_key) if next_key else None}
+
+
+    @staticmethod
+    def _parse_limit(value):
+        if not value.isdigit() or int(value) < 1:
+            raise ValueError("'limit' must be a positive integer")
+        return int(value)
+
+
+    def _parse_timestamp(self, value):
+        # ISO 8601, timestamps without a timezone are in TZ
+        timestamp = datetime.fromisoformat(value)
+        return timestamp if timestamp.tzinfo is not None else timestamp.replace(tzinfo=self.tz)
+
+
+    @staticmethod
+    def encode_cursor(key):
+        timestamp, conversation_id = key
+        return base64.urlsafe_b64encode(json.dumps([timestamp.isoformat(), conversation_id]).encode("utf-8")).decode("ascii")
+
+
+    def decode_cursor(self, cursor):
         try:
+            timestamp, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            return self._parse_timestamp(timestamp), str(conversation_id)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+    def get_conversation(self, conversation_id):
+        with self.pool.connection() as conn:
             with conn.cursor(cursor_factory=DictCursor) as cur:
-                cur.execute("""
-                    SELECT 
-                        SUM(CASE WHEN feedback > 0 THEN 1 ELSE 0 END) as thumbs_up,
-                        SUM(CASE WHEN feedback < 0 THEN 1 ELSE 0 END) as thumbs_down
-                    FROM feedback
-                """)
+                cur.execute("SELECT * FROM conversations WHERE id = %s", (conversation_id,))
                 return cur.fetchone()
-        finally:
-            conn.close()
+
+
+    def get_llm_evaluated_conversations(self, limit=1000):
+        # Conversations with a relevance from the LLM judge, the labels used to
+        # calibrate the local relevance evaluator.
+        with self.pool.connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute(
+                    """
+                    SELECT id, question, answer, relevance
+                    FROM conversations
+                    WHERE evaluation_policy IN ('full', 'sampled', 'low_score', 'flagged')
+                    AND relevance IN ('RELEVANT', 'PARTLY_RELEVANT', 'NON_RELEVANT')
+                    ORDER BY timestamp DESC LIMIT %s
+                    """,
+                    (limit,),
+                )
+                return cur.fetchall()
+
+
+    def get_feedback_stats(self):
+        return self.get_stats()["feedback"]
+
+
+    def _stats_snapshot(self):
+        # Counters read from Postgres at most every STATS_CACHE_TTL seconds per process.
+        with self._stats_lock:
+            if self._stats is None or monotonic() - self._stats_time >= self.STATS_CACHE_TTL:
+                with self.pool.connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT name, value FROM stats_counters")
+                        self._stats = dict(cur.fetchall())
+                self._stats_time = monotonic()
+            return dict(self._stats)
+
+
+    def get_stats(self):
+        counters = self._stats_snapshot()
+        count = lambda name: int(round(counters.get(name, 0)))
+        return {
+            "conversations": count("conversations"),
+            "cache_hits": count("cache_hits"),
+            "fast_paths": count("fast_paths"),
+            "relevance": {name.split(":", 1)[1]: int(round(value)) for name, value in sorted(counters.items())
+                          if name.startswith("relevance:") and round(value)},
+            "feedback": {"thumbs_up": count("thumbs_up"), "thumbs_down": count("thumbs_down")},
+            "tokens": {name: count(name) for name, _ in self.CONVERSATION_STATS_COLUMNS if name.endswith("_tokens")},
+            "openai_cost": round(counters.get("openai_cost", 0.0), 6),
+        }
+
+
+    def reconcile_stats(self):
+        # Compares the counters with the tables and adds the difference to the counters.
+        # Both are read in one REPEATABLE READ snapshot, which contains either all or none
+        # of the changes of a transaction, so no writes are blocked. The difference is
+        # added in a second transaction and keeps the increments committed in between.
+        # Returns the corrected drift, None when another process is reconciling.
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(hashtext('stats_counters'))")
+                if not cur.fetchone()[0]:
+                    conn.rollback()
+                    return None
+                conn.commit()
+                try:
+                    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+                    expected = {}
+                    for table, columns in [("conversations", self.CONVERSATION_STATS_COLUMNS), ("feedback", self.FEEDBACK_STATS_COLUMNS)]:
+                        cur.execute("SELECT {} FROM {}".format(", ".join(expression for _, expression in columns), table))
+                        expected.update(zip([name for name, _ in columns], cur.fetchone()))
+                    cur.execute("SELECT 'relevance:' || relevance, COUNT(*) FROM conversations GROUP BY relevance")
+                    expected.update(cur.fetchall())
+                    cur.execute("SELECT name, value FROM stats_counters")
+                    current = dict(cur.fetchall())
+                    conn.commit()
+
+                    drift = {}
+                    for name in expected.keys() | current.keys():
+                        difference = float(expected.get(name) or 0) - current.get(name, 0.0)
+                        if abs(difference) > 1e-6:
+                            drift[name] = difference
+                    if drift:
+                        self._increment_stats(cur, drift)
+                        conn.commit()
+                        metrics.inc("stats_counter_corrections_total", len(drift), help_text="Counters of /stats corrected by the reconciliation")
+                        logger.warning(f"Corrected drift of the stats counters: {drift}")
+                finally:
+                    conn.rollback()
+                    cur.execute("SELECT pg_advisory_unlock(hashtext('stats_counters'))")
+                    conn.commit()
+        return drift
+
+
+    def refresh_rollups(self, lookback_minutes=None):
+        # Recomputes the rollup buckets of the last lookback_minutes. Only one process
+        # refreshes at a time, the others skip the run while the advisory lock is held.
+        lookback_minutes = lookback_minutes or self.ROLLUP_LOOKBACK_MINUTES
+
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('conversation_rollups'))")
+                if not cur.fetchone()[0]:
+                    conn.rollback()
+                    return False
+
+                since = "date_trunc('minute', now() - %s * interval '1 minute')"
+                cur.execute(self._rollup_sql(
+                    "conversation_rollups_minute", ["model_used"], self.CONVERSATION_ROLLUP_COLUMNS,
+                    f"FROM conversations WHERE timestamp >= {since}", "timestamp",
+                ), (lookback_minutes,))
+                cur.execute(self._rollup_sql(
+                    "feedback_rollups_minute", [], self.FEEDBACK_ROLLUP_COLUMNS,
+                    f"FROM feedback WHERE timestamp >= {since}", "timestamp",
+                ), (lookback_minutes,))
+                cur.execute(self._rollup_sql(
+                    "stage_rollups_minute", ["s.stage"], self.STAGE_ROLLUP_COLUMNS,
+                    f"FROM conversation_stages s JOIN conversations c ON c.id = s.conversation_id WHERE c.timestamp >= {since}",
+                    "c.timestamp",
+                ), (lookback_minutes,))
+            conn.commit()
+        return True
+
+
+    def _rollup_sql(self, table, keys, columns, source, timestamp_column):
+        key_columns = ["bucket"] + [key.split(".")[-1] for key in keys]
+        return """
+            INSERT INTO {table} ({columns})
+            SELECT date_trunc('minute', {timestamp_column}), {values}
+            {source}
+            GROUP BY {group_by}
+            ON CONFLICT ({key_columns}) DO UPDATE SET {updates}
+        """.format(
+            table=table,
+            columns=", ".join(key_columns + [column for column, _ in columns]),
+            timestamp_column=timestamp_column,
+            values=", ".join(keys + [expression for _, expression in columns]),
+            source=source,
+            group_by=", ".join(str(i + 1) for i in range(len(key_columns))),
+            key_columns=", ".join(key_columns),
+            updates=", ".join(f"{column} = EXCLUDED.{column}" for column, _ in columns),
+        )
+
+
+    def ping(self):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchone()
 
 
     def check_timezone(self):
-        conn = self._get_db_connection()
         try:
-            with conn.cursor() as cur:
-                cur.execute("SHOW timezone;")
-                db_timezone = cur.fetchone()[0]
-                print(f"Database timezone: {db_timezone}")
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SHOW timezone;")
+                    db_timezone = cur.fetchone()[0]
+                    print(f"Database timezone: {db_timezone}")
 
-                cur.execute("SELECT current_timestamp;")
-                db_time_utc = cur.fetchone()[0]
-                print(f"Database current time (UTC): {db_time_utc}")
+                    cur.execute("SELECT current_timestamp;")
+                    db_time_utc = cur.fetchone()[0]
+                    print(f"Database current time (UTC): {db_time_utc}")
 
-                db_time_local = db_time_utc.astimezone(tz)
-                print(f"Database current time ({self.TZ_INFO}): {db_time_local}")
+                    db_time_local = db_time_utc.astimezone(self.tz)
+                    print(f"Database current time ({self.TZ_INFO}): {db_time_local}")
 
-                py_time = datetime.now(tz)
-                print(f"Python current time: {py_time}")
+                    py_time = datetime.now(self.tz)
+                    print(f"Python current time: {py_time}")
 
-                # Use py_time instead of tz for insertion
-                cur.execute("""
-                    INSERT INTO conversations 
-                    (id, question, answer, model_used, response_time, relevance, 
-                    relevance_explanation, prompt_tokens, completion_tokens, total_tokens, 
-                    eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, openai_cost, timestamp)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING timestamp;
-                """, 
-                ('test', 'test question', 'test answer', 'test model', 0.0, 0.0, 
-                'test explanation', 0, 0, 0, 0, 0, 0, 0.0, py_time))
-
-                inserted_time = cur.fetchone()[0]
-                print(f"Inserted time (UTC): {inserted_time}")
-                print(f"Inserted time ({self.TZ_INFO}): {inserted_time.astimezone(tz)}")
-
-                cur.execute("SELECT timestamp FROM conversations WHERE id = 'test';")
-                selected_time = cur.fetchone()[0]
-                print(f"Selected time (UTC): {selected_time}")
-                print(f"Selected time ({self.TZ_INFO}): {selected_time.astimezone(self.tz)}")
-
-                # Clean up the test entry
-                cur.execute("DELETE FROM conversations WHERE id = 'test';")
-                conn.commit()
+                    # Use py_time instead of tz for insertion
+                    cur.execute("""
+                        INSERT INTO conversations 
+                        (id, question, answer, model_used, response_time, relevance, 
+                        relevance_explanation, prompt_tokens, completion_tokens, total_tokens, 
+                        eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, openai_cost, timestamp)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        RETURNING timestamp;
+                    """, 
+                    ('test', 'test question', 'test answer', 'test model', 0.0, 0.0, 
+                    'test explanation', 0, 0, 0, 0, 0, 0, 0.0, py_time))
+
+                    inserted_time = cur.fetchone()[0]
+                    print(f"Inserted time (UTC): {inserted_time}")
+                    print(f"Inserted time ({self.TZ_INFO}): {inserted_time.astimezone(self.tz)}")
+
+                    cur.execute("SELECT timestamp FROM conversations WHERE id = 'test';")
+                    selected_time = cur.fetchone()[0]
+                    print(f"Selected time (UTC): {selected_time}")
+                    print(f"Selected time ({self.TZ_INFO}): {selected_time.astimezone(self.tz)}")
+
+                    # Clean up the test entry
+                    cur.execute("DELETE FROM conversations WHERE id = 'test';")
+                    conn.commit()
         except Exception as e:
             print(f"An error occurred: {e}")
-            conn.rollback()
-        finally:
-            conn.close()
\ No newline at end of file
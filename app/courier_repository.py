@@ -1,14 +1,42 @@
+import os
 from tinydb import TinyDB, Query
+from courier_store import CourierStore
+import stage_timer
 
 class CourierRepository:
     tinydb: TinyDB
+    store: CourierStore
+
+    # "indexed" reads a compact memory mapped copy of the TinyDB file, "tinydb" scans the TinyDB file
+    BACKEND = os.getenv("COURIER_BACKEND", "indexed")
 
     def __init__(self, tinydb_file):
-        self.tinydb = TinyDB(tinydb_file)
+        self.tinydb = None
+        self.store = None
+        if self.BACKEND == "tinydb":
+            self.tinydb = TinyDB(tinydb_file)
+        else:
+            self.store = CourierStore(tinydb_file)
 
     def search(self, courier_id):
+        with stage_timer.stage("courier_lookup"):
+            return self._search(courier_id)
+
+    def _search(self, courier_id):
+        if self.store is not None:
+            return self.store.search(courier_id)
+
         result = self.tinydb.search(Query().index == courier_id)
         if result:
             return result[0]
         else:
-            return None 
\ No newline at end of file
+            return None 
+
+    def search_many(self, courier_ids):
+        # Returns {courier_id: courier}, every distinct courier is looked up once.
+        courier_ids = set(courier_ids)
+        if self.store is not None:
+            couriers = {courier_id: self.store.search(courier_id) for courier_id in courier_ids}
+            return {courier_id: courier for courier_id, courier in couriers.items() if courier is not None}
+
+        return {courier['index']: courier for courier in self.tinydb.search(Query().index.one_of(list(courier_ids)))}
@@ -0,0 +1,243 @@
+import os
+import json
+import mmap
+import fcntl
+import struct
+import threading
+import logging
+from collections.abc import MutableMapping
+from time import time
+import numpy as np
+
+logger = logging.getLogger('gunicorn.error')
+
+
+class CourierRecord(MutableMapping):
+    """Courier profile backed by a list of values and a field index shared by all records."""
+    __slots__ = ("_fields", "_values", "_extra")
+
+    def __init__(self, fields, values):
+        self._fields = fields
+        self._values = values
+        self._extra = None
+
+    def __getitem__(self, key):
+        position = self._fields.get(key)
+        if position is not None:
+            return self._values[position]
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        position = self._fields.get(key)
+        if position is not None:
+            self._values[position] = value
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        del self._extra[key]
+
+    def __iter__(self):
+        yield from self._fields
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return len(self._fields) + (len(self._extra) if self._extra is not None else 0)
+
+    def __repr__(self):
+        return f"CourierRecord({dict(self)})"
+
+
+class _CourierSnapshot:
+    # Read-only view of a compiled store file. The arrays point into a shared
+    # memory map, so gunicorn workers share the pages through the OS page cache.
+    MAGIC = b"CSTORE01"
+
+    def __init__(self, store_file):
+        with open(store_file, "rb") as f:
+            self.header, position = self.read_header(f, store_file)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.fields = {field: i for i, field in enumerate(self.header["fields"])}
+        self.ids = np.frombuffer(self._mm, dtype=np.int64, count=self.header["id_slots"], offset=position)
+        position += self.ids.nbytes
+        self.offsets = np.frombuffer(self._mm, dtype=np.int64, count=self.header["rows"] + 1, offset=position)
+        self.blob_start = position + self.offsets.nbytes
+
+    def source_signature(self):
+        return self.header["source_signature"]
+
+    @classmethod
+    def read_header(cls, f, store_file):
+        # Returns the header and the position of the id array.
+        prefix = f.read(16)
+        if prefix[:8] != cls.MAGIC or len(prefix) < 16:
+            raise ValueError(f"{store_file} is not a courier store file")
+        header_length = struct.unpack_from("<Q", prefix, 8)[0]
+        return json.loads(f.read(header_length)), _align(16 + header_length)
+
+    @classmethod
+    def read_source_signature(cls, store_file):
+        # Reads only the header, without mapping the file.
+        with open(store_file, "rb") as f:
+            return cls.read_header(f, store_file)[0]["source_signature"]
+
+    def row_of(self, courier_id):
+        if self.header["id_mode"] == "direct":
+            # ids[courier_id] holds the row of the courier, -1 for unknown ids
+            if 0 <= courier_id < len(self.ids):
+                row = int(self.ids[courier_id])
+                return row if row >= 0 else None
+            return None
+        # ids holds the sorted courier ids, rows are stored in the same order
+        row = int(np.searchsorted(self.ids, courier_id))
+        return row if row < len(self.ids) and self.ids[row] == courier_id else None
+
+    def lookup(self, courier_id):
+        row = self.row_of(courier_id)
+        if row is None:
+            return None
+        start = self.blob_start + int(self.offsets[row])
+        end = self.blob_start + int(self.offsets[row + 1])
+        values = json.loads(self._mm[start:end])
+        # profiles with missing fields are stored as dicts and raise KeyError for them
+        return CourierRecord(self.fields, values) if isinstance(values, list) else values
+
+
+def _align(position):
+    return (position + 7) // 8 * 8
+
+
+def _source_signature(source_file):
+    stat = os.stat(source_file)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def compile_courier_store(source_file, store_file):
+    """Converts the TinyDB JSON file of courier profiles to the compact store format."""
+    signature = _source_signature(source_file)
+    with open(source_file) as f:
+        documents = list(json.load(f).get("_default", {}).values())
+
+    fields = []
+    for document in documents:
+        for field in document:
+            if field not in fields:
+                fields.append(field)
+    documents.sort(key=lambda document: document["index"])
+    courier_ids = np.array([document["index"] for document in documents], dtype=np.int64)
+
+    max_id = int(courier_ids.max()) if len(courier_ids) else -1
+    if len(courier_ids) and courier_ids.min() >= 0 and max_id < 4 * len(courier_ids) + 1024:
+        id_mode = "direct"
+        ids = np.full(max_id + 1, -1, dtype=np.int64)
+        ids[courier_ids] = np.arange(len(courier_ids))
+    else:
+        id_mode = "sorted"
+        ids = courier_ids
+
+    rows, incomplete = [], []
+    for document in documents:
+        if len(document) == len(fields):
+            row = [document[field] for field in fields]
+        else:
+            row = document
+            incomplete.append((document["index"], [field for field in fields if field not in document]))
+        rows.append(json.dumps(row, separators=(",", ":")).encode())
+    if incomplete:
+        logger.warning(f"{len(incomplete)} courier profiles in {source_file} have missing fields (courier index, missing fields): {incomplete[:20]}")
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(row) for row in rows])
+
+    header = json.dumps({
+        "fields": fields,
+        "rows": len(rows),
+        "id_slots": len(ids),
+        "id_mode": id_mode,
+        "source_signature": signature,
+    }).encode()
+
+    tmp_file = f"{store_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(_CourierSnapshot.MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(b"\0" * (_align(16 + len(header)) - 16 - len(header)))
+        f.write(ids.tobytes())
+        f.write(offsets.tobytes())
+        for row in rows:
+            f.write(row)
+    os.replace(tmp_file, store_file)
+    print(f"Compiled {len(rows)} courier profiles to {store_file}.")
+
+
+class CourierStore:
+    """Courier profiles with O(1) lookup by id from a memory mapped store file.
+
+    The store file is compiled from the TinyDB JSON file once and recompiled in
+    the background when the JSON file changes. Readers keep using the previous
+    snapshot until the new one is ready.
+    """
+    source_file: str
+    store_file: str
+
+    RELOAD_CHECK_INTERVAL = float(os.getenv("COURIER_STORE_RELOAD_CHECK_INTERVAL", "2"))
+
+    def __init__(self, source_file, store_file=None):
+        self.source_file = source_file
+        self.store_file = store_file or os.getenv("COURIER_STORE_FILE") or f"{source_file}.store"
+        self._reload_lock = threading.Lock()
+        self._checked_at = time()
+        self._snapshot = self._load()
+
+    def search(self, courier_id):
+        if time() - self._checked_at > self.RELOAD_CHECK_INTERVAL:
+            self._checked_at = time()
+            self._reload_if_changed()
+
+        if isinstance(courier_id, bool) or not isinstance(courier_id, int):
+            return None
+        return self._snapshot.lookup(courier_id)
+
+    def _reload_if_changed(self):
+        try:
+            changed = _source_signature(self.source_file) != self._snapshot.source_signature()
+        except FileNotFoundError:
+            return
+        if changed and self._reload_lock.acquire(blocking=False):
+            threading.Thread(target=self._reload, name="courier-store-reload", daemon=True).start()
+
+    def _reload(self):
+        try:
+            self._snapshot = self._load()
+            logger.info(f"Reloaded courier profiles from {self.source_file}.")
+        except Exception as e:
+            logger.error(f"Reloading courier profiles from {self.source_file} failed: {e}")
+        finally:
+            self._reload_lock.release()
+
+    def _load(self):
+        # Only one process compiles the store file, the others wait and open the result.
+        with open(f"{self.store_file}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self._store_is_stale():
+                    compile_courier_store(self.source_file, self.store_file)
+                return _CourierSnapshot(self.store_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _store_is_stale(self):
+        if not os.path.exists(self.store_file):
+            return True
+        try:
+            return _CourierSnapshot.read_source_signature(self.store_file) != _source_signature(self.source_file)
+        except ValueError:
+            return True
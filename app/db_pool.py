@@ -0,0 +1,155 @@
+import os
+import threading
+from contextlib import contextmanager
+from time import time
+import psycopg2
+import metrics
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of persistent Postgres connections.
+
+    Connections live as long as the worker process. Idle connections are health
+    checked before reuse and broken ones are replaced with new connections.
+    """
+    max_size: int
+    timeout: float
+    health_check_interval: float
+
+    def __init__(self, connect, max_size=10, timeout=5.0, health_check_interval=30.0):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._condition = threading.Condition()
+        self._reset()
+        metrics.register_gauge_callback(self._report_gauges)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []  # (connection, last_used)
+        self._size = 0
+        self._waiting = 0
+        self._prepared = {}
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._release(conn, broken=True)
+            raise
+        except Exception:
+            self._release(conn)
+            raise
+        else:
+            self._release(conn)
+
+    def prepare(self, cur, name, statement):
+        # Prepares the statement once per connection, later calls use EXECUTE name (...)
+        prepared = self._prepared.setdefault(id(cur.connection), set())
+        if name not in prepared:
+            cur.execute(f"PREPARE {name} AS {statement}")
+            prepared.add(name)
+
+    def _acquire(self):
+        start_time = time()
+        with self._condition:
+            if self._pid != os.getpid():
+                # Connections inherited from the parent process can't be shared, forget them.
+                self._reset()
+
+            conn = None
+            while conn is None:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    break
+                else:
+                    remaining = self.timeout - (time() - start_time)
+                    if remaining <= 0:
+                        metrics.inc("db_pool_timeouts_total", help_text="Connection requests that timed out waiting for the pool")
+                        raise PoolTimeoutError(f"No Postgres connection available after {self.timeout}s")
+                    self._waiting += 1
+                    self._condition.wait(remaining)
+                    self._waiting -= 1
+
+        if conn is not None and not self._is_healthy(conn, last_used):
+            # Keep the slot and replace the broken connection with a new one.
+            metrics.inc("db_pool_reconnects_total", help_text="Broken idle Postgres connections replaced by the pool")
+            self._close(conn)
+            conn = None
+        if conn is None:
+            conn = self._new_connection()
+
+        metrics.observe("db_pool_wait_seconds", time() - start_time, help_text="Time spent waiting for a pooled Postgres connection")
+        return conn
+
+    def _new_connection(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        metrics.inc("db_pool_connects_total", help_text="New Postgres connections opened by the pool")
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _release(self, conn, broken=False):
+        if not broken and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+
+        if broken or conn.closed:
+            metrics.inc("db_pool_broken_connections_total", help_text="Pooled Postgres connections discarded after a failure")
+            self._discard(conn)
+            return
+
+        with self._condition:
+            self._idle.append((conn, time()))
+            self._condition.notify()
+
+    def _close(self, conn):
+        self._prepared.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def _report_gauges(self):
+        with self._condition:
+            idle = len(self._idle)
+            metrics.set_gauge("db_pool_size", self._size, help_text="Open Postgres connections in the pool")
+            metrics.set_gauge("db_pool_in_use", self._size - idle, help_text="Postgres connections currently checked out")
+            metrics.set_gauge("db_pool_idle", idle, help_text="Idle Postgres connections in the pool")
+            metrics.set_gauge("db_pool_waiting", self._waiting, help_text="Requests waiting for a Postgres connection")
+            metrics.set_gauge("db_pool_max_size", self.max_size, help_text="Maximum Postgres connections in the pool")
@@ -0,0 +1,117 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import metrics
+
+
+class EmbeddingCache:
+    """Bounded LRU cache of question embeddings keyed by normalized question text.
+
+    Entries evicted from memory can optionally spill to a memory mapped vector
+    file, which keeps many more embeddings around without using process memory.
+    """
+    dimensions: int
+
+    MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "2000"))
+    SPILL_FILE = os.getenv("EMBEDDING_CACHE_SPILL_FILE")
+    SPILL_ENTRIES = int(os.getenv("EMBEDDING_CACHE_SPILL_ENTRIES", "100000"))
+
+    def __init__(self, dimensions, max_entries=None, spill_file=None, spill_entries=None):
+        self.dimensions = dimensions
+        self.max_entries = max_entries or self.MAX_ENTRIES
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        self._spill_file = spill_file or self.SPILL_FILE
+        self._spill_entries = spill_entries or self.SPILL_ENTRIES
+        self._spill = None
+        self._spill_pid = None
+        self._spill_slots = {}  # text -> slot
+        self._spill_keys = []  # slot -> text
+        self._spill_next = 0
+
+    def _check_spill(self):
+        # One spill file per process, opened on first use. A cache created before a
+        # fork (gunicorn preload_app) opens a new file in every worker, the workers
+        # never write to the same file. The file is unlinked right after mapping it,
+        # so its disk space is freed when the process exits or restarts.
+        if self._spill_file is None or self._spill_pid == os.getpid():
+            return
+        self._spill_pid = os.getpid()
+        fd, path = tempfile.mkstemp(prefix=f"{os.path.basename(self._spill_file)}.{self._spill_pid}.",
+                                    dir=os.path.dirname(self._spill_file) or None)
+        try:
+            with os.fdopen(fd, "w+b") as f:
+                self._spill = np.memmap(f, dtype=np.float32, mode="w+", shape=(self._spill_entries, self.dimensions))
+        finally:
+            os.unlink(path)
+        self._spill_slots = {}
+        self._spill_keys = [None] * self._spill_entries
+        self._spill_next = 0
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.split()).casefold()
+
+    def get(self, text):
+        key = self.normalize(text)
+        with self._lock:
+            self._check_spill()
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.inc("embedding_cache_hits_total", help_text="Question embeddings served from memory")
+                return vector
+
+            slot = self._spill_slots.get(key) if self._spill is not None else None
+            if slot is not None:
+                vector = np.array(self._spill[slot])
+                self._put(key, vector)
+                self.spill_hits += 1
+                metrics.inc("embedding_cache_spill_hits_total", help_text="Question embeddings served from the spill file")
+                return vector
+
+            self.misses += 1
+            metrics.inc("embedding_cache_misses_total", help_text="Question embeddings that had to be computed")
+            return None
+
+    def put(self, text, vector):
+        with self._lock:
+            self._check_spill()
+            self._put(self.normalize(text), np.asarray(vector, dtype=np.float32))
+
+    def _put(self, key, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted_key, evicted_vector = self._entries.popitem(last=False)
+            if self._spill is not None:
+                self._spill_put(evicted_key, evicted_vector)
+
+    def _spill_put(self, key, vector):
+        if key in self._spill_slots:
+            return
+        # The spill file is a ring buffer, the oldest spilled embedding is overwritten.
+        slot = self._spill_next
+        self._spill_next = (slot + 1) % self._spill_entries
+        previous_key = self._spill_keys[slot]
+        if previous_key is not None:
+            del self._spill_slots[previous_key]
+        self._spill[slot] = vector
+        self._spill_keys[slot] = key
+        self._spill_slots[key] = slot
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "spilled_entries": len(self._spill_slots),
+            "hits": self.hits,
+            "spill_hits": self.spill_hits,
+            "misses": self.misses,
+        }
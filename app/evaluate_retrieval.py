@@ -0,0 +1,118 @@
+"""Evaluates FAQ retrieval (hit rate and MRR) on the ground truth questions for a grid of score thresholds and limits.
+
+Every question is embedded once and searched once with the lowest threshold and the
+highest limit of the grid. All grid points are then computed from these candidates.
+Run from the root folder with Qdrant running: python app/evaluate_retrieval.py
+"""
+import os
+import sys
+import json
+import argparse
+from time import perf_counter
+import numpy as np
+from faq_repository import FaqRepository
+from embedding_cache import EmbeddingCache
+
+
+def candidate_ranks(hits_batch, ground_truth_ids, depth):
+    """Rank and score of the ground truth FAQ entry in each candidate list, depth and -inf if not found."""
+    ranks = np.full(len(hits_batch), depth, dtype=np.int64)
+    scores = np.full(len(hits_batch), -np.inf, dtype=np.float64)
+    for i, (hits, ground_truth_id) in enumerate(zip(hits_batch, ground_truth_ids)):
+        for rank, (point_id, score, _) in enumerate(hits):
+            if point_id == ground_truth_id:
+                ranks[i], scores[i] = rank, score
+                break
+    return ranks, scores
+
+
+def evaluate_grid(ranks, scores, score_thresholds, limits):
+    # Candidates are sorted by score, so searching with (threshold, limit) returns
+    # the first `limit` candidates with a score >= threshold. The ground truth entry
+    # is found when its rank is below the limit and its score reaches the threshold.
+    found = (ranks[None, None, :] < limits[None, :, None]) & (scores[None, None, :] >= score_thresholds[:, None, None])
+    reciprocal_ranks = np.where(found, 1.0 / (ranks[None, None, :] + 1), 0.0)
+    return found.mean(axis=2), reciprocal_ranks.mean(axis=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ground-truth", default="notebooks/evaluation_ground_truth.json")
+    parser.add_argument("--questions", type=int, default=None, help="evaluate only the first N questions")
+    parser.add_argument("--thresholds", default="0.4:1.0:0.05", help="start:stop:step of the score thresholds")
+    parser.add_argument("--limits", default="1:11", help="start:stop of the limits")
+    parser.add_argument("--score-threshold", type=float, default=0.7, help="threshold used by the server, checked by the gate")
+    parser.add_argument("--limit", type=int, default=5, help="limit used by the server, checked by the gate")
+    parser.add_argument("--min-hit-rate", type=float, default=None, help="fail when the server config is below this hit rate")
+    parser.add_argument("--min-mrr", type=float, default=None, help="fail when the server config is below this MRR")
+    parser.add_argument("--batch-size", type=int, default=256, help="questions per Qdrant batch query")
+    parser.add_argument("--report", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    score_thresholds = np.round(np.arange(*[float(x) for x in args.thresholds.split(":")]), 6)
+    limits = np.arange(*[int(x) for x in args.limits.split(":")])
+    score_thresholds = np.union1d(score_thresholds, [args.score_threshold])
+    limits = np.union1d(limits, [args.limit])
+
+    with open(args.ground_truth) as f:
+        ground_truth = json.load(f)[:args.questions]
+    questions = [record["generated_question"] for record in ground_truth]
+    countries = [record["ground_truth_courier"]["country"] for record in ground_truth]
+    ground_truth_ids = [record["ground_truth_faq_id"] for record in ground_truth]
+
+    qd_server = os.environ.get("QD_SERVER", "localhost:6333")
+    faq_db = FaqRepository(qd_server, "courier_faq", embedding_cache=EmbeddingCache(FaqRepository.EMBEDDING_DIMENSIONALITY, max_entries=len(questions)))
+
+    start_time = perf_counter()
+    query_vectors = faq_db.embed_questions(questions)
+    embed_time = perf_counter() - start_time
+
+    start_time = perf_counter()
+    depth = int(limits.max())
+    hits_batch = []
+    for i in range(0, len(questions), args.batch_size):
+        hits_batch += faq_db.search_hits_batch(
+            questions[i:i + args.batch_size], countries[i:i + args.batch_size],
+            float(score_thresholds.min()), depth, query_vectors=query_vectors[i:i + args.batch_size],
+        )
+    search_time = perf_counter() - start_time
+
+    start_time = perf_counter()
+    ranks, scores = candidate_ranks(hits_batch, ground_truth_ids, depth)
+    hit_rates, mrrs = evaluate_grid(ranks, scores, score_thresholds, limits)
+    grid_time = perf_counter() - start_time
+
+    grid = [
+        {"score_threshold": float(score_threshold), "limit": int(limit), "hit_rate": float(hit_rates[i, j]), "mrr": float(mrrs[i, j])}
+        for i, score_threshold in enumerate(score_thresholds)
+        for j, limit in enumerate(limits)
+    ]
+    current = next(result for result in grid if result["score_threshold"] == args.score_threshold and result["limit"] == args.limit)
+
+    failures = []
+    if args.min_hit_rate is not None and current["hit_rate"] < args.min_hit_rate:
+        failures.append(f"hit_rate {current['hit_rate']:.4f} < {args.min_hit_rate}")
+    if args.min_mrr is not None and current["mrr"] < args.min_mrr:
+        failures.append(f"mrr {current['mrr']:.4f} < {args.min_mrr}")
+
+    report = {
+        "questions": len(questions),
+        "backend": faq_db.backend,
+        "timings_s": {"embed": round(embed_time, 3), "search": round(search_time, 3), "grid": round(grid_time, 3)},
+        "current": current,
+        "best": max(grid, key=lambda result: (result["mrr"], result["hit_rate"])),
+        "grid": grid,
+        "failures": failures,
+    }
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps({key: value for key, value in report.items() if key != "grid"}, indent=2))
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import os
+import random
+import numpy as np
+
+# Policies that evaluate with the LLM judge, everything else is evaluated locally.
+LLM_POLICIES = ("full", "sampled", "low_score", "flagged")
+
+
+class EvaluationPolicy:
+    """Decides per answer how its relevance is evaluated.
+
+    full:      every answer is evaluated by the LLM judge
+    sampled:   EVALUATION_SAMPLE_RATE of the answers are evaluated by the LLM judge
+    low_score: answers whose best FAQ hit scores below EVALUATION_LOW_SCORE_THRESHOLD
+               are evaluated by the LLM judge
+    local:     no LLM evaluation
+    Answers not evaluated by the LLM judge are evaluated by LocalRelevanceEvaluator
+    and stored with the "local" policy. Answers with negative feedback are
+    evaluated by the LLM judge later with the "flagged" policy.
+    """
+    policy: str
+
+    POLICY = os.getenv("EVALUATION_POLICY", "full")
+    SAMPLE_RATE = float(os.getenv("EVALUATION_SAMPLE_RATE", "0.1"))
+    LOW_SCORE_THRESHOLD = float(os.getenv("EVALUATION_LOW_SCORE_THRESHOLD", "0.8"))
+
+    def __init__(self, policy=None, sample_rate=None, low_score_threshold=None):
+        self.policy = policy or self.POLICY
+        if self.policy not in ("full", "sampled", "low_score", "local"):
+            raise ValueError(f"Unknown evaluation policy: {self.policy}")
+        self.sample_rate = self.SAMPLE_RATE if sample_rate is None else sample_rate
+        self.low_score_threshold = self.LOW_SCORE_THRESHOLD if low_score_threshold is None else low_score_threshold
+
+    def choose(self, related_faq):
+        if self.policy == "full":
+            return "full"
+        if self.policy == "sampled" and random.random() < self.sample_rate:
+            return "sampled"
+        if self.policy == "low_score":
+            top_score = related_faq[0].get("score", 0.0) if related_faq else 0.0
+            if top_score < self.low_score_threshold:
+                return "low_score"
+        return "local"
+
+
+class LocalRelevanceEvaluator:
+    """Relevance from the cosine similarity of the question and answer embeddings.
+
+    The thresholds map the similarity to RELEVANT / PARTLY_RELEVANT / NON_RELEVANT,
+    calibrate them against LLM evaluated conversations with calibrate_local_evaluation.py.
+    """
+    # "<RELEVANT threshold>,<PARTLY_RELEVANT threshold>"
+    THRESHOLDS = os.getenv("LOCAL_EVALUATION_THRESHOLDS", "0.75,0.6")
+
+    def __init__(self, embed_texts, thresholds=None):
+        self.embed_texts = embed_texts
+        relevant, partly_relevant = thresholds or [float(x) for x in self.THRESHOLDS.split(",")]
+        self.relevant_threshold = relevant
+        self.partly_relevant_threshold = partly_relevant
+
+    def similarity(self, question, answer):
+        question_vector, answer_vector = (np.asarray(vector, dtype=np.float32) for vector in self.embed_texts([question, answer]))
+        norm = np.linalg.norm(question_vector) * np.linalg.norm(answer_vector)
+        return float(question_vector @ answer_vector / norm) if norm else 0.0
+
+    def classify(self, similarity):
+        if similarity >= self.relevant_threshold:
+            return "RELEVANT"
+        if similarity >= self.partly_relevant_threshold:
+            return "PARTLY_RELEVANT"
+        return "NON_RELEVANT"
+
+    def evaluate_answer(self, question, llm_answer):
+        # Same return value as RagEvaluation.evaluate_answer, without tokens.
+        similarity = self.similarity(question, llm_answer)
+        relevance = {
+            "Relevance": self.classify(similarity),
+            "Explanation": f"Local embedding similarity {similarity:.4f}",
+        }
+        return relevance, {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
@@ -0,0 +1,60 @@
+import os
+import queue
+import threading
+import logging
+
+logger = logging.getLogger('gunicorn.error')
+
+
+class EvaluationWorker:
+    """Runs answer relevance evaluation in background threads, off the request path."""
+    rag: object
+    conversation_repository: object
+    evaluation_queue: queue.Queue
+
+    WORKERS = int(os.getenv("EVALUATION_WORKERS", "2"))
+    QUEUE_SIZE = int(os.getenv("EVALUATION_QUEUE_SIZE", "1000"))
+
+    def __init__(self, rag, conversation_repository, workers=None, queue_size=None):
+        self.rag = rag
+        self.conversation_repository = conversation_repository
+        self.workers = workers or self.WORKERS
+        self.evaluation_queue = queue.Queue(maxsize=queue_size or self.QUEUE_SIZE)
+        self.threads = []
+        self.dropped = 0
+
+    def start(self):
+        if self.threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"evaluation-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Started {self.workers} evaluation workers (queue size {self.evaluation_queue.maxsize}).")
+
+    def submit(self, conversation_id, question, answer_llm, on_complete=None, policy="full"):
+        # The queue is bounded so the evaluation backlog can't grow without limit.
+        # When it is full the conversation keeps its PENDING relevance.
+        try:
+            self.evaluation_queue.put_nowait((conversation_id, question, answer_llm, on_complete, policy))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Evaluation queue full, skipping evaluation of conversation {conversation_id}.")
+            return False
+
+    def backlog(self):
+        return self.evaluation_queue.qsize()
+
+    def _run(self):
+        while True:
+            conversation_id, question, answer_llm, on_complete, policy = self.evaluation_queue.get()
+            try:
+                eval_data = self.rag.evaluate_answer(question, answer_llm, policy)
+                self.conversation_repository.update_evaluation(conversation_id, eval_data)
+                if on_complete is not None:
+                    on_complete(eval_data)
+            except Exception as e:
+                logger.error(f"Evaluation of conversation {conversation_id} failed: {e}")
+            finally:
+                self.evaluation_queue.task_done()
@@ -0,0 +1,113 @@
+"""Local stand-in for the OpenAI chat completions API, used for load tests without OpenAI costs.
+
+Start it and point the API server to it with OPENAI_BASE_URL:
+python app/fake_openai.py --port 8099
+OPENAI_BASE_URL=http://127.0.0.1:8099/v1 gunicorn --bind 0.0.0.0:9696 --chdir=app server:app
+"""
+import json
+import uuid
+import random
+import argparse
+from time import time, sleep
+from flask import Flask, Response, request, jsonify
+
+app = Flask(__name__)
+
+# Latency of a completion: a log-normal time to the first token plus a fixed time per completion token.
+config = {
+    "ttft_median_ms": 400.0,
+    "ttft_sigma": 0.5,
+    "token_ms": 10.0,
+    "min_completion_tokens": 40,
+    "max_completion_tokens": 120,
+    "error_rate": 0.0,
+}
+
+ANSWER_WORDS = ("you can find the details in your contract and the courier app , please contact "
+                "support if anything is unclear about your deliveries payments or vehicle .").split()
+
+
+def prompt_tokens(messages):
+    # Rough estimate, about 4 characters per token.
+    return max(1, sum(len(message.get("content") or "") for message in messages) // 4)
+
+
+def completion_text(messages, completion_tokens):
+    if any("Relevance" in (message.get("content") or "") for message in messages):
+        # Evaluation prompt of rag_evaluation.py, answered with the JSON it parses.
+        return json.dumps({"Relevance": "RELEVANT", "Explanation": "Fake evaluation for load tests."})
+    return " ".join(ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(completion_tokens))
+
+
+def completion_id():
+    return f"chatcmpl-fake-{uuid.uuid4().hex}"
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def handle_chat_completions():
+    data = request.json
+    messages = data.get("messages", [])
+    model = data.get("model", "gpt-4o-mini")
+
+    if random.random() < config["error_rate"]:
+        return jsonify({"error": {"message": "Fake server error", "type": "server_error"}}), 500
+
+    completion_tokens = random.randint(config["min_completion_tokens"], config["max_completion_tokens"])
+    content = completion_text(messages, completion_tokens)
+    usage = {
+        "prompt_tokens": prompt_tokens(messages),
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens(messages) + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": 0},
+    }
+    ttft = random.lognormvariate(0, config["ttft_sigma"]) * config["ttft_median_ms"] / 1000
+    token_time = config["token_ms"] / 1000
+
+    if data.get("stream"):
+        return Response(stream_completion(model, content, usage, ttft, token_time, data.get("stream_options")), mimetype="text/event-stream")
+
+    sleep(ttft + completion_tokens * token_time)
+    return jsonify({
+        "id": completion_id(),
+        "object": "chat.completion",
+        "created": int(time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": usage,
+    })
+
+
+def stream_completion(model, content, usage, ttft, token_time, stream_options):
+    chunk = {"id": completion_id(), "object": "chat.completion.chunk", "created": int(time()), "model": model}
+    words = content.split(" ")
+    sleep(ttft)
+    for i, word in enumerate(words):
+        if i:
+            sleep(token_time * usage["completion_tokens"] / len(words))
+        delta = {"role": "assistant", "content": word} if i == 0 else {"content": " " + word}
+        yield f"data: {json.dumps({**chunk, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})}\n\n"
+    yield f"data: {json.dumps({**chunk, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
+    if stream_options and stream_options.get("include_usage"):
+        yield f"data: {json.dumps({**chunk, 'choices': [], 'usage': usage})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--ttft-median-ms", type=float, default=config["ttft_median_ms"])
+    parser.add_argument("--ttft-sigma", type=float, default=config["ttft_sigma"], help="sigma of the log-normal time to first token")
+    parser.add_argument("--token-ms", type=float, default=config["token_ms"], help="time per completion token")
+    parser.add_argument("--min-completion-tokens", type=int, default=config["min_completion_tokens"])
+    parser.add_argument("--max-completion-tokens", type=int, default=config["max_completion_tokens"])
+    parser.add_argument("--error-rate", type=float, default=config["error_rate"], help="share of requests failing with HTTP 500")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config.update({key: value for key, value in vars(args).items() if key in config})
+    random.seed(args.seed)
+    app.run(host="0.0.0.0", port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
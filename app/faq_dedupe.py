@@ -0,0 +1,116 @@
+"""Deletes near-duplicate FAQ entries from the Qdrant collection in a single pass.
+
+Run from the root folder with Qdrant running: python app/faq_dedupe.py --dry-run
+"""
+import os
+import json
+import argparse
+import numpy as np
+from qdrant_client import QdrantClient, models
+from local_faq_index import LocalFaqIndex
+from faq_storage import FaqVectorStorage
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parent = np.arange(size)
+
+    def find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            # The lower row stays the root, so it becomes the survivor of the cluster.
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+
+def duplicate_clusters(vectors, score_threshold, block_size=1024):
+    """Groups rows of normalized vectors with cosine similarity >= score_threshold.
+
+    Similarities are computed block by block, so at most block_size x len(vectors)
+    scores are in memory. Clusters are transitive: if a~b and b~c, a, b and c
+    end up in the same cluster even when a and c are below the threshold.
+    Returns {survivor row: [(duplicate row, similarity to the survivor), ...]}.
+    """
+    union_find = UnionFind(len(vectors))
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size]
+        # Only pairs (i, j) with j > i, the lower triangle is the same pairs again.
+        scores = block @ vectors[start:].T
+        rows, columns = np.nonzero(np.triu(scores >= score_threshold, k=1))
+        for i, j in zip(rows + start, columns + start):
+            union_find.union(i, j)
+
+    clusters = {}
+    for row in range(len(vectors)):
+        root = union_find.find(row)
+        if root != row:
+            clusters.setdefault(int(root), []).append((row, float(vectors[root] @ vectors[row])))
+    return clusters
+
+
+def dedupe_faq_data(qd_client, collection_name, score_threshold=0.9999, report_file=None, dry_run=False, block_size=1024):
+    # FAQ vectors are loaded once with one scroll pass instead of one query per point.
+    index = LocalFaqIndex.from_qdrant(qd_client, collection_name, storage=FaqVectorStorage("float32"))
+    clusters = duplicate_clusters(index.vectors, score_threshold, block_size=block_size)
+
+    report = {
+        "collection_name": collection_name,
+        "score_threshold": score_threshold,
+        "points": len(index),
+        "clusters": [
+            {
+                "survivor": {"id": index.ids[root].item(), "question": index.payloads[root].get("question")},
+                "duplicates": [
+                    {"id": index.ids[row].item(), "question": index.payloads[row].get("question"), "score": round(score, 6)}
+                    for row, score in duplicates
+                ],
+            }
+            for root, duplicates in sorted(clusters.items())
+        ],
+    }
+    deletion_list = [duplicate["id"] for cluster in report["clusters"] for duplicate in cluster["duplicates"]]
+    report["deleted"] = 0 if dry_run else len(deletion_list)
+
+    if deletion_list and not dry_run:
+        qd_client.delete(
+            collection_name=collection_name,
+            points_selector=models.PointIdsList(
+                points=deletion_list
+            )
+        )
+        print(f"Successfully deleted {len(deletion_list)} duplicate FAQ points in vector DB.")
+    elif deletion_list:
+        print(f"Found {len(deletion_list)} duplicate FAQ points, nothing deleted in dry run.")
+    else:
+        print("No FAQ duplicates found above the threshold.")
+
+    if report_file:
+        os.makedirs(os.path.dirname(report_file) or ".", exist_ok=True)
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote FAQ dedupe report with {len(report['clusters'])} duplicate clusters to {report_file}.")
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--score-threshold", type=float, default=0.9999)
+    parser.add_argument("--report", default="tmp_datastore/faq_dedupe_report.json")
+    parser.add_argument("--block-size", type=int, default=1024, help="rows per similarity block")
+    parser.add_argument("--dry-run", action="store_true", help="only write the report")
+    args = parser.parse_args()
+
+    qd_client = QdrantClient(os.environ.get("QD_SERVER", "localhost:6333"))
+    dedupe_faq_data(qd_client, "courier_faq", args.score_threshold, args.report, args.dry_run, args.block_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import os
+import json
+import random
+from time import perf_counter, sleep
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from qdrant_client import models
+from fastembed import TextEmbedding
+from faq_storage import FaqVectorStorage
+
+COUNTRY_CODES = {
+    'germany': 'DE',
+    'netherlands': 'NL',
+    'uk': 'GB'
+}
+
+_embedding_model = None
+
+
+def _init_embedding_worker(model_handle, threads):
+    # One model per worker process, loaded once and reused for all its chunks.
+    global _embedding_model
+    _embedding_model = TextEmbedding(model_handle, threads=threads)
+
+
+def _embed_chunk(chunk_index, first_id, records):
+    texts = [record['question'] + ' ' + record['answer'] for record in records]
+    vectors = [vector.tolist() for vector in _embedding_model.embed(texts)]
+    return chunk_index, first_id, records, vectors
+
+
+class FaqIngestion:
+    """Streams the FAQ CSV file into Qdrant.
+
+    The CSV file is read in chunks, chunks are embedded in a process pool and
+    the points are upserted in parallel batches with retries. Finished chunks
+    are written to a checkpoint file, so running an interrupted ingestion again
+    continues with the missing chunks instead of starting over.
+    """
+    qd_client: object
+    collection_name: str
+
+    MODEL_HANDLE = "jinaai/jina-embeddings-v2-small-en"
+    EMBEDDING_DIMENSIONALITY = 512
+
+    CHUNK_SIZE = int(os.getenv("FAQ_INGEST_CHUNK_SIZE", "256"))
+    BATCH_SIZE = int(os.getenv("FAQ_INGEST_BATCH_SIZE", "64"))
+    EMBED_WORKERS = int(os.getenv("FAQ_INGEST_EMBED_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+    UPSERT_WORKERS = int(os.getenv("FAQ_INGEST_UPSERT_WORKERS", "4"))
+    MAX_RETRIES = int(os.getenv("FAQ_INGEST_MAX_RETRIES", "5"))
+
+    def __init__(self, qd_client, collection_name, checkpoint_file=None, chunk_size=None, batch_size=None,
+                 embed_workers=None, upsert_workers=None, storage=None):
+        self.qd_client = qd_client
+        self.collection_name = collection_name
+        self.checkpoint_file = checkpoint_file or f"tmp_datastore/{collection_name}.ingestion_checkpoint.json"
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.embed_workers = embed_workers or self.EMBED_WORKERS
+        self.upsert_workers = upsert_workers or self.UPSERT_WORKERS
+        self.storage = storage or FaqVectorStorage()
+
+    def ingest(self, source_faq_data_file):
+        checkpoint = self._load_checkpoint(source_faq_data_file)
+        if checkpoint is None:
+            checkpoint = {
+                "source_file": source_faq_data_file,
+                "source_signature": _source_signature(source_faq_data_file),
+                "chunk_size": self.chunk_size,
+                "vector_storage": self.storage.mode,
+                # Marks the ingestion run, servers clear their answer caches when it changes.
+                "ingested_at": datetime.now(timezone.utc).isoformat(),
+                "done_chunks": [],
+            }
+            self._create_collection()
+            self._save_checkpoint(checkpoint)
+        else:
+            print(f"Resuming FAQ ingestion, {len(checkpoint['done_chunks'])} chunks already ingested.")
+
+        done_chunks = set(checkpoint["done_chunks"])
+        start_time = perf_counter()
+        documents = 0
+        # Each embedding worker gets one ONNX thread, the processes provide the parallelism.
+        threads = 1 if self.embed_workers > 1 else None
+
+        with ProcessPoolExecutor(self.embed_workers, initializer=_init_embedding_worker, initargs=(self.MODEL_HANDLE, threads)) as embed_pool, \
+                ThreadPoolExecutor(self.upsert_workers, thread_name_prefix="faq-upsert") as upsert_pool:
+            pending = set()
+            for chunk_index, first_id, records in self._read_chunks(source_faq_data_file):
+                if chunk_index in done_chunks:
+                    continue
+                # Bounded number of chunks in flight, the CSV file is never fully in memory.
+                while len(pending) >= 2 * self.embed_workers:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    documents += self._finish_chunks(finished, upsert_pool, checkpoint)
+                pending.add(embed_pool.submit(_embed_chunk, chunk_index, first_id, records))
+
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                documents += self._finish_chunks(finished, upsert_pool, checkpoint)
+
+        elapsed = perf_counter() - start_time
+        print(f"Ingested {documents} FAQ documents in {elapsed:.1f}s ({documents / elapsed if elapsed else 0:.1f} docs/sec).")
+        os.remove(self.checkpoint_file)
+        return documents
+
+    def _read_chunks(self, source_faq_data_file):
+        # Point ids are the row numbers of the CSV file, stable between runs.
+        first_id = 0
+        for chunk_index, chunk_df in enumerate(pd.read_csv(source_faq_data_file, chunksize=self.chunk_size)):
+            chunk_df['country'] = chunk_df['country'].str.lower().replace(COUNTRY_CODES)
+            yield chunk_index, first_id, chunk_df.to_dict('records')
+            first_id += len(chunk_df)
+
+    def _finish_chunks(self, finished, upsert_pool, checkpoint):
+        documents = 0
+        for future in finished:
+            chunk_index, first_id, records, vectors = future.result()
+            points = [
+                models.PointStruct(id=first_id + i, vector=vector, payload={**record, "ingested_at": checkpoint["ingested_at"]})
+                for i, (record, vector) in enumerate(zip(records, vectors))
+            ]
+            batches = [points[i:i + self.batch_size] for i in range(0, len(points), self.batch_size)]
+            for upsert in [upsert_pool.submit(self._upsert_batch, batch) for batch in batches]:
+                upsert.result()
+
+            checkpoint["done_chunks"].append(chunk_index)
+            self._save_checkpoint(checkpoint)
+            documents += len(points)
+        return documents
+
+    def _upsert_batch(self, points):
+        for attempt in range(self.MAX_RETRIES + 1):
+            try:
+                self.qd_client.upsert(collection_name=self.collection_name, points=points, wait=True)
+                return
+            except Exception as e:
+                if attempt == self.MAX_RETRIES:
+                    raise
+                delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+                print(f"Upsert of {len(points)} FAQ points failed ({e}), retrying in {delay:.1f}s.")
+                sleep(delay)
+
+    def _create_collection(self):
+        if self.qd_client.collection_exists(collection_name=self.collection_name):
+            self.qd_client.delete_collection(collection_name=self.collection_name)
+
+        self.qd_client.create_collection(
+            collection_name=self.collection_name,
+            vectors_config=self.storage.vectors_config(self.EMBEDDING_DIMENSIONALITY),
+            quantization_config=self.storage.quantization_config(),
+            hnsw_config=self.storage.hnsw_config(),
+        )
+        print(f"Created collection {self.collection_name} with {self.storage.mode} vector storage.")
+
+        self.qd_client.create_payload_index(
+            collection_name=self.collection_name,
+            field_name="country",
+            field_schema="keyword"
+        )
+
+    def _load_checkpoint(self, source_faq_data_file):
+        # A checkpoint is only reused for the same, unchanged source file, chunk size and vector storage.
+        if not os.path.exists(self.checkpoint_file):
+            return None
+        with open(self.checkpoint_file) as f:
+            checkpoint = json.load(f)
+        if (checkpoint.get("source_file") != source_faq_data_file
+                or checkpoint.get("source_signature") != _source_signature(source_faq_data_file)
+                or checkpoint.get("chunk_size") != self.chunk_size
+                or checkpoint.get("vector_storage", "float32") != self.storage.mode
+                or not self.qd_client.collection_exists(collection_name=self.collection_name)):
+            print(f"Ignoring stale FAQ ingestion checkpoint {self.checkpoint_file}.")
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint):
+        os.makedirs(os.path.dirname(self.checkpoint_file) or ".", exist_ok=True)
+        tmp_file = f"{self.checkpoint_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+
+def _source_signature(source_file):
+    stat = os.stat(source_file)
+    return [stat.st_mtime_ns, stat.st_size]
@@ -1,24 +1,163 @@
-from qdrant_client import QdrantClient, models
+import os
+import asyncio
+from qdrant_client import QdrantClient, AsyncQdrantClient, models
+from fastembed import TextEmbedding
+from embedding_cache import EmbeddingCache
+from local_faq_index import LocalFaqIndex
+from faq_storage import FaqVectorStorage
+import stage_timer
 
 class FaqRepository:
     qd_client: QdrantClient
+    async_qd_client: AsyncQdrantClient
     collection_name: str
+    embedding_model: TextEmbedding
+    embedding_cache: EmbeddingCache
+    local_index: LocalFaqIndex
     MODEL_HANDLE = "jinaai/jina-embeddings-v2-small-en"
-    # EMBEDDING_DIMENSIONALITY = 512
+    EMBEDDING_DIMENSIONALITY = 512
+
+    # "qdrant" queries the Qdrant server, "local" searches an in-process copy of the FAQ vectors
+    BACKEND = os.getenv("FAQ_BACKEND", "qdrant")
+    # optional file exported with local_faq_index.py, otherwise the local index is loaded from Qdrant
+    INDEX_FILE = os.getenv("FAQ_INDEX_FILE")
     
-    def __init__(self, db_server, collection_name):
-        self.qd_client = QdrantClient(db_server)
+    def __init__(self, db_server, collection_name, embedding_cache=None, backend=None, storage=None):
+        self.db_server = db_server
+        self._qd_client = None
+        self._async_qd_client = None
         self.collection_name = collection_name
+        self.embedding_model = None
+        self.embedding_cache = embedding_cache or EmbeddingCache(self.EMBEDDING_DIMENSIONALITY)
+        self.backend = backend or self.BACKEND
+        self.local_index = None
+        # quantization search params of the Qdrant queries, mirrored by the local index
+        self.storage = storage or FaqVectorStorage()
 
-    def vector_search(self, question, country, score_threshold, limit):
-        # print('vector_search is called on question: '+question)
-        
-        query_points = self.qd_client.query_points(
+    # The Qdrant clients are created on first use, so a preloading gunicorn
+    # master doesn't open connections that its forked workers would share.
+    @property
+    def qd_client(self):
+        if self._qd_client is None:
+            self._qd_client = QdrantClient(self.db_server)
+        return self._qd_client
+
+    @property
+    def async_qd_client(self):
+        if self._async_qd_client is None:
+            self._async_qd_client = AsyncQdrantClient(self.db_server)
+        return self._async_qd_client
+
+    def _get_embedding_model(self):
+        if self.embedding_model is None:
+            self.embedding_model = TextEmbedding(self.MODEL_HANDLE)
+        return self.embedding_model
+
+    def download_embedding_model(self):
+        # Downloads the model files into the fastembed cache without creating the
+        # onnxruntime session, which doesn't survive a fork. Safe in the gunicorn master.
+        TextEmbedding(self.MODEL_HANDLE, lazy_load=True)
+
+    def warm_up(self):
+        # Loads the model and embeds once, so the first request doesn't pay for it.
+        model = self._get_embedding_model()
+        list(model.query_embed(["warm up"]))
+        list(model.embed(["warm up"]))
+        if self.backend == "local":
+            self._get_local_index()
+
+    def _get_local_index(self):
+        if self.local_index is None:
+            if self.INDEX_FILE and os.path.exists(self.INDEX_FILE):
+                self.local_index = LocalFaqIndex.load(self.INDEX_FILE, storage=self.storage)
+            else:
+                self.local_index = LocalFaqIndex.from_qdrant(self.qd_client, self.collection_name, storage=self.storage)
+        return self.local_index
+
+    def embed_question(self, question):
+        vector = self.embedding_cache.get(question)
+        if vector is None:
+            model = self._get_embedding_model()
+            with stage_timer.stage("embed_question"):
+                vector = next(iter(model.query_embed(question)))
+            self.embedding_cache.put(question, vector)
+        return vector
+
+    def embed_questions(self, questions):
+        # Questions missing from the cache are embedded in one batched call.
+        vectors = [self.embedding_cache.get(question) for question in questions]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            model = self._get_embedding_model()
+            with stage_timer.stage("embed_question"):
+                embedded = list(model.query_embed([questions[i] for i in missing]))
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+                self.embedding_cache.put(questions[i], vector)
+        return vectors
+
+    def embed_texts(self, texts):
+        # Document embeddings of arbitrary texts, not cached (used by the local relevance evaluator).
+        return list(self._get_embedding_model().embed(texts))
+
+    def ingestion_version(self):
+        # All points of one ingestion run share the same "ingested_at" payload value.
+        points, _ = self.qd_client.scroll(collection_name=self.collection_name, limit=1, with_payload=["ingested_at"])
+        return points[0].payload.get("ingested_at") if points else None
+
+    def search_hits(self, question, country, score_threshold, limit, query_vector=None):
+        # Returns (point id, score, payload) tuples, best match first.
+        if query_vector is None:
+            query_vector = self.embed_question(question)
+
+        with stage_timer.stage("vector_search"):
+            if self.backend == "local":
+                return self._get_local_index().search(query_vector, country, score_threshold, limit)
+
+            query_points = self.qd_client.query_points(**self._query_args(query_vector, country, score_threshold, limit))
+
+        return [(point.id, point.score, point.payload) for point in query_points.points]
+
+    async def search_hits_async(self, question, country, score_threshold, limit, query_vector=None):
+        # The embedding is CPU bound and runs in a thread, the Qdrant query is awaited.
+        if query_vector is None:
+            query_vector = await asyncio.to_thread(self.embed_question, question)
+
+        with stage_timer.stage("vector_search"):
+            if self.backend == "local":
+                return self._get_local_index().search(query_vector, country, score_threshold, limit)
+
+            query_points = await self.async_qd_client.query_points(**self._query_args(query_vector, country, score_threshold, limit))
+
+        return [(point.id, point.score, point.payload) for point in query_points.points]
+
+    def search_hits_batch(self, questions, countries, score_threshold, limit, query_vectors=None):
+        # Same as search_hits for many questions, with one batched embedding
+        # call and one Qdrant batch query.
+        if query_vectors is None:
+            query_vectors = self.embed_questions(questions)
+
+        if self.backend == "local":
+            local_index = self._get_local_index()
+            return [local_index.search(vector, country, score_threshold, limit) for vector, country in zip(query_vectors, countries)]
+
+        requests = []
+        for query_vector, country in zip(query_vectors, countries):
+            query_args = self._query_args(query_vector, country, score_threshold, limit)
+            del query_args["collection_name"]
+            query_args["filter"] = query_args.pop("query_filter")
+            query_args["params"] = query_args.pop("search_params")
+            requests.append(models.QueryRequest(**query_args))
+
+        with stage_timer.stage("vector_search"):
+            responses = self.qd_client.query_batch_points(collection_name=self.collection_name, requests=requests)
+
+        return [[(point.id, point.score, point.payload) for point in response.points] for response in responses]
+
+    def _query_args(self, query_vector, country, score_threshold, limit):
+        return dict(
             collection_name=self.collection_name,
-            query=models.Document(
-                text=question,
-                model=self.MODEL_HANDLE 
-            ),
+            query=[float(x) for x in query_vector],
             query_filter=models.Filter( 
                 must=[
                     models.FieldCondition(
@@ -29,12 +168,24 @@ class FaqRepository:
             ),
             score_threshold = score_threshold,
             limit=limit,
+            search_params=self.storage.search_params(),
             with_payload=True
         )
 
+    def vector_search(self, question, country, score_threshold, limit, query_vector=None):
+        # print('vector_search is called on question: '+question)
+        # The payloads are copied with the search score added, see ContextAssembler.
         results = []
         
-        for point in query_points.points:
-            results.append(point.payload)
+        for _, score, payload in self.search_hits(question, country, score_threshold, limit, query_vector):
+            results.append({**payload, "score": score})
         
         return results
+
+    def vector_search_batch(self, questions, countries, score_threshold, limit, query_vectors=None):
+        hits_batch = self.search_hits_batch(questions, countries, score_threshold, limit, query_vectors)
+        return [[{**payload, "score": score} for _, score, payload in hits] for hits in hits_batch]
+
+    async def vector_search_async(self, question, country, score_threshold, limit, query_vector=None):
+        hits = await self.search_hits_async(question, country, score_threshold, limit, query_vector)
+        return [{**payload, "score": score} for _, score, payload in hits]
@@ -0,0 +1,68 @@
+import os
+from qdrant_client import models
+
+
+class FaqVectorStorage:
+    """Storage settings of the FAQ vectors, shared by the Qdrant collection and LocalFaqIndex.
+
+    float32: plain vectors (default)
+    int8:    scalar quantized vectors in RAM, 4x smaller
+    binary:  one bit per dimension in RAM, 32x smaller
+    With quantization, searches run on the quantized vectors and the best
+    `limit * OVERSAMPLING` candidates are rescored with the original vectors,
+    which Qdrant keeps on disk with ON_DISK.
+    """
+    MODES = ("float32", "int8", "binary")
+
+    MODE = os.getenv("FAQ_VECTOR_STORAGE", "float32")
+    ON_DISK = os.getenv("FAQ_VECTORS_ON_DISK", "1") == "1"
+    RESCORE = os.getenv("FAQ_QUANTIZATION_RESCORE", "1") == "1"
+    OVERSAMPLING = float(os.getenv("FAQ_QUANTIZATION_OVERSAMPLING", "0")) or None
+    # used without FAQ_QUANTIZATION_OVERSAMPLING, binary vectors lose more precision and need more candidates
+    DEFAULT_OVERSAMPLING = {"int8": 2.0, "binary": 4.0}
+    # quantile of the vector values mapped to the int8 range, outliers are clipped
+    INT8_QUANTILE = 0.99
+    # Sized for a few thousand FAQ entries per market: building and searching the
+    # graph is cheap at this size, so ef_construct and the search beam are raised
+    # above Qdrant's default of 100 for recall, which matters more with quantization.
+    HNSW_M = int(os.getenv("FAQ_HNSW_M", "16"))
+    HNSW_EF_CONSTRUCT = int(os.getenv("FAQ_HNSW_EF_CONSTRUCT", "128"))
+    HNSW_EF = int(os.getenv("FAQ_HNSW_EF", "128"))
+
+    def __init__(self, mode=None, on_disk=None, rescore=None, oversampling=None):
+        self.mode = mode or self.MODE
+        if self.mode not in self.MODES:
+            raise ValueError(f"Unknown FAQ vector storage: {self.mode}")
+        self.on_disk = self.ON_DISK if on_disk is None else on_disk
+        self.rescore = self.RESCORE if rescore is None else rescore
+        self.oversampling = oversampling or self.OVERSAMPLING or self.DEFAULT_OVERSAMPLING.get(self.mode, 1.0)
+
+    @property
+    def quantized(self):
+        return self.mode != "float32"
+
+    def vectors_config(self, size):
+        return models.VectorParams(
+            size=size,
+            distance=models.Distance.COSINE,
+            # the originals are only read for rescoring when the quantized vectors are in RAM
+            on_disk=self.on_disk and self.quantized,
+        )
+
+    def quantization_config(self):
+        if self.mode == "int8":
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=self.INT8_QUANTILE, always_ram=True)
+            )
+        if self.mode == "binary":
+            return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def hnsw_config(self):
+        return models.HnswConfigDiff(m=self.HNSW_M, ef_construct=self.HNSW_EF_CONSTRUCT)
+
+    def search_params(self):
+        quantization = None
+        if self.quantized:
+            quantization = models.QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
+        return models.SearchParams(hnsw_ef=self.HNSW_EF, quantization=quantization)
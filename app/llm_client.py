@@ -0,0 +1,328 @@
+import os
+import random
+import asyncio
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from time import time, sleep
+import numpy as np
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+import notebooks.keys_secret as keys_secret
+import metrics
+from llm_transport import LlmTransport
+
+logger = logging.getLogger('gunicorn.error')
+
+
+class LlmUnavailableError(Exception):
+    """The completion failed after all retries, ran past its deadline or was rejected by the open circuit."""
+
+
+class CircuitOpenError(LlmUnavailableError):
+    pass
+
+
+def is_retryable(error):
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    """Fails fast while the upstream error rate is high.
+
+    closed:    calls pass, outcomes of the last WINDOW seconds are counted
+    open:      calls are rejected for OPEN_SECONDS once at least MIN_CALLS calls
+               in the window failed with a rate of ERROR_RATE or more
+    half_open: one probe call passes, its outcome closes or re-opens the circuit,
+               outcomes of calls that started before the circuit opened are ignored
+    """
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+    MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+    WINDOW = float(os.getenv("LLM_BREAKER_WINDOW", "30"))
+    OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+
+    def __init__(self, name, error_rate=None, min_calls=None, window=None, open_seconds=None):
+        self.name = name
+        self.error_rate = error_rate or self.ERROR_RATE
+        self.min_calls = min_calls or self.MIN_CALLS
+        self.window = window or self.WINDOW
+        self.open_seconds = open_seconds or self.OPEN_SECONDS
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe = None
+        self.outcomes = deque()
+        self._lock = threading.Lock()
+        self._set_state("closed")
+
+    def _set_state(self, state):
+        if state == "open" and self.state != "open":
+            metrics.inc("llm_circuit_opened_total", help_text="Times the LLM circuit breaker opened", client=self.name)
+            logger.warning(f"LLM circuit {self.name} opened.")
+        self.state = state
+        metrics.set_gauge("llm_circuit_state", self.STATES[state], help_text="LLM circuit breaker state (0 closed, 1 half open, 2 open)", client=self.name)
+
+    def allow(self):
+        # False when the call is rejected, otherwise its ticket for record().
+        with self._lock:
+            if self.state == "open" and time() - self.opened_at >= self.open_seconds:
+                self._set_state("half_open")
+                self.probing = False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                self.probe = object()
+                return self.probe
+            if self.state == "closed":
+                return True
+        metrics.inc("llm_circuit_rejections_total", help_text="LLM calls rejected by the open circuit", client=self.name)
+        return False
+
+    def record(self, success, ticket=True):
+        now = time()
+        with self._lock:
+            if self.state == "half_open":
+                if ticket is not self.probe:
+                    return
+                self.probing = False
+                self.probe = None
+                self.outcomes.clear()
+                if success:
+                    self._set_state("closed")
+                else:
+                    self.opened_at = now
+                    self._set_state("open")
+                return
+
+            self.outcomes.append((now, success))
+            while self.outcomes and self.outcomes[0][0] < now - self.window:
+                self.outcomes.popleft()
+            failures = sum(1 for _, ok in self.outcomes if not ok)
+            if self.state == "closed" and len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.error_rate:
+                self.opened_at = now
+                self._set_state("open")
+
+
+class LatencyTracker:
+    # Recent latencies of successful calls, the hedge delay is their HEDGE_QUANTILE.
+
+    def __init__(self, size=200):
+        self.latencies = deque(maxlen=size)
+
+    def add(self, latency):
+        self.latencies.append(latency)
+
+    def quantile(self, q, default):
+        if len(self.latencies) < 20:
+            return default
+        return float(np.quantile(np.fromiter(self.latencies, dtype=np.float64), q))
+
+
+class LlmClient:
+    """OpenAI chat completions with deadlines, retries, hedging and a circuit breaker.
+
+    Every attempt gets at most TIMEOUT seconds, and all attempts of a call together
+    at most DEADLINE seconds. Retryable errors (timeouts, connection errors, 408, 409,
+    429 and 5xx) are retried up to MAX_RETRIES times with full jitter backoff. With
+    HEDGE a duplicate request is sent when the first one hasn't answered after the
+    HEDGE_QUANTILE latency of the operation, the first answer wins. Streamed calls are
+    retried only until the stream is opened and are not hedged, iterate them with
+    stream_chunks() so a stream breaking off raises LlmUnavailableError as well.
+    """
+    name: str
+    breaker: CircuitBreaker
+
+    TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+    DEADLINE = float(os.getenv("LLM_DEADLINE", "45"))
+    MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+    RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+    HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+    HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+    # used until enough latencies were seen, and as the lower bound of the hedge delay
+    HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+    HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "16"))
+
+    def __init__(self, name="openai", timeout=None, deadline=None, max_retries=None, hedge=None, breaker=None, transport=None):
+        self.name = name
+        self.timeout = timeout or self.TIMEOUT
+        self.deadline = deadline or self.DEADLINE
+        self.max_retries = self.MAX_RETRIES if max_retries is None else max_retries
+        self.hedge = self.HEDGE if hedge is None else hedge
+        self.breaker = breaker or CircuitBreaker(name)
+        # retries are done here, not by the OpenAI client
+        self.openai_client = OpenAI(api_key=keys_secret.openai_api_key, timeout=self.timeout, max_retries=0)
+        self.async_openai_client = AsyncOpenAI(api_key=keys_secret.openai_api_key, timeout=self.timeout, max_retries=0)
+        # passthrough, record or replay (LLM_TRANSPORT)
+        self.transport = transport or LlmTransport()
+        self.latencies = {}
+        self.executor = ThreadPoolExecutor(max_workers=self.HEDGE_WORKERS, thread_name_prefix=f"{name}-hedge") if self.hedge else None
+
+    def _tracker(self, operation):
+        tracker = self.latencies.get(operation)
+        if tracker is None:
+            tracker = self.latencies.setdefault(operation, LatencyTracker())
+        return tracker
+
+    def _hedge_delay(self, operation):
+        return max(self.HEDGE_MIN_DELAY, self._tracker(operation).quantile(self.HEDGE_QUANTILE, self.HEDGE_MIN_DELAY))
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.RETRY_MAX_DELAY, self.RETRY_BASE_DELAY * 2 ** attempt))
+
+    def _count(self, operation, outcome):
+        metrics.inc("llm_requests_total", help_text="LLM calls by outcome", client=self.name, operation=operation, outcome=outcome)
+
+    def _attempts(self, operation):
+        # Yields (attempt, timeout of the attempt, deadline of the call) until the retries or the deadline run out.
+        deadline = time() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time()
+            if remaining <= 0:
+                return
+            if attempt:
+                metrics.inc("llm_retries_total", help_text="Retried LLM calls", client=self.name, operation=operation)
+            yield attempt, min(self.timeout, remaining), deadline
+
+    def create(self, operation="answer", **kwargs):
+        # Same arguments as chat.completions.create, raises LlmUnavailableError when the call fails.
+        ticket = self.breaker.allow()
+        if not ticket:
+            self._count(operation, "rejected")
+            raise CircuitOpenError(f"LLM circuit {self.name} is open")
+
+        last_error = None
+        for attempt, timeout, deadline in self._attempts(operation):
+            start_time = time()
+            try:
+                if self.hedge and not kwargs.get("stream"):
+                    response = self._hedged_call(operation, timeout, kwargs)
+                else:
+                    response = self.transport.create(self.openai_client.chat.completions.create, {"timeout": timeout, **kwargs})
+            except Exception as e:
+                if not is_retryable(e):
+                    # e.g. a bad request, the upstream itself is healthy
+                    self.breaker.record(True, ticket)
+                    self._count(operation, "error")
+                    raise
+                last_error = e
+                self.breaker.record(False, ticket)
+                logger.warning(f"LLM {operation} attempt {attempt + 1} failed: {e!r}")
+                if attempt < self.max_retries:
+                    sleep(max(0.0, min(self._backoff(attempt), deadline - time())))
+                continue
+            self._tracker(operation).add(time() - start_time)
+            self.breaker.record(True, ticket)
+            self._count(operation, "success")
+            return response
+
+        self._count(operation, "failed")
+        raise LlmUnavailableError(f"LLM {operation} failed after retries: {last_error!r}") from last_error
+
+    def _stream_error(self, operation, error):
+        self._count(operation, "broken_stream")
+        logger.warning(f"LLM {operation} stream broke off: {error!r}")
+        return LlmUnavailableError(f"LLM {operation} stream broke off: {error!r}")
+
+    def stream_chunks(self, operation, stream):
+        # Chunks of a stream opened with create(stream=True).
+        try:
+            yield from stream
+        except (openai.APIError, httpx.HTTPError, TimeoutError) as e:
+            raise self._stream_error(operation, e) from e
+
+    async def astream_chunks(self, operation, stream):
+        try:
+            async for chunk in stream:
+                yield chunk
+        except (openai.APIError, httpx.HTTPError, TimeoutError) as e:
+            raise self._stream_error(operation, e) from e
+
+    def _hedged_call(self, operation, timeout, kwargs):
+        call = lambda: self.transport.create(self.openai_client.chat.completions.create, {"timeout": timeout, **kwargs})
+        futures = [self.executor.submit(call)]
+        done, _ = wait(futures, timeout=self._hedge_delay(operation))
+        if not done:
+            metrics.inc("llm_hedges_total", help_text="Hedged duplicate LLM requests", client=self.name, operation=operation)
+            futures.append(self.executor.submit(call))
+
+        # The first successful answer wins, the other request still runs to completion.
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"LLM {operation} timed out after {timeout}s")
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        metrics.inc("llm_hedge_wins_total", help_text="Hedged LLM requests answering first", client=self.name, operation=operation)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def acreate(self, operation="answer", **kwargs):
+        ticket = self.breaker.allow()
+        if not ticket:
+            self._count(operation, "rejected")
+            raise CircuitOpenError(f"LLM circuit {self.name} is open")
+
+        last_error = None
+        for attempt, timeout, deadline in self._attempts(operation):
+            start_time = time()
+            try:
+                if self.hedge and not kwargs.get("stream"):
+                    response = await self._hedged_call_async(operation, timeout, kwargs)
+                else:
+                    response = await self.transport.acreate(self.async_openai_client.chat.completions.create, {"timeout": timeout, **kwargs})
+            except Exception as e:
+                if not is_retryable(e):
+                    # e.g. a bad request, the upstream itself is healthy
+                    self.breaker.record(True, ticket)
+                    self._count(operation, "error")
+                    raise
+                last_error = e
+                self.breaker.record(False, ticket)
+                logger.warning(f"LLM {operation} attempt {attempt + 1} failed: {e!r}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(max(0.0, min(self._backoff(attempt), deadline - time())))
+                continue
+            self._tracker(operation).add(time() - start_time)
+            self.breaker.record(True, ticket)
+            self._count(operation, "success")
+            return response
+
+        self._count(operation, "failed")
+        raise LlmUnavailableError(f"LLM {operation} failed after retries: {last_error!r}") from last_error
+
+    async def _hedged_call_async(self, operation, timeout, kwargs):
+        call = lambda: asyncio.ensure_future(self.transport.acreate(self.async_openai_client.chat.completions.create, {"timeout": timeout, **kwargs}))
+        tasks = [call()]
+        done, _ = await asyncio.wait(tasks, timeout=self._hedge_delay(operation))
+        if not done:
+            metrics.inc("llm_hedges_total", help_text="Hedged duplicate LLM requests", client=self.name, operation=operation)
+            tasks.append(call())
+
+        # The first successful answer wins and the other request is cancelled.
+        pending, error = set(tasks), None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise TimeoutError(f"LLM {operation} timed out after {timeout}s")
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            metrics.inc("llm_hedge_wins_total", help_text="Hedged LLM requests answering first", client=self.name, operation=operation)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
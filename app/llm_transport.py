@@ -0,0 +1,243 @@
+"""Pluggable transport of the OpenAI chat completion calls, selected with LLM_TRANSPORT.
+
+passthrough: calls OpenAI (default)
+record:      calls OpenAI and stores every response with its latency in the response store
+replay:      answers from the response store without calling OpenAI, with the recorded
+             latency or none (LLM_REPLAY_LATENCY=zero). Requests missing from the
+             store fail with ReplayMissError.
+
+Requests are identified by a fingerprint of their arguments (model, messages, stream, ...),
+so a replay only matches when the prompts are exactly the same as when recording.
+Show a summary of a store: python app/llm_transport.py [store path]
+"""
+import os
+import sys
+import json
+import zlib
+import fcntl
+import struct
+import asyncio
+import hashlib
+import inspect
+import threading
+from time import time, sleep
+from types import SimpleNamespace
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+import metrics
+
+
+class ReplayMissError(Exception):
+    pass
+
+
+def fingerprint(kwargs):
+    # The timeout of an attempt doesn't change the response.
+    request = {key: value for key, value in kwargs.items() if key != "timeout"}
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ResponseStore:
+    """Append-only store of recorded responses with an append-only index.
+
+    <path>.data holds the records, each a 4 byte length followed by zlib compressed JSON.
+    <path>.index has one "<fingerprint> <offset> <length>" line per record, the last
+    record of a fingerprint wins. Appends of all processes are serialized with flock,
+    the index of a process is refreshed when a fingerprint is not found.
+    """
+    HEADER = struct.Struct("<I")
+
+    def __init__(self, path):
+        self.data_file = f"{path}.data"
+        self.index_file = f"{path}.index"
+        os.makedirs(os.path.dirname(os.path.abspath(self.data_file)), exist_ok=True)
+        self.index = {}
+        self.index_position = 0
+        self._fd = None
+        self._lock = threading.Lock()
+        if os.path.exists(self.data_file) and not os.path.exists(self.index_file):
+            self._rebuild_index()
+        self._read_index()
+
+    def __len__(self):
+        return len(self.index)
+
+    def _read_index(self):
+        # Reads the index lines appended since the last call.
+        if not os.path.exists(self.index_file):
+            return
+        data_size = os.path.getsize(self.data_file) if os.path.exists(self.data_file) else 0
+        with open(self.index_file, "rb") as f:
+            f.seek(self.index_position)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # line still being written
+                self.index_position += len(line)
+                key, offset, length = line.split()
+                if int(offset) + int(length) <= data_size:
+                    self.index[key.decode()] = (int(offset), int(length))
+
+    def _rebuild_index(self):
+        with open(self.data_file, "rb") as data, open(self.index_file, "w") as index:
+            offset = 0
+            while True:
+                header = data.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+                (length,) = self.HEADER.unpack(header)
+                payload = data.read(length)
+                if len(payload) < length:
+                    break
+                record = json.loads(zlib.decompress(payload))
+                index.write(f"{record['fingerprint']} {offset + self.HEADER.size} {length}\n")
+                offset += self.HEADER.size + length
+
+    def get(self, key):
+        with self._lock:
+            if key not in self.index:
+                self._read_index()
+            location = self.index.get(key)
+            if location is None:
+                return None
+            if self._fd is None:
+                self._fd = os.open(self.data_file, os.O_RDONLY)
+        offset, length = location
+        return json.loads(zlib.decompress(os.pread(self._fd, length, offset)))
+
+    def put(self, key, record):
+        payload = zlib.compress(json.dumps({"fingerprint": key, **record}).encode("utf-8"))
+        with self._lock, open(self.data_file, "ab") as data:
+            fcntl.flock(data, fcntl.LOCK_EX)
+            try:
+                offset = data.seek(0, os.SEEK_END)
+                data.write(self.HEADER.pack(len(payload)) + payload)
+                data.flush()
+                with open(self.index_file, "a") as index:
+                    index.write(f"{key} {offset + self.HEADER.size} {len(payload)}\n")
+            finally:
+                fcntl.flock(data, fcntl.LOCK_UN)
+            self.index[key] = (offset + self.HEADER.size, len(payload))
+
+
+class LlmTransport:
+    mode: str
+    store: ResponseStore
+
+    MODE = os.getenv("LLM_TRANSPORT", "passthrough")
+    STORE = os.getenv("LLM_TRANSPORT_STORE", "../tmp_datastore/llm_store")
+    # "recorded" waits as long as the recorded call took, "zero" answers right away
+    REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "recorded")
+
+    def __init__(self, mode=None, store_path=None, replay_latency=None):
+        self.mode = mode or self.MODE
+        if self.mode not in ("passthrough", "record", "replay"):
+            raise ValueError(f"Unknown LLM transport: {self.mode}")
+        self.replay_latency = replay_latency or self.REPLAY_LATENCY
+        self.store = ResponseStore(store_path or self.STORE) if self.mode != "passthrough" else None
+
+    def _count(self, result):
+        metrics.inc("llm_transport_requests_total", help_text="LLM calls by transport result", mode=self.mode, result=result)
+
+    def _delay(self, seconds):
+        return seconds if self.replay_latency == "recorded" else 0.0
+
+    def _recorded(self, kwargs):
+        key = fingerprint(kwargs)
+        record = self.store.get(key)
+        if record is None:
+            self._count("miss")
+            raise ReplayMissError(f"No recorded response for request {key} in {self.store.data_file}")
+        self._count("hit")
+        return record
+
+    def create(self, create_fn, kwargs):
+        # create_fn(**kwargs) is the OpenAI chat.completions.create call.
+        if self.mode == "passthrough":
+            return create_fn(**kwargs)
+
+        if self.mode == "replay":
+            record = self._recorded(kwargs)
+            if "chunks" in record:
+                return self._replay_stream(record)
+            sleep(self._delay(record["latency"]))
+            return ChatCompletion.model_validate(record["response"])
+
+        start_time = time()
+        response = create_fn(**kwargs)
+        if kwargs.get("stream"):
+            return self._record_stream(fingerprint(kwargs), start_time, response)
+        self.store.put(fingerprint(kwargs), {"latency": time() - start_time, "response": response.model_dump(mode="json")})
+        self._count("recorded")
+        return response
+
+    async def acreate(self, create_fn, kwargs):
+        if self.mode == "passthrough":
+            return await create_fn(**kwargs)
+
+        if self.mode == "replay":
+            record = self._recorded(kwargs)
+            if "chunks" in record:
+                return self._replay_stream_async(record)
+            await asyncio.sleep(self._delay(record["latency"]))
+            return ChatCompletion.model_validate(record["response"])
+
+        start_time = time()
+        response = await create_fn(**kwargs)
+        if kwargs.get("stream"):
+            return self._record_stream_async(fingerprint(kwargs), start_time, response)
+        await asyncio.to_thread(self.store.put, fingerprint(kwargs), {"latency": time() - start_time, "response": response.model_dump(mode="json")})
+        self._count("recorded")
+        return response
+
+    # Streams are stored as [seconds since the previous chunk, chunk] pairs, the
+    # first delay includes the time until the stream was opened.
+
+    def _replay_stream(self, record):
+        for delay, chunk in record["chunks"]:
+            sleep(self._delay(delay))
+            yield ChatCompletionChunk.model_validate(chunk)
+
+    async def _replay_stream_async(self, record):
+        for delay, chunk in record["chunks"]:
+            await asyncio.sleep(self._delay(delay))
+            yield ChatCompletionChunk.model_validate(chunk)
+
+    def _record_stream(self, key, start_time, stream):
+        # Only streams read to the end are stored.
+        chunks, last_time = [], start_time
+        for chunk in stream:
+            now = time()
+            chunks.append([now - last_time, chunk.model_dump(mode="json")])
+            last_time = now
+            yield chunk
+        self.store.put(key, {"latency": last_time - start_time, "chunks": chunks})
+        self._count("recorded")
+
+    async def _record_stream_async(self, key, start_time, stream):
+        chunks, last_time = [], start_time
+        async for chunk in stream:
+            now = time()
+            chunks.append([now - last_time, chunk.model_dump(mode="json")])
+            last_time = now
+            yield chunk
+        await asyncio.to_thread(self.store.put, key, {"latency": last_time - start_time, "chunks": chunks})
+        self._count("recorded")
+
+
+def wrap_client(openai_client, transport=None):
+    # OpenAI or AsyncOpenAI client whose chat.completions.create goes through the
+    # transport, for scripts and notebooks that call OpenAI directly.
+    transport = transport or LlmTransport()
+    create_fn = openai_client.chat.completions.create
+    if inspect.iscoroutinefunction(create_fn):
+        async def create(**kwargs):
+            return await transport.acreate(create_fn, kwargs)
+    else:
+        def create(**kwargs):
+            return transport.create(create_fn, kwargs)
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+if __name__ == "__main__":
+    store = ResponseStore(sys.argv[1] if len(sys.argv) > 1 else LlmTransport.STORE)
+    size = os.path.getsize(store.data_file) if os.path.exists(store.data_file) else 0
+    print(f"{store.data_file}: {len(store)} recorded responses, {size / 1024:.1f} KiB")
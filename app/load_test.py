@@ -0,0 +1,180 @@
+"""Sends /question and /feedback requests to the API server at a fixed rate and reports throughput and latency.
+
+The workload is generated from the ground truth questions with a fixed seed, so every
+run with the same arguments sends the same requests in the same order. Results are
+saved as JSON and can be compared with an earlier run to catch latency regressions.
+Run from the root folder with the API server running:
+python app/load_test.py --rps 5 --duration 60 --compare tmp_datastore/load_tests/baseline.json
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+from time import perf_counter, sleep
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+COMPARED_STATS = ["p50_ms", "p95_ms", "p99_ms"]
+
+
+def build_workload(ground_truth, count, feedback_ratio, seed):
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(count):
+        record = rng.choice(ground_truth)
+        workload.append({
+            "question": record["generated_question"],
+            "courier_id": record["ground_truth_courier"]["index"],
+            "feedback": rng.choice([-1, 1]) if rng.random() < feedback_ratio else None,
+        })
+    return workload
+
+
+def post_json(url, body, timeout):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+class LoadTest:
+    def __init__(self, url, workload, rps, workers, timeout):
+        self.url = url.rstrip("/")
+        self.workload = workload
+        self.rps = rps
+        self.workers = workers
+        self.timeout = timeout
+        self.results = {"/question": [], "/feedback": []}
+        self._lock = threading.Lock()
+
+    def run(self):
+        start_time = perf_counter()
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="load-test") as pool:
+            for i, item in enumerate(self.workload):
+                # Open loop: requests are sent on schedule, also when the server falls behind.
+                scheduled_at = start_time + i / self.rps
+                delay = scheduled_at - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+                pool.submit(self._send, item, scheduled_at)
+        return perf_counter() - start_time
+
+    def _send(self, item, scheduled_at):
+        # Latency is measured from the scheduled send time, so time spent waiting
+        # for a free driver thread counts too (no coordinated omission).
+        response = self._request("/question", {"question": item["question"], "courier_id": item["courier_id"]}, scheduled_at)
+        if response is not None and item["feedback"] is not None:
+            self._request("/feedback", {"conversation_id": response["conversation_id"], "feedback": item["feedback"]}, perf_counter())
+
+    def _request(self, endpoint, body, started_at):
+        response, error = None, None
+        try:
+            response = post_json(self.url + endpoint, body, self.timeout)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            error = str(e)
+        with self._lock:
+            self.results[endpoint].append((perf_counter() - started_at, error))
+        return response
+
+
+def endpoint_stats(results, elapsed):
+    latencies_ms = np.array([latency for latency, error in results if error is None]) * 1000
+    stats = {
+        "requests": len(results),
+        "errors": sum(error is not None for _, error in results),
+        "throughput_rps": round(len(latencies_ms) / elapsed, 3) if elapsed else 0.0,
+    }
+    if len(latencies_ms):
+        stats.update({
+            "mean_ms": round(float(latencies_ms.mean()), 3),
+            "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+            "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+            "max_ms": round(float(latencies_ms.max()), 3),
+        })
+    return stats
+
+
+def compare_reports(baseline, report, max_regression):
+    # Relative change of each latency percentile and of the throughput, positive is worse.
+    comparison, regressions = {}, []
+    for endpoint, stats in report["endpoints"].items():
+        baseline_stats = baseline.get("endpoints", {}).get(endpoint, {})
+        changes = {}
+        for stat in COMPARED_STATS + ["throughput_rps"]:
+            if not baseline_stats.get(stat) or stat not in stats:
+                continue
+            change = (stats[stat] - baseline_stats[stat]) / baseline_stats[stat]
+            if stat == "throughput_rps":
+                change = -change
+            changes[stat] = round(change, 4)
+            if change > max_regression:
+                regressions.append(f"{endpoint} {stat}: {baseline_stats[stat]} -> {stats[stat]}")
+        comparison[endpoint] = changes
+    return comparison, regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:9696")
+    parser.add_argument("--rps", type=float, default=5, help="target /question requests per second")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of load")
+    parser.add_argument("--feedback-ratio", type=float, default=0.3, help="share of answers followed by a /feedback request")
+    parser.add_argument("--ground-truth", default="notebooks/evaluation_ground_truth.json")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=256, help="maximum concurrent requests")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", default=None, help="result file, default tmp_datastore/load_tests/<time>-<commit>.json")
+    parser.add_argument("--compare", default=None, help="earlier result file to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.1, help="fail when a latency percentile or the throughput is this much worse")
+    args = parser.parse_args()
+
+    with open(args.ground_truth) as f:
+        ground_truth = json.load(f)
+    workload = build_workload(ground_truth, int(args.rps * args.duration), args.feedback_ratio, args.seed)
+
+    load_test = LoadTest(args.url, workload, args.rps, args.workers, args.timeout)
+    elapsed = load_test.run()
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {key: getattr(args, key) for key in ["url", "rps", "duration", "feedback_ratio", "seed", "workers"]},
+        "elapsed_s": round(elapsed, 3),
+        "endpoints": {endpoint: endpoint_stats(results, elapsed) for endpoint, results in load_test.results.items()},
+    }
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report["baseline"] = {"file": args.compare, "commit": baseline.get("commit")}
+        report["comparison"], regressions = compare_reports(baseline, report, args.max_regression)
+        report["regressions"] = regressions
+
+    output = args.output or f"tmp_datastore/load_tests/{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit or 'unknown'}.json"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Saved load test results to {output}.")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
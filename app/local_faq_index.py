@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import math
+import numpy as np
+from qdrant_client import QdrantClient
+from faq_storage import FaqVectorStorage
+
+
+class LocalFaqIndex:
+    """In-process FAQ vector index, an alternative to querying Qdrant.
+
+    All FAQ vectors are kept in one contiguous float32 matrix per country. Each
+    country matrix also contains the FAQ entries for "all" countries, so a search
+    is a single matrix-vector product followed by an argpartition top-k.
+
+    With int8 or binary FaqVectorStorage the country matrices hold quantized
+    vectors, like the Qdrant collection: the best `limit * oversampling`
+    candidates by approximate score are rescored with the float32 vectors.
+    """
+    ids: np.ndarray
+    vectors: np.ndarray
+    payloads: list
+
+    ALL_COUNTRIES = "all"
+
+    def __init__(self, ids, vectors, payloads, storage=None):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.ids = np.asarray(ids)
+        self.vectors = vectors / norms
+        self.payloads = payloads
+        self.storage = storage or FaqVectorStorage()
+        if self.storage.mode == "int8":
+            # One value range for all vectors, like Qdrant's scalar quantization.
+            tail = (1 - self.storage.INT8_QUANTILE) / 2
+            low, high = np.quantile(self.vectors, [tail, 1 - tail])
+            self._int8_low, self._int8_scale = float(low), float(high - low) / 255 or 1.0
+        self._partitions = self._build_partitions()
+
+    def _build_partitions(self):
+        countries = np.array([payload.get("country") for payload in self.payloads])
+        is_all = countries == self.ALL_COUNTRIES
+        partitions = {}
+        for country in set(countries.tolist()) | {self.ALL_COUNTRIES}:
+            rows = np.flatnonzero(is_all | (countries == country))
+            partitions[country] = (rows, self._quantize(self.vectors[rows]))
+        return partitions
+
+    def _quantize(self, vectors):
+        if self.storage.mode == "int8":
+            return np.clip(np.round((vectors - self._int8_low) / self._int8_scale), 0, 255).astype(np.uint8)
+        if self.storage.mode == "binary":
+            return np.packbits(vectors > 0, axis=1)
+        return np.ascontiguousarray(vectors)
+
+    def _scores(self, matrix, query_vector):
+        # Cosine scores of all vectors of a country matrix, approximate when quantized.
+        if self.storage.mode == "int8":
+            return self._int8_low * query_vector.sum() + self._int8_scale * (matrix @ query_vector)
+        if self.storage.mode == "binary":
+            dimensions = self.vectors.shape[1]
+            distances = np.bitwise_count(matrix ^ np.packbits(query_vector > 0)).sum(axis=1, dtype=np.int64)
+            return 1.0 - 2.0 * distances / dimensions
+        return matrix @ query_vector
+
+    def memory_usage(self):
+        # Bytes of the float32 vectors and of the country matrices searched per query.
+        return {
+            "vectors": int(self.vectors.nbytes),
+            "search_matrices": int(sum(matrix.nbytes for _, matrix in self._partitions.values())),
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query_vector, country, score_threshold, limit):
+        # Same semantics as the Qdrant query: FAQ entries of the country or "all",
+        # cosine score >= score_threshold, best `limit` hits first.
+        rows, matrix = self._partitions.get(country, self._partitions[self.ALL_COUNTRIES])
+        if not len(rows) or limit <= 0:
+            return []
+
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+        scores = self._scores(matrix, query_vector)
+
+        candidates = limit
+        if self.storage.quantized and self.storage.rescore:
+            candidates = math.ceil(limit * self.storage.oversampling)
+        k = min(candidates, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        if self.storage.quantized and self.storage.rescore:
+            scores = np.zeros(len(rows), dtype=np.float32)
+            scores[top] = self.vectors[rows[top]] @ query_vector
+        top = top[np.argsort(-scores[top], kind="stable")][:limit]
+        top = top[scores[top] >= score_threshold]
+
+        return [(self.ids[rows[i]].item(), float(scores[i]), self.payloads[rows[i]]) for i in top]
+
+    @classmethod
+    def from_qdrant(cls, qd_client, collection_name, batch_size=256, storage=None):
+        ids, vectors, payloads = [], [], []
+        offset = None
+        while True:
+            points, offset = qd_client.scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            for point in points:
+                ids.append(point.id)
+                vectors.append(point.vector)
+                payloads.append(point.payload)
+            if offset is None:
+                break
+
+        print(f"Loaded {len(ids)} FAQ vectors from Qdrant collection {collection_name}.")
+        return cls(ids, np.array(vectors, dtype=np.float32).reshape(len(ids), -1), payloads, storage)
+
+    @classmethod
+    def from_csv(cls, source_faq_data_file, model_handle, storage=None):
+        # Builds the index without Qdrant, e.g. as a Qdrant stand-in for load tests.
+        # Point ids are the CSV row numbers, like in faq_ingestion.py.
+        import pandas as pd
+        from fastembed import TextEmbedding
+        from faq_ingestion import COUNTRY_CODES
+
+        faq_df = pd.read_csv(source_faq_data_file)
+        faq_df['country'] = faq_df['country'].str.lower().replace(COUNTRY_CODES)
+        payloads = faq_df.to_dict('records')
+        texts = [payload['question'] + ' ' + payload['answer'] for payload in payloads]
+        vectors = np.array(list(TextEmbedding(model_handle).embed(texts)), dtype=np.float32)
+
+        print(f"Embedded {len(payloads)} FAQ entries from {source_faq_data_file}.")
+        return cls(np.arange(len(payloads)), vectors, payloads, storage)
+
+    def save(self, path):
+        np.savez(path, ids=self.ids, vectors=self.vectors, payloads=np.array(json.dumps(self.payloads)))
+
+    @classmethod
+    def load(cls, path, storage=None):
+        # The file holds the float32 vectors, they are quantized when loading.
+        with np.load(path) as data:
+            return cls(data["ids"], data["vectors"], json.loads(data["payloads"].item()), storage)
+
+
+if __name__ == '__main__':
+    # Exports the Qdrant FAQ collection to a file that can be used with FAQ_INDEX_FILE.
+    # python app/local_faq_index.py tmp_datastore/faq_index.npz
+    # python app/local_faq_index.py tmp_datastore/faq_index.npz dataset/couriers_faq.csv builds it from the CSV file instead
+    output_file = sys.argv[1] if len(sys.argv) > 1 else "tmp_datastore/faq_index.npz"
+    if len(sys.argv) > 2:
+        index = LocalFaqIndex.from_csv(sys.argv[2], "jinaai/jina-embeddings-v2-small-en")
+    else:
+        qd_client = QdrantClient(os.environ.get("QD_SERVER", "localhost:6333"))
+        index = LocalFaqIndex.from_qdrant(qd_client, "courier_faq")
+    index.save(output_file)
+    print(f"Saved {len(index)} FAQ vectors to {output_file}.")
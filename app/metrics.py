@@ -0,0 +1,95 @@
+# Minimal in-process metrics registry rendered in Prometheus text format.
+# Every gunicorn worker keeps its own values.
+import threading
+
+_lock = threading.Lock()
+_metrics = {}
+_gauge_callbacks = []
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _metric(name, metric_type, help_text):
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = {"type": metric_type, "help": help_text or name, "values": {}}
+        _metrics[name] = metric
+    return metric
+
+
+def inc(name, value=1, help_text=None, **labels):
+    with _lock:
+        values = _metric(name, "counter", help_text)["values"]
+        key = _key(labels)
+        values[key] = values.get(key, 0) + value
+
+
+def set_gauge(name, value, help_text=None, **labels):
+    with _lock:
+        _metric(name, "gauge", help_text)["values"][_key(labels)] = value
+
+
+def observe(name, value, help_text=None, **labels):
+    # Exposed as a Prometheus summary without quantiles (_count and _sum).
+    with _lock:
+        values = _metric(name, "summary", help_text)["values"]
+        key = _key(labels)
+        count, total = values.get(key, (0, 0.0))
+        values[key] = (count + 1, total + value)
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def observe_histogram(name, value, buckets=DEFAULT_BUCKETS, help_text=None, **labels):
+    # Exposed as a Prometheus histogram with cumulative le buckets, _count and _sum.
+    with _lock:
+        metric = _metric(name, "histogram", help_text)
+        metric.setdefault("buckets", buckets)
+        values = metric["values"]
+        key = _key(labels)
+        bucket_counts, count, total = values.get(key, ([0] * len(metric["buckets"]), 0, 0.0))
+        for i, bound in enumerate(metric["buckets"]):
+            if value <= bound:
+                bucket_counts[i] += 1
+        values[key] = (bucket_counts, count + 1, total + value)
+
+
+def register_gauge_callback(callback):
+    # callback() is called on every scrape and sets gauges that are cheaper to read on demand
+    _gauge_callbacks.append(callback)
+
+
+def _format_labels(key, extra=()):
+    labels = list(key) + list(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def render():
+    for callback in _gauge_callbacks:
+        callback()
+
+    lines = []
+    with _lock:
+        for name, metric in sorted(_metrics.items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, value in metric["values"].items():
+                if metric["type"] == "histogram":
+                    bucket_counts, count, total = value
+                    for bound, bucket_count in zip(metric["buckets"], bucket_counts):
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {bucket_count}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_count{_format_labels(key)} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {total}")
+                elif metric["type"] == "summary":
+                    count, total = value
+                    lines.append(f"{name}_count{_format_labels(key)} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {total}")
+                else:
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,17 @@
+"""Brings the conversations database of an existing deployment up to date.
+
+setup_dbs.py recreates the tables, this only adds what newer versions need
+(the conversation history indexes) and can run while the server is serving.
+Run from the root folder: python app/migrate_db.py
+"""
+from conversation_repository import ConversationRepository
+
+
+def main():
+    print("Creating missing indexes of the conversations database.")
+    ConversationRepository().create_indexes()
+    print("Migration completed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# Token usage and cost of OpenAI chat completions.
+import logging
+import metrics
+
+logger = logging.getLogger('gunicorn.error')
+
+# OpenAI only caches prompts with at least this many tokens (then in steps of 128
+# tokens), shorter prompts always report 0 cached tokens.
+MIN_CACHED_PROMPT_TOKENS = 1024
+
+# USD per 1K tokens. Cached input tokens are prompt tokens served from the
+# provider's prompt prefix cache, billed at a lower rate.
+PRICING = {
+    "gpt-4o-mini": {"input": 0.00015, "cached_input": 0.000075, "output": 0.0006},
+    "gpt-4o": {"input": 0.0025, "cached_input": 0.00125, "output": 0.01},
+    "gpt-4.1-nano": {"input": 0.0001, "cached_input": 0.000025, "output": 0.0004},
+    "gpt-4.1-mini": {"input": 0.0004, "cached_input": 0.0001, "output": 0.0016},
+    "gpt-4.1": {"input": 0.002, "cached_input": 0.0005, "output": 0.008},
+    "gpt-3.5-turbo": {"input": 0.0005, "cached_input": 0.0005, "output": 0.0015},
+}
+
+
+def token_stats(usage):
+    cached_tokens = 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is not None and details.cached_tokens:
+        cached_tokens = details.cached_tokens
+
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+        "cached_tokens": cached_tokens,
+    }
+
+
+def model_pricing(model):
+    # Dated snapshots like gpt-4o-mini-2024-07-18 use the price of their model.
+    for name in sorted(PRICING, key=len, reverse=True):
+        if model == name or model.startswith(name + "-"):
+            return PRICING[name]
+    return None
+
+
+def calculate_cost(model, tokens):
+    pricing = model_pricing(model)
+    if pricing is None:
+        print(f"Model {model} not recognized. OpenAI cost calculation failed.")
+        return 0
+
+    cached_tokens = tokens.get("cached_tokens", 0)
+    return (
+        (tokens["prompt_tokens"] - cached_tokens) * pricing["input"]
+        + cached_tokens * pricing["cached_input"]
+        + tokens["completion_tokens"] * pricing["output"]
+    ) / 1000
+
+
+def report_prompt_prefix(prompt, tokens):
+    # tokens of the static prefix shared by all requests of a prompt
+    metrics.set_gauge("llm_prompt_prefix_tokens", tokens, help_text="Tokens of the static prompt prefix shared by all requests", prompt=prompt)
+    if tokens < MIN_CACHED_PROMPT_TOKENS:
+        logger.warning(f"The {prompt} prompt prefix has {tokens} tokens, OpenAI only caches prompts with at least {MIN_CACHED_PROMPT_TOKENS} tokens.")
@@ -0,0 +1,44 @@
+import threading
+import logging
+from time import time
+import metrics
+
+logger = logging.getLogger('gunicorn.error')
+
+
+class PeriodicJob:
+    """Calls a function every `interval` seconds in a background thread.
+
+    Every gunicorn worker runs its own job thread. Jobs that must run only once
+    across workers take a Postgres advisory lock in the function itself.
+    """
+    name: str
+    interval: float
+
+    def __init__(self, name, interval, function):
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self.thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+        logger.info(f"Started periodic job {self.name} (every {self.interval}s).")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            start_time = time()
+            try:
+                self.function()
+            except Exception as e:
+                metrics.inc("periodic_job_failures_total", help_text="Failed periodic job runs", job=self.name)
+                logger.error(f"Periodic job {self.name} failed: {e}")
+            finally:
+                metrics.observe("periodic_job_seconds", time() - start_time, help_text="Duration of periodic job runs", job=self.name)
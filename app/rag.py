@@ -1,48 +1,165 @@
 
 
 from tinydb import TinyDB, Query
-from openai import OpenAI
-import notebooks.keys_secret as keys_secret
 import notebooks.helpers as helpers
 from faq_repository import FaqRepository
 from rag_evaluation import RagEvaluation
+from answer_cache import SemanticAnswerCache
+from context_assembler import ContextAssembler
+import openai_usage
+from llm_client import LlmClient, LlmUnavailableError
+from evaluation_policy import EvaluationPolicy, LocalRelevanceEvaluator, LLM_POLICIES
 from time import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import re
+import asyncio
+import metrics
+import stage_timer
 
 class Rag:
     ai_model: str
-    openai_client: OpenAI
+    llm_client: LlmClient
     rag_evaluation: RagEvaluation
+    answer_cache: SemanticAnswerCache
+    context_assembler: ContextAssembler
 
-    def __init__(self, ai_model):
-        self.openai_client = OpenAI(api_key=keys_secret.openai_api_key)
+    PENDING_EVALUATION = {
+        "relevance": "PENDING",
+        "relevance_explanation": "Evaluation queued",
+        "eval_prompt_tokens": 0,
+        "eval_completion_tokens": 0,
+        "eval_total_tokens": 0,
+        "eval_cached_tokens": 0,
+        "eval_openai_cost": 0,
+    }
+
+    # FAQ fast path: when the best FAQ hit scores at least the threshold of the
+    # courier's country, its answer is returned without calling OpenAI.
+    FAST_PATH = os.getenv("FAST_PATH", "0") == "1"
+    FAST_PATH_THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", "0.95"))
+    # per country overrides, e.g. "DE=0.93,GB=0.97"
+    FAST_PATH_THRESHOLDS = os.getenv("FAST_PATH_THRESHOLDS", "")
+    # {first_name} and {answer} are replaced, an empty template returns the FAQ answer as is
+    FAST_PATH_TEMPLATE = os.getenv("FAST_PATH_TEMPLATE", "Hi {first_name}! {answer}")
+
+    # Static instructions first and the request specific part last, so all
+    # requests share the same prompt prefix and the provider can cache it.
+    SYSTEM_PROMPT = """
+You are the courier suport agent of a iDelivery company that handles food delivery in Germany, Netherlands and UK. 
+The couriers working for this company are employees or freelancers. 
+
+Answer the courier's QUESTION based on the CONTEXT from the FAQ database.
+Use only the facts from the CONTEXT when answering the QUESTION.
+""".strip()
+
+    # stands for the courier's first name in answers of the semantic answer cache
+    FIRST_NAME_PLACEHOLDER = "\x00first_name\x00"
+
+    # "faq" answers with the best FAQ hit when OpenAI is unavailable (open circuit,
+    # retries or deadline exhausted), "none" fails the request
+    LLM_FALLBACK = os.getenv("LLM_FALLBACK", "faq")
+
+    # maximum number of batch items answered at the same time
+    BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+    def __init__(self, ai_model, answer_cache=None, embed_texts=None):
+        # embed_texts(texts) -> vectors is used by the local relevance evaluator
+        self.llm_client = LlmClient()
         self.ai_model = ai_model
-        self.rag_evaluation = RagEvaluation(ai_model)
+        self.rag_evaluation = RagEvaluation(ai_model, llm_client=self.llm_client)
+        self.answer_cache = answer_cache
+        self.context_assembler = ContextAssembler()
+        openai_usage.report_prompt_prefix("answer", self.context_assembler.count_tokens(self.SYSTEM_PROMPT))
+        openai_usage.report_prompt_prefix("evaluation", self.context_assembler.count_tokens(RagEvaluation.SYSTEM_PROMPT))
+        self.evaluation_policy = EvaluationPolicy()
+        self.local_evaluator = LocalRelevanceEvaluator(embed_texts) if embed_texts is not None else None
+        if self.evaluation_policy.policy != "full" and self.local_evaluator is None:
+            raise ValueError(f"Evaluation policy {self.evaluation_policy.policy} needs embed_texts for the local evaluator")
+        self.fast_path_thresholds = {
+            country.strip(): float(threshold)
+            for country, threshold in (item.split("=") for item in self.FAST_PATH_THRESHOLDS.split(",") if item.strip())
+        }
 
     def _llm_aswer(self, prompt):
-        response = self.openai_client.chat.completions.create(
-            model=self.ai_model,
-            messages=[{"role": "user", "content": prompt}]
-        )
+        with stage_timer.stage("llm_answer"):
+            response = self.llm_client.create(
+                operation="answer",
+                model=self.ai_model,
+                messages=self._messages(prompt)
+            )
         
+        return self._parse_response(response)
+
+
+    async def _llm_aswer_async(self, prompt):
+        with stage_timer.stage("llm_answer"):
+            response = await self.llm_client.acreate(
+                operation="answer",
+                model=self.ai_model,
+                messages=self._messages(prompt)
+            )
+
+        return self._parse_response(response)
+
+
+    def _messages(self, prompt):
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+
+
+    def _parse_response(self, response):
         answer_llm = response.choices[0].message.content
-        token_stats = {
-            "prompt_tokens": response.usage.prompt_tokens,
-            "completion_tokens": response.usage.completion_tokens,
-            "total_tokens": response.usage.total_tokens,
-        }
+        token_stats = openai_usage.token_stats(response.usage)
 
         return answer_llm, token_stats
+
+
+    def _llm_stream(self, prompt):
+        # Opens the stream right away, so LlmUnavailableError is raised before the first
+        # delta. Returns an iterator of (delta text, token stats) pairs, the token
+        # stats arrive with the last chunk.
+        stream = self.llm_client.create(
+            operation="answer_stream",
+            model=self.ai_model,
+            messages=self._messages(prompt),
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+        return (self._parse_chunk(chunk) for chunk in self.llm_client.stream_chunks("answer_stream", stream))
+
+
+    async def _llm_stream_async(self, prompt):
+        stream = await self.llm_client.acreate(
+            operation="answer_stream",
+            model=self.ai_model,
+            messages=self._messages(prompt),
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+        async def chunks():
+            async for chunk in self.llm_client.astream_chunks("answer_stream", stream):
+                yield self._parse_chunk(chunk)
+
+        return chunks()
+
+
+    def _parse_chunk(self, chunk):
+        token_stats = None
+        if chunk.usage is not None:
+            token_stats = openai_usage.token_stats(chunk.usage)
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        return delta, token_stats
         
 
     def _build_prompt(self, question, related_faq, courier):
+        # Request specific part of the prompt, sent after SYSTEM_PROMPT
         prompt_template = """
-    You are the courier suport agent of a iDelivery company that handles food delivery in Germany, Netherlands and UK. 
-    The couriers working for this company are employees or freelancers. 
-
     The courier {courier_first_name} is {courier_age} years old, has a {courier_contract_type} working contract and uses a {courier_vehicle_type} for delivery.
-        
-    Answer the courier's QUESTION based on the CONTEXT from the FAQ database.
-    Use only the facts from the CONTEXT when answering the QUESTION.
 
     QUESTION: {question}
 
@@ -51,68 +168,376 @@ class Rag:
 
     """.strip()
 
-        context = ""
-        
-        for doc in related_faq:
-            context = context + f"country: {doc['country']}\nquestion: {doc['question']}\nanswer: {doc['answer']}\n\n"
-
-        # print(courier)
-        prompt = prompt_template.format(question=question, 
-                                        context=context, 
-                                        courier_first_name=courier['first_name'],
-                                        courier_age=courier['age'],
-                                        courier_contract_type=courier['contract_type'],
-                                        courier_vehicle_type=courier['vehicle_type'],
-                                    ).strip()
-        return prompt
+        with stage_timer.stage("build_prompt"):
+            context, context_tokens_saved = self.context_assembler.assemble(related_faq)
 
+            # print(courier)
+            prompt = prompt_template.format(question=question, 
+                                            context=context, 
+                                            courier_first_name=courier['first_name'],
+                                            courier_age=courier['age'],
+                                            courier_contract_type=courier['contract_type'],
+                                            courier_vehicle_type=courier['vehicle_type'],
+                                        ).strip()
+        return prompt, context_tokens_saved
 
-    def get_llm_answer(self, question, courier, related_faq):
-        start_time = time()
 
-        prompt = self._build_prompt(question, related_faq, courier)
-        # print(prompt)
-        answer_llm, token_stats = self._llm_aswer(prompt)
-        # print("LLM answer: ",answer_llm)
-        relevance, rel_token_stats = self.rag_evaluation.evaluate_answer(question, answer_llm)
+    def evaluate_answer(self, question, answer_llm, policy="full"):
+        # policy is one of LLM_POLICIES to evaluate with the LLM judge, "local" otherwise
+        if policy in LLM_POLICIES:
+            relevance, rel_token_stats = self.rag_evaluation.evaluate_answer(question, answer_llm)
+        else:
+            with stage_timer.stage("local_evaluation"):
+                relevance, rel_token_stats = self.local_evaluator.evaluate_answer(question, answer_llm)
         # print("LLM relevance: ", relevance)
 
+        return self._eval_data(relevance, rel_token_stats, policy)
+
+
+    async def evaluate_answer_async(self, question, answer_llm, policy="full"):
+        if policy in LLM_POLICIES:
+            relevance, rel_token_stats = await self.rag_evaluation.evaluate_answer_async(question, answer_llm)
+        else:
+            with stage_timer.stage("local_evaluation"):
+                relevance, rel_token_stats = await asyncio.to_thread(self.local_evaluator.evaluate_answer, question, answer_llm)
+
+        return self._eval_data(relevance, rel_token_stats, policy)
+
+
+    def _eval_data(self, relevance, rel_token_stats, policy="full"):
+        metrics.inc("answer_evaluations_total", help_text="Answer relevance evaluations by policy", policy=policy)
+        return {
+            "relevance": relevance.get("Relevance", "UNKNOWN"),
+            "relevance_explanation": relevance.get(
+                "Explanation", "Failed to parse evaluation"
+            ),
+            "eval_prompt_tokens": rel_token_stats["prompt_tokens"],
+            "eval_completion_tokens": rel_token_stats["completion_tokens"],
+            "eval_total_tokens": rel_token_stats["total_tokens"],
+            "eval_cached_tokens": rel_token_stats["cached_tokens"],
+            "eval_openai_cost": self._calculate_openai_cost(self.ai_model, rel_token_stats),
+            "evaluation_policy": policy,
+        }
+
+
+    def cache_answer(self, question_vector, courier, answer_data):
+        # Only answers evaluated as RELEVANT are served again to other couriers.
+        if self.answer_cache is None or question_vector is None:
+            return
+        # Relevance of the local evaluator is too coarse to serve an answer to other couriers.
+        if answer_data["relevance"] == "RELEVANT" and answer_data.get("evaluation_policy", "full") in LLM_POLICIES:
+            # The courier's first name (e.g. in the greeting) is cached as a placeholder
+            # and replaced with the name of the courier the answer is served to.
+            self.answer_cache.put(question_vector, courier, {
+                "answer": self._replace_first_name(answer_data["answer"], courier['first_name']),
+                "model_used": answer_data["model_used"],
+                "relevance": answer_data["relevance"],
+                "relevance_explanation": answer_data["relevance_explanation"],
+            })
+
+
+    def _replace_first_name(self, answer, first_name):
+        # Whole words only, names like Ava or Ben are also part of other words ("Available").
+        if not first_name:
+            return answer
+        return re.sub(rf"\b{re.escape(first_name)}\b", lambda _: self.FIRST_NAME_PLACEHOLDER, answer)
+
+
+    def _cached_answer_data(self, cached_answer, courier, start_time):
+        return {
+            **cached_answer,
+            "answer": cached_answer["answer"].replace(self.FIRST_NAME_PLACEHOLDER, courier['first_name']),
+            "response_time": (time() - start_time),
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+            "cached_tokens": 0,
+            "eval_prompt_tokens": 0,
+            "eval_completion_tokens": 0,
+            "eval_total_tokens": 0,
+            "eval_cached_tokens": 0,
+            "openai_cost": 0,
+            "cache_hit": True,
+            "evaluation_policy": "cached",
+        }
+
+
+    def _cached_answer(self, question_vector, courier, start_time):
+        if self.answer_cache is None or question_vector is None:
+            return None
+        with stage_timer.stage("answer_cache_lookup"):
+            cached_answer = self.answer_cache.lookup(question_vector, courier)
+        if cached_answer is None:
+            return None
+        return self._cached_answer_data(cached_answer, courier, start_time)
+
+
+    def _fast_path_answer(self, related_faq, courier, start_time):
+        if not self.FAST_PATH or not related_faq:
+            return None
+        top_hit = related_faq[0]
+        threshold = self.fast_path_thresholds.get(courier.get('country'), self.FAST_PATH_THRESHOLD)
+        if top_hit.get("score", 0.0) < threshold:
+            return None
+
+        metrics.inc("fast_path_answers_total", help_text="Answers returned from the FAQ without calling OpenAI")
+        answer_data = self._faq_answer_data(top_hit, courier, start_time, "faq", f"FAQ answer returned directly, search score {top_hit['score']:.4f}")
+        answer_data["fast_path"] = True
+        return answer_data
+
+
+    def _fallback_answer(self, related_faq, courier, start_time, error):
+        # FAQ-only answer while OpenAI is unavailable, re-raises the error without a fallback.
+        if self.LLM_FALLBACK != "faq" or not related_faq:
+            raise error
+        metrics.inc("llm_fallback_answers_total", help_text="FAQ answers returned because OpenAI was unavailable")
+        return self._faq_answer_data(related_faq[0], courier, start_time, "faq_fallback", f"OpenAI unavailable, FAQ answer returned: {error}")
+
+
+    def _faq_answer_data(self, top_hit, courier, start_time, model_used, explanation):
+        answer = top_hit['answer']
+        if self.FAST_PATH_TEMPLATE:
+            answer = self.FAST_PATH_TEMPLATE.format(first_name=courier['first_name'], answer=answer)
+
+        return {
+            "answer": answer,
+            "model_used": model_used,
+            "response_time": (time() - start_time),
+            "relevance": "SKIPPED",
+            "relevance_explanation": explanation,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+            "cached_tokens": 0,
+            "eval_prompt_tokens": 0,
+            "eval_completion_tokens": 0,
+            "eval_total_tokens": 0,
+            "eval_cached_tokens": 0,
+            "openai_cost": 0,
+            "cache_hit": False,
+            "fast_path": False,
+            "evaluation_policy": "skipped",
+        }
+
+
+    def _answer_data(self, courier, answer_llm, token_stats, eval_data, question_vector, start_time, context_tokens_saved=0, evaluation_policy="full"):
+        # eval_data is None when the answer is evaluated later with evaluation_policy
+        evaluated = eval_data is not None
+        eval_data = dict(eval_data if evaluated else {**self.PENDING_EVALUATION, "evaluation_policy": evaluation_policy})
+
         openai_cost_rag = self._calculate_openai_cost(self.ai_model, token_stats)
-        openai_cost_eval = self._calculate_openai_cost(self.ai_model, rel_token_stats)
 
-        openai_cost = openai_cost_rag + openai_cost_eval
+        openai_cost = openai_cost_rag + eval_data.pop("eval_openai_cost")
 
         answer_data = {
                 "answer": answer_llm,
                 "model_used": self.ai_model,
                 "response_time": (time() - start_time),
-                "relevance": relevance.get("Relevance", "UNKNOWN"),
-                "relevance_explanation": relevance.get(
-                    "Explanation", "Failed to parse evaluation"
-                ),
                 "prompt_tokens": token_stats["prompt_tokens"],
                 "completion_tokens": token_stats["completion_tokens"],
                 "total_tokens": token_stats["total_tokens"],
-                "eval_prompt_tokens": rel_token_stats["prompt_tokens"],
-                "eval_completion_tokens": rel_token_stats["completion_tokens"],
-                "eval_total_tokens": rel_token_stats["total_tokens"],
+                "cached_tokens": token_stats["cached_tokens"],
+                "context_tokens_saved": context_tokens_saved,
+                **eval_data,
                 "openai_cost": openai_cost,
+                "cache_hit": False,
             }
         print(answer_data)
 
+        if evaluated:
+            self.cache_answer(question_vector, courier, answer_data)
+
         return answer_data
-    
+
+
+    def get_llm_answer(self, question, courier, related_faq, evaluate=True, question_vector=None):
+        # With evaluate=False the relevance is left PENDING and the caller is
+        # responsible for evaluating the answer later (see EvaluationWorker).
+        # With question_vector and an answer cache, similar questions skip both LLM calls.
+        start_time = time()
+
+        fast_path_answer_data = self._fast_path_answer(related_faq, courier, start_time)
+        if fast_path_answer_data is not None:
+            return fast_path_answer_data
+
+        cached_answer_data = self._cached_answer(question_vector, courier, start_time)
+        if cached_answer_data is not None:
+            return cached_answer_data
+
+        prompt, context_tokens_saved = self._build_prompt(question, related_faq, courier)
+        # print(prompt)
+        try:
+            answer_llm, token_stats = self._llm_aswer(prompt)
+        except LlmUnavailableError as e:
+            return self._fallback_answer(related_faq, courier, start_time, e)
+        # print("LLM answer: ",answer_llm)
+        evaluation_policy = self.evaluation_policy.choose(related_faq)
+        eval_data = self.evaluate_answer(question, answer_llm, evaluation_policy) if evaluate else None
+
+        return self._answer_data(courier, answer_llm, token_stats, eval_data, question_vector, start_time, context_tokens_saved, evaluation_policy)
+
+
+    async def get_llm_answer_async(self, question, courier, related_faq, evaluate=True, question_vector=None):
+        start_time = time()
+
+        fast_path_answer_data = self._fast_path_answer(related_faq, courier, start_time)
+        if fast_path_answer_data is not None:
+            return fast_path_answer_data
+
+        cached_answer_data = self._cached_answer(question_vector, courier, start_time)
+        if cached_answer_data is not None:
+            return cached_answer_data
+
+        prompt, context_tokens_saved = self._build_prompt(question, related_faq, courier)
+        try:
+            answer_llm, token_stats = await self._llm_aswer_async(prompt)
+        except LlmUnavailableError as e:
+            return self._fallback_answer(related_faq, courier, start_time, e)
+        evaluation_policy = self.evaluation_policy.choose(related_faq)
+        eval_data = await self.evaluate_answer_async(question, answer_llm, evaluation_policy) if evaluate else None
+
+        return self._answer_data(courier, answer_llm, token_stats, eval_data, question_vector, start_time, context_tokens_saved, evaluation_policy)
+
+
+    def get_llm_answers(self, items, evaluate=True, max_concurrency=None):
+        # items is a list of dicts with question, courier, related_faq and optional question_vector.
+        # Yields (index, answer_data, error) in completion order, so one slow item
+        # doesn't hold back the others.
+        with ThreadPoolExecutor(max_workers=max_concurrency or self.BATCH_CONCURRENCY) as executor:
+            futures = {
+                executor.submit(
+                    self.get_llm_answer,
+                    item["question"], item["courier"], item["related_faq"],
+                    evaluate=evaluate, question_vector=item.get("question_vector"),
+                ): index
+                for index, item in enumerate(items)
+            }
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+
+
+    def stream_llm_answer(self, question, courier, related_faq, evaluate=True, question_vector=None):
+        # Generator of ("delta", text) events while the answer is generated,
+        # followed by one ("done", answer_data) event.
+        start_time = time()
+
+        cached_answer_data = self._fast_path_answer(related_faq, courier, start_time) or self._cached_answer(question_vector, courier, start_time)
+        if cached_answer_data is not None:
+            yield from self._cached_stream(cached_answer_data)
+            return
+
+        prompt, context_tokens_saved = self._build_prompt(question, related_faq, courier)
+        stream = _StreamedAnswer(start_time)
+
+        llm_start_time = time()
+        try:
+            chunks = self._llm_stream(prompt)
+        except LlmUnavailableError as e:
+            yield from self._cached_stream(self._fallback_answer(related_faq, courier, start_time, e))
+            return
+        try:
+            for delta, token_stats in chunks:
+                if stream.add(delta, token_stats):
+                    yield "delta", delta
+        except LlmUnavailableError as e:
+            yield from self._broken_stream(stream, related_faq, courier, start_time, e)
+            return
+        # includes the time spent sending the deltas to the client
+        stage_timer.record("llm_answer", time() - llm_start_time)
+
+        evaluation_policy = self.evaluation_policy.choose(related_faq)
+        eval_data = self.evaluate_answer(question, stream.answer(), evaluation_policy) if evaluate else None
+        yield "done", stream.answer_data(self._answer_data(courier, stream.answer(), stream.token_stats, eval_data, question_vector, start_time, context_tokens_saved, evaluation_policy))
+
+
+    async def stream_llm_answer_async(self, question, courier, related_faq, evaluate=True, question_vector=None):
+        start_time = time()
+
+        cached_answer_data = self._fast_path_answer(related_faq, courier, start_time) or self._cached_answer(question_vector, courier, start_time)
+        if cached_answer_data is not None:
+            for event in self._cached_stream(cached_answer_data):
+                yield event
+            return
+
+        prompt, context_tokens_saved = self._build_prompt(question, related_faq, courier)
+        stream = _StreamedAnswer(start_time)
+
+        llm_start_time = time()
+        try:
+            chunks = await self._llm_stream_async(prompt)
+        except LlmUnavailableError as e:
+            for event in self._cached_stream(self._fallback_answer(related_faq, courier, start_time, e)):
+                yield event
+            return
+        try:
+            async for delta, token_stats in chunks:
+                if stream.add(delta, token_stats):
+                    yield "delta", delta
+        except LlmUnavailableError as e:
+            for event in self._broken_stream(stream, related_faq, courier, start_time, e):
+                yield event
+            return
+        stage_timer.record("llm_answer", time() - llm_start_time)
+
+        evaluation_policy = self.evaluation_policy.choose(related_faq)
+        eval_data = await self.evaluate_answer_async(question, stream.answer(), evaluation_policy) if evaluate else None
+        yield "done", stream.answer_data(self._answer_data(courier, stream.answer(), stream.token_stats, eval_data, question_vector, start_time, context_tokens_saved, evaluation_policy))
+
+
+    def _cached_stream(self, cached_answer_data):
+        cached_answer_data["time_to_first_token"] = cached_answer_data["response_time"]
+        yield "delta", cached_answer_data["answer"]
+        yield "done", cached_answer_data
+
+    def _broken_stream(self, stream, related_faq, courier, start_time, error):
+        # The stream broke off after it was opened. The "done" event carries the fallback
+        # answer, which replaces the deltas sent so far. Without a fallback an ("error",
+        # message) event ends the stream.
+        try:
+            fallback_answer_data = self._fallback_answer(related_faq, courier, start_time, error)
+        except LlmUnavailableError:
+            yield "error", str(error)
+            return
+        if not stream.parts:
+            yield from self._cached_stream(fallback_answer_data)
+            return
+        yield "done", stream.answer_data(fallback_answer_data)
+
     def _calculate_openai_cost(self, model, tokens):
-        openai_cost = 0
+        return openai_usage.calculate_cost(model, tokens)
 
-        if model == "gpt-4o-mini":
-            openai_cost = (
-                tokens["prompt_tokens"] * 0.00015 + tokens["completion_tokens"] * 0.0006
-            ) / 1000
-        else:
-            print("Model not recognized. OpenAI cost calculation failed.")
 
-        return openai_cost
+class _StreamedAnswer:
+    # Collects the streamed answer parts, token stats and time to first token.
+
+    def __init__(self, start_time):
+        self.start_time = start_time
+        self.parts = []
+        # stays at zero when the stream ends without a usage chunk
+        self.token_stats = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
+        self.time_to_first_token = None
+
+    def add(self, delta, token_stats):
+        if token_stats is not None:
+            self.token_stats = token_stats
+        if not delta:
+            return False
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time() - self.start_time
+            metrics.observe("llm_time_to_first_token_seconds", self.time_to_first_token, help_text="Time until the first streamed answer token")
+        self.parts.append(delta)
+        return True
+
+    def answer(self):
+        return "".join(self.parts)
+
+    def answer_data(self, answer_data):
+        answer_data["time_to_first_token"] = self.time_to_first_token
+        return answer_data
+
 
 # question = "Can I deliver alcohol with my bike?"
 # courier_id = 0
@@ -1,47 +1,71 @@
 
 
 from tinydb import TinyDB, Query
-from openai import OpenAI
-import notebooks.keys_secret as keys_secret
 import notebooks.helpers as helpers
 from faq_repository import FaqRepository
 import json
+import re
+import logging
+import metrics
+import stage_timer
+import openai_usage
+from llm_client import LlmClient, LlmUnavailableError
+
+logger = logging.getLogger('gunicorn.error')
 
 class RagEvaluation:
     ai_model: str
-    openai_client: OpenAI
-
-    def __init__(self, ai_model):
-        self.openai_client = OpenAI(api_key=keys_secret.openai_api_key)
+    llm_client: LlmClient
+
+    # Static evaluation instructions, shared prompt prefix of all evaluations (see Rag.SYSTEM_PROMPT)
+    SYSTEM_PROMPT = """
+You are an expert evaluator for a Retrieval-Augmented Generation (RAG) system.
+Your task is to analyze the relevance of the generated answer compared to the question provided.
+Based on the relevance of the generated answer you will classify
+it as "NON_RELEVANT", "PARTLY_RELEVANT", or "RELEVANT".
+
+Please analyze the content and context of the generated answer in relation to the question 
+and provide your evaluation in parsable JSON without using code blocks:
+
+{
+"Relevance": "NON_RELEVANT" | "PARTLY_RELEVANT" | "RELEVANT",
+"Explanation": "[Provide a brief explanation for your evaluation]"
+}
+""".strip()
+
+    def __init__(self, ai_model, llm_client=None):
+        # Rag passes its client, so both share the circuit breaker of the OpenAI API
+        self.llm_client = llm_client or LlmClient()
         self.ai_model = ai_model
 
     def _llm_aswer(self, prompt):
-        response = self.openai_client.chat.completions.create(
+        response = self.llm_client.create(
+            operation="evaluation",
             model=self.ai_model,
-            messages=[{"role": "user", "content": prompt}]
+            messages=self._messages(prompt)
         )
         
         return response
 
+    async def _llm_aswer_async(self, prompt):
+        return await self.llm_client.acreate(
+            operation="evaluation",
+            model=self.ai_model,
+            messages=self._messages(prompt)
+        )
+
+    def _messages(self, prompt):
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+
     def _build_prompt(self, question, llm_answer):
         prompt_template = """
-    You are an expert evaluator for a Retrieval-Augmented Generation (RAG) system.
-    Your task is to analyze the relevance of the generated answer compared to the question provided.
-    Based on the relevance of the generated answer you will classify
-    it as "NON_RELEVANT", "PARTLY_RELEVANT", or "RELEVANT".
-
     Here is the data for evaluation:
 
     Question: {question}
     Generated Answer: {answer_llm}
-
-    Please analyze the content and context of the generated answer in relation to the question 
-    and provide your evaluation in parsable JSON without using code blocks:
-
-    {{
-    "Relevance": "NON_RELEVANT" | "PARTLY_RELEVANT" | "RELEVANT",
-    "Explanation": "[Provide a brief explanation for your evaluation]"
-    }}
     """.strip()
         
         prompt = prompt_template.format(
@@ -55,18 +79,58 @@ class RagEvaluation:
     def evaluate_answer(self, question, llm_answer):
         prompt = self._build_prompt(question, llm_answer)
         # print(prompt)
-        response = self._llm_aswer(prompt)
+        try:
+            with stage_timer.stage("llm_evaluation"):
+                response = self._llm_aswer(prompt)
+        except LlmUnavailableError as e:
+            return self._unavailable(e)
+
+        return self._parse_response(response)
 
+
+    async def evaluate_answer_async(self, question, llm_answer):
+        prompt = self._build_prompt(question, llm_answer)
+        try:
+            with stage_timer.stage("llm_evaluation"):
+                response = await self._llm_aswer_async(prompt)
+        except LlmUnavailableError as e:
+            return self._unavailable(e)
+
+        return self._parse_response(response)
+
+
+    def _unavailable(self, error):
+        # The answer is still returned, without a relevance.
+        relevance = {"Relevance": "UNKNOWN", "Explanation": f"Evaluation skipped, OpenAI unavailable: {error}"}
+        return relevance, {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
+
+
+    def _parse_response(self, response):
         answer_llm = response.choices[0].message.content
         # print("LLM evaluation answer:", answer_llm)
 
-        token_stats = {
-            "prompt_tokens": response.usage.prompt_tokens,
-            "completion_tokens": response.usage.completion_tokens,
-            "total_tokens": response.usage.total_tokens,
-        }
+        token_stats = openai_usage.token_stats(response.usage)
+
+        return self._parse_relevance(answer_llm), token_stats
+
+
+    def _parse_relevance(self, answer_llm):
+        # The model sometimes wraps the JSON in code blocks or text, an
+        # unparsable evaluation must not fail the question request.
+        match = re.search(r"\{.*\}", answer_llm or "", re.DOTALL)
+        for candidate in (answer_llm, match.group(0) if match else None):
+            if candidate is None:
+                continue
+            try:
+                relevance = json.loads(candidate)
+            except (TypeError, ValueError):
+                continue
+            if isinstance(relevance, dict):
+                return relevance
 
-        return json.loads(answer_llm), token_stats
+        metrics.inc("evaluation_parse_failures_total", help_text="LLM evaluations that could not be parsed")
+        logger.warning(f"Failed to parse LLM evaluation: {answer_llm!r}")
+        return {"Relevance": "UNKNOWN", "Explanation": f"Failed to parse evaluation: {(answer_llm or '')[:200]}"}
 
 
 # question = "Can I deliver alcohol with my bike?"
@@ -1,10 +1,16 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from rag import Rag
 from faq_repository import FaqRepository
 from courier_repository import CourierRepository
 from conversation_repository import ConversationRepository
+from evaluation_worker import EvaluationWorker
+from answer_cache import SemanticAnswerCache
+from periodic_job import PeriodicJob
+from startup import Startup
 import notebooks.helpers as helpers
-import uuid, os, logging
+import metrics
+import stage_timer
+import uuid, os, logging, json
 
 
 logger = logging.getLogger('gunicorn.error')
@@ -15,19 +21,118 @@ QD_SERVER = os.environ.get("QD_SERVER", "localhost:6333")
 logger.info(f"Using Qdrant server at: {QD_SERVER}")
 TINY_DB_FILE = os.environ.get("TINY_DB_FILE", "../tmp_datastore/tmp_tinydb_storage/courier_profiles_db.json")
 logger.info(f"Using TinyDB file: {TINY_DB_FILE}")
+# "sync" evaluates the answer before responding, "async" evaluates it in background workers
+EVALUATION_MODE = os.environ.get("EVALUATION_MODE", "sync")
+logger.info(f"Using evaluation mode: {EVALUATION_MODE}")
+ANSWER_CACHE = os.environ.get("ANSWER_CACHE", "0") == "1"
+logger.info(f"Using semantic answer cache: {ANSWER_CACHE}")
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "100"))
+
+# The module level steps don't open connections or start threads, so gunicorn can
+# import this module once in the master (preload_app in gunicorn.conf.py) and fork
+# the workers from it. start_worker() runs the per process steps in every worker.
+startup = Startup()
+faq_db = startup.step("faq_repository", lambda: FaqRepository(QD_SERVER, "courier_faq"))
+startup.step("download_embedding_model", faq_db.download_embedding_model)
+courier_repo = startup.step("courier_repository", lambda: CourierRepository(TINY_DB_FILE))
+conversationRepository = startup.step("conversation_repository", ConversationRepository)
+answer_cache = SemanticAnswerCache(version_provider=faq_db.ingestion_version) if ANSWER_CACHE else None
+rag = startup.step("rag", lambda: Rag("gpt-4o-mini", answer_cache=answer_cache, embed_texts=faq_db.embed_texts))
+evaluation_worker = EvaluationWorker(rag, conversationRepository)
+rollup_job = PeriodicJob("conversation-rollups", conversationRepository.ROLLUP_INTERVAL, conversationRepository.refresh_rollups)
+stats_job = PeriodicJob("stats-reconciliation", conversationRepository.STATS_RECONCILE_INTERVAL, conversationRepository.reconcile_stats)
+
+
+def start_worker():
+    steps = [
+        ("warm_up_embedding_model", faq_db.warm_up),
+        ("postgres", conversationRepository.ping),
+    ]
+    if conversationRepository.RUN_TIMEZONE_CHECK:
+        steps.append(("timezone_check", conversationRepository.check_timezone))
+    # the workers also re-evaluate locally evaluated answers with negative feedback
+    if EVALUATION_MODE == "async" or rag.evaluation_policy.policy != "full":
+        steps.append(("evaluation_worker", evaluation_worker.start))
+    steps.append(("rollup_job", rollup_job.start))
+    steps.append(("stats_job", stats_job.start))
+    return startup.run(steps)
+
+
+# gunicorn.conf.py calls start_worker() in its post_worker_init hook
+if os.environ.get("SERVER_STARTUP_HOOK") != "1":
+    start_worker()
+
+def save_answer(conversation_id, question, courier, answer_data, question_vector, request_stages=None):
+    conversationRepository.save_conversation(
+        conversation_id=conversation_id,
+        question=question,
+        answer_data=answer_data,
+        stages=request_stages.snapshot() if request_stages is not None else None,
+    )
+
+    submit_evaluation(conversation_id, question, courier, answer_data, question_vector)
+
+
+def submit_evaluation(conversation_id, question, courier, answer_data, question_vector):
+    # cache hits, fast path and fallback answers are not evaluated
+    if EVALUATION_MODE == "async" and answer_data["relevance"] == "PENDING":
+        evaluation_worker.submit(
+            conversation_id, question, answer_data["answer"],
+            on_complete=lambda eval_data: rag.cache_answer(question_vector, courier, {**answer_data, **eval_data}),
+            policy=answer_data.get("evaluation_policy", "full"),
+        )
+
+
+def flag_evaluation(conversation_id):
+    # Locally evaluated answers with negative feedback are evaluated again by the LLM judge.
+    conversation = conversationRepository.get_conversation(conversation_id)
+    if conversation is not None and conversation["evaluation_policy"] == "local":
+        evaluation_worker.submit(conversation_id, conversation["question"], conversation["answer"], policy="flagged")
+
+
+def question_response(conversation_id, question, answer_data):
+    return {
+        "conversation_id":conversation_id, 
+        # "courier": courier,
+        "question": question, 
+        "answer": answer_data["answer"],
+        "model_used": answer_data["model_used"],
+    }
+
+
+def server_sent_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+def stream_answer(conversation_id, question, courier, related_faq, question_vector, request_stages):
+    yield server_sent_event({"conversation_id": conversation_id, "question": question}, event="conversation")
+
+    evaluate = EVALUATION_MODE != "async"
+    for event, value in rag.stream_llm_answer(question, courier, related_faq, evaluate=evaluate, question_vector=question_vector):
+        if event == "delta":
+            yield server_sent_event({"delta": value})
+        elif event == "error":
+            logger.error(f"/question stream failed: {value}")
+            yield server_sent_event({"conversation_id": conversation_id, "error": value}, event="error")
+        else:
+            save_answer(conversation_id, question, courier, value, question_vector, request_stages)
+            response = question_response(conversation_id, question, value)
+            logger.info(f"/question streamed response: {response}")
+            yield server_sent_event(response, event="done")
 
-faq_db = FaqRepository(QD_SERVER, "courier_faq")
-courier_repo = CourierRepository(TINY_DB_FILE)
-conversationRepository = ConversationRepository()
-rag = Rag("gpt-4o-mini")
 
 """
 curl --request POST 'http://127.0.0.1:5000/question' \
 --header 'Content-Type: application/json' \
 -d '{"question": "Can I keep the bike?", "courier_id": 0}'
+
+Add "stream": true to the body to receive the answer token by token as Server-Sent Events:
+"conversation" event, then data events with {"delta": "..."}, then a "done" event with the full response.
 """
 @app.route('/question', methods=['POST'])
 def handle_question():
+    request_stages = stage_timer.start_request()
     data = request.json
     question = data.get('question')
     courier_id = data.get('courier_id')
@@ -36,30 +141,100 @@ def handle_question():
     if not question or courier_id is None:
         return jsonify({"error": "Missing 'question' or 'courier_id' in request body"}), 400
 
-    related_faq = faq_db.vector_search(question, "DE", 0.7, 5)
+    question_vector = faq_db.embed_question(question) if answer_cache is not None else None
+    related_faq = faq_db.vector_search(question, "DE", 0.7, 5, query_vector=question_vector)
 
     courier = courier_repo.search(courier_id)
-    courier['age'] = helpers.get_age_by_birthdate(courier['date_of_birth'])
+    with stage_timer.stage("courier_age"):
+        courier['age'] = helpers.get_age_by_birthdate(courier['date_of_birth'])
 
-    answer_data = rag.get_llm_answer(question, courier, related_faq)
+    if data.get('stream'):
+        return Response(
+            stream_with_context(stream_answer(conversation_id, question, courier, related_faq, question_vector, request_stages)),
+            mimetype="text/event-stream",
+        )
 
-    conversationRepository.save_conversation(
-        conversation_id=conversation_id,
-        question=question,
-        answer_data=answer_data,
-    )
+    evaluate = EVALUATION_MODE != "async"
+    answer_data = rag.get_llm_answer(question, courier, related_faq, evaluate=evaluate, question_vector=question_vector)
 
-    response = {
-        "conversation_id":conversation_id, 
-        # "courier": courier,
-        "question": question, 
-        "answer": answer_data["answer"],
-        "model_used": answer_data["model_used"],
-    }
+    save_answer(conversation_id, question, courier, answer_data, question_vector, request_stages)
+
+    response = question_response(conversation_id, question, answer_data)
 
     logger.info(f"/question response: {response}")
     return jsonify(response), 200
 
+def stream_batch_answers(items):
+    evaluate = EVALUATION_MODE != "async"
+    conversations = []
+
+    for index, answer_data, error in rag.get_llm_answers(items, evaluate=evaluate):
+        item = items[index]
+        if error is not None:
+            logger.error(f"/questions item {index} failed: {error}")
+            yield json.dumps({"index": index, "error": str(error)}) + "\n"
+            continue
+        conversation_id = uuid.uuid4().hex
+        item["conversation_id"] = conversation_id
+        item["answer_data"] = answer_data
+        conversations.append((conversation_id, item["question"], answer_data))
+        yield json.dumps({"index": index, **question_response(conversation_id, item["question"], answer_data)}) + "\n"
+
+    # All conversations of the batch are stored with one multi-row insert.
+    conversationRepository.save_conversations(conversations)
+    for item in items:
+        if "answer_data" in item:
+            submit_evaluation(item["conversation_id"], item["question"], item["courier"], item["answer_data"], item["question_vector"])
+
+    logger.info(f"/questions answered {len(conversations)} of {len(items)} questions")
+    yield json.dumps({"done": True, "answered": len(conversations), "failed": len(items) - len(conversations)}) + "\n"
+
+
+"""
+curl --request POST 'http://127.0.0.1:5000/questions' \
+--header 'Content-Type: application/json' \
+-d '{"questions": [{"question": "Can I keep the bike?", "courier_id": 0}, {"question": "When do I get paid?", "courier_id": 1}]}'
+
+Answers are streamed back as JSON lines in completion order, each with the "index" of its question,
+followed by a last {"done": true, ...} line once all conversations are stored.
+"""
+@app.route('/questions', methods=['POST'])
+def handle_questions():
+    # Batch items are answered in parallel, their stages are only exported as metrics.
+    stage_timer.start_request()
+    data = request.json
+    questions = data.get('questions')
+
+    if not questions or not isinstance(questions, list):
+        return jsonify({"error": "Missing 'questions' list in request body"}), 400
+    if len(questions) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} questions per request"}), 400
+    if any(not item.get('question') or item.get('courier_id') is None for item in questions):
+        return jsonify({"error": "Missing 'question' or 'courier_id' in a 'questions' item"}), 400
+
+    couriers = courier_repo.search_many([item['courier_id'] for item in questions])
+    missing = sorted({item['courier_id'] for item in questions if item['courier_id'] not in couriers}, key=str)
+    if missing:
+        return jsonify({"error": f"Unknown courier_id: {missing}"}), 400
+    for courier in couriers.values():
+        courier['age'] = helpers.get_age_by_birthdate(courier['date_of_birth'])
+
+    question_texts = [item['question'] for item in questions]
+    question_vectors = faq_db.embed_questions(question_texts)
+    related_faqs = faq_db.vector_search_batch(question_texts, ["DE"] * len(questions), 0.7, 5, query_vectors=question_vectors)
+
+    items = [
+        {
+            "question": item['question'],
+            "courier": couriers[item['courier_id']],
+            "related_faq": related_faq,
+            "question_vector": question_vector if answer_cache is not None else None,
+        }
+        for item, related_faq, question_vector in zip(questions, related_faqs, question_vectors)
+    ]
+
+    return Response(stream_with_context(stream_batch_answers(items)), mimetype="application/x-ndjson")
+
 """
 curl --request POST 'http://127.0.0.1:5000/feedback' \
 --header 'Content-Type: application/json' \
@@ -73,17 +248,76 @@ def handle_feedback():
 
     if not conversation_id or feedback is None:
         return jsonify({"error": "Missing 'conversation_id' or 'feedback' in request body"}), 400
+    if not isinstance(feedback, int) or isinstance(feedback, bool):
+        return jsonify({"error": "'feedback' must be an integer, e.g. 1 or -1"}), 400
 
     conversationRepository.save_feedback(
         conversation_id=conversation_id,
         feedback=feedback,
     )
 
+    if feedback < 0:
+        flag_evaluation(conversation_id)
+
     print(f"Received feedback for conversation {conversation_id}: {feedback})")
 
     response = {"message": "Feedback received"}
     logger.info(f"/feedback response: {response}")
     return jsonify(response), 200
 
+"""
+curl 'http://127.0.0.1:9696/conversations?relevance=NON_RELEVANT&model=gpt-4o-mini&since=2025-01-01T00:00:00&limit=50'
+
+Conversations newest first with their latest feedback. Pass the returned "next_cursor"
+as cursor to get the next page, it is null on the last page.
+"""
+@app.route('/conversations', methods=['GET'])
+def handle_conversations():
+    args = request.args
+    try:
+        page = conversationRepository.get_conversations_page(
+            limit=args.get('limit'),
+            cursor=args.get('cursor'),
+            relevance=args.get('relevance'),
+            model=args.get('model'),
+            since=args.get('since'),
+            until=args.get('until'),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(page), 200
+
+"""
+curl 'http://127.0.0.1:9696/stats'
+"""
+@app.route('/stats', methods=['GET'])
+def handle_stats():
+    # All-time counters, at most STATS_CACHE_TTL seconds old
+    return jsonify(conversationRepository.get_stats()), 200
+
+"""
+curl 'http://127.0.0.1:9696/healthz'
+"""
+@app.route('/healthz', methods=['GET'])
+def handle_healthz():
+    # Liveness, the process answers requests
+    return jsonify({"status": "ok"}), 200
+
+"""
+curl 'http://127.0.0.1:9696/readyz'
+"""
+@app.route('/readyz', methods=['GET'])
+def handle_readyz():
+    # Readiness, all startup steps of this worker passed (embedding model warmed up, Postgres reachable)
+    status = startup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+"""
+curl 'http://127.0.0.1:9696/metrics'
+"""
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == '__main__':
     app.run(debug=True, host="0.0.0.0", port=9696)    
\ No newline at end of file
@@ -0,0 +1,235 @@
+from quart import Quart, Response, request, jsonify
+from rag import Rag
+from faq_repository import FaqRepository
+from courier_repository import CourierRepository
+from conversation_repository import ConversationRepository
+from evaluation_worker import EvaluationWorker
+from answer_cache import SemanticAnswerCache
+from periodic_job import PeriodicJob
+from startup import Startup
+import notebooks.helpers as helpers
+import metrics
+import stage_timer
+import uuid, os, logging, json, asyncio
+
+# asyncio variant of server.py with the same /question and /feedback contract.
+# OpenAI and Qdrant are called with async clients, so one process serves many
+# requests waiting for the LLM at the same time. Run with:
+# cd app && uvicorn --host 0.0.0.0 --port 9696 server_async:app
+
+logger = logging.getLogger('uvicorn.error')
+logger.setLevel(logging.DEBUG)
+
+app = Quart(__name__)
+QD_SERVER = os.environ.get("QD_SERVER", "localhost:6333")
+logger.info(f"Using Qdrant server at: {QD_SERVER}")
+TINY_DB_FILE = os.environ.get("TINY_DB_FILE", "../tmp_datastore/tmp_tinydb_storage/courier_profiles_db.json")
+logger.info(f"Using TinyDB file: {TINY_DB_FILE}")
+EVALUATION_MODE = os.environ.get("EVALUATION_MODE", "sync")
+logger.info(f"Using evaluation mode: {EVALUATION_MODE}")
+ANSWER_CACHE = os.environ.get("ANSWER_CACHE", "0") == "1"
+logger.info(f"Using semantic answer cache: {ANSWER_CACHE}")
+
+startup = Startup()
+faq_db = startup.step("faq_repository", lambda: FaqRepository(QD_SERVER, "courier_faq"))
+startup.step("download_embedding_model", faq_db.download_embedding_model)
+courier_repo = startup.step("courier_repository", lambda: CourierRepository(TINY_DB_FILE))
+conversationRepository = startup.step("conversation_repository", ConversationRepository)
+answer_cache = SemanticAnswerCache(version_provider=faq_db.ingestion_version) if ANSWER_CACHE else None
+rag = startup.step("rag", lambda: Rag("gpt-4o-mini", answer_cache=answer_cache, embed_texts=faq_db.embed_texts))
+evaluation_worker = EvaluationWorker(rag, conversationRepository)
+rollup_job = PeriodicJob("conversation-rollups", conversationRepository.ROLLUP_INTERVAL, conversationRepository.refresh_rollups)
+stats_job = PeriodicJob("stats-reconciliation", conversationRepository.STATS_RECONCILE_INTERVAL, conversationRepository.reconcile_stats)
+
+
+def start_worker():
+    steps = [
+        ("warm_up_embedding_model", faq_db.warm_up),
+        ("postgres", conversationRepository.ping),
+    ]
+    if conversationRepository.RUN_TIMEZONE_CHECK:
+        steps.append(("timezone_check", conversationRepository.check_timezone))
+    # the workers also re-evaluate locally evaluated answers with negative feedback
+    if EVALUATION_MODE == "async" or rag.evaluation_policy.policy != "full":
+        steps.append(("evaluation_worker", evaluation_worker.start))
+    steps.append(("rollup_job", rollup_job.start))
+    steps.append(("stats_job", stats_job.start))
+    return startup.run(steps)
+
+
+@app.before_serving
+async def start_serving():
+    # uvicorn only accepts requests once the worker is warmed up
+    await asyncio.to_thread(start_worker)
+
+
+async def retrieve_faq(question):
+    question_vector = None
+    if answer_cache is not None:
+        question_vector = await asyncio.to_thread(faq_db.embed_question, question)
+    related_faq = await faq_db.vector_search_async(question, "DE", 0.7, 5, query_vector=question_vector)
+    return question_vector, related_faq
+
+
+async def find_courier(courier_id):
+    courier = await asyncio.to_thread(courier_repo.search, courier_id)
+    with stage_timer.stage("courier_age"):
+        courier['age'] = helpers.get_age_by_birthdate(courier['date_of_birth'])
+    return courier
+
+
+async def save_answer(conversation_id, question, courier, answer_data, question_vector, request_stages=None):
+    await asyncio.to_thread(
+        conversationRepository.save_conversation,
+        conversation_id=conversation_id,
+        question=question,
+        answer_data=answer_data,
+        stages=request_stages.snapshot() if request_stages is not None else None,
+    )
+
+    # cache hits, fast path and fallback answers are not evaluated
+    if EVALUATION_MODE == "async" and answer_data["relevance"] == "PENDING":
+        evaluation_worker.submit(
+            conversation_id, question, answer_data["answer"],
+            on_complete=lambda eval_data: rag.cache_answer(question_vector, courier, {**answer_data, **eval_data}),
+            policy=answer_data.get("evaluation_policy", "full"),
+        )
+
+
+async def flag_evaluation(conversation_id):
+    # Locally evaluated answers with negative feedback are evaluated again by the LLM judge.
+    conversation = await asyncio.to_thread(conversationRepository.get_conversation, conversation_id)
+    if conversation is not None and conversation["evaluation_policy"] == "local":
+        evaluation_worker.submit(conversation_id, conversation["question"], conversation["answer"], policy="flagged")
+
+
+def question_response(conversation_id, question, answer_data):
+    return {
+        "conversation_id":conversation_id,
+        "question": question,
+        "answer": answer_data["answer"],
+        "model_used": answer_data["model_used"],
+    }
+
+
+def server_sent_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+async def stream_answer(conversation_id, question, courier, related_faq, question_vector, request_stages):
+    yield server_sent_event({"conversation_id": conversation_id, "question": question}, event="conversation")
+
+    evaluate = EVALUATION_MODE != "async"
+    async for event, value in rag.stream_llm_answer_async(question, courier, related_faq, evaluate=evaluate, question_vector=question_vector):
+        if event == "delta":
+            yield server_sent_event({"delta": value})
+        elif event == "error":
+            logger.error(f"/question stream failed: {value}")
+            yield server_sent_event({"conversation_id": conversation_id, "error": value}, event="error")
+        else:
+            await save_answer(conversation_id, question, courier, value, question_vector, request_stages)
+            response = question_response(conversation_id, question, value)
+            logger.info(f"/question streamed response: {response}")
+            yield server_sent_event(response, event="done")
+
+
+@app.route('/question', methods=['POST'])
+async def handle_question():
+    request_stages = stage_timer.start_request()
+    data = await request.get_json()
+    question = data.get('question')
+    courier_id = data.get('courier_id')
+    conversation_id = uuid.uuid4().hex
+
+    if not question or courier_id is None:
+        return jsonify({"error": "Missing 'question' or 'courier_id' in request body"}), 400
+
+    # FAQ retrieval and courier lookup don't depend on each other.
+    (question_vector, related_faq), courier = await asyncio.gather(
+        retrieve_faq(question),
+        find_courier(courier_id),
+    )
+
+    if data.get('stream'):
+        return Response(
+            stream_answer(conversation_id, question, courier, related_faq, question_vector, request_stages),
+            mimetype="text/event-stream",
+        )
+
+    evaluate = EVALUATION_MODE != "async"
+    answer_data = await rag.get_llm_answer_async(question, courier, related_faq, evaluate=evaluate, question_vector=question_vector)
+
+    await save_answer(conversation_id, question, courier, answer_data, question_vector, request_stages)
+
+    response = question_response(conversation_id, question, answer_data)
+
+    logger.info(f"/question response: {response}")
+    return jsonify(response), 200
+
+
+@app.route('/feedback', methods=['POST'])
+async def handle_feedback():
+    data = await request.get_json()
+    conversation_id = data.get('conversation_id')
+    feedback = data.get('feedback')
+
+    if not conversation_id or feedback is None:
+        return jsonify({"error": "Missing 'conversation_id' or 'feedback' in request body"}), 400
+    if not isinstance(feedback, int) or isinstance(feedback, bool):
+        return jsonify({"error": "'feedback' must be an integer, e.g. 1 or -1"}), 400
+
+    await asyncio.to_thread(
+        conversationRepository.save_feedback,
+        conversation_id=conversation_id,
+        feedback=feedback,
+    )
+    if feedback < 0:
+        await flag_evaluation(conversation_id)
+
+    response = {"message": "Feedback received"}
+    logger.info(f"/feedback response: {response}")
+    return jsonify(response), 200
+
+
+@app.route('/conversations', methods=['GET'])
+async def handle_conversations():
+    args = request.args
+    try:
+        page = await asyncio.to_thread(
+            conversationRepository.get_conversations_page,
+            limit=args.get('limit'),
+            cursor=args.get('cursor'),
+            relevance=args.get('relevance'),
+            model=args.get('model'),
+            since=args.get('since'),
+            until=args.get('until'),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(page), 200
+
+
+@app.route('/stats', methods=['GET'])
+async def handle_stats():
+    return jsonify(await asyncio.to_thread(conversationRepository.get_stats)), 200
+
+
+@app.route('/healthz', methods=['GET'])
+async def handle_healthz():
+    return jsonify({"status": "ok"}), 200
+
+
+@app.route('/readyz', methods=['GET'])
+async def handle_readyz():
+    status = startup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+@app.route('/metrics', methods=['GET'])
+async def handle_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+if __name__ == '__main__':
+    app.run(debug=True, host="0.0.0.0", port=9696)
@@ -0,0 +1,53 @@
+# Per-request timing of the /question pipeline stages.
+# start_request() opens a timing context for the current request, stage(name)
+# blocks add their duration to it. The context lives in a contextvar, so it follows
+# the request through asyncio tasks and asyncio.to_thread calls. Stages timed
+# outside a request (e.g. background evaluations) are only exported as metrics.
+import contextvars
+from contextlib import contextmanager
+from time import perf_counter
+import metrics
+
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+
+
+class RequestStages:
+    def __init__(self):
+        self.start_time = perf_counter()
+        self.durations = {}
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+    def elapsed(self):
+        return perf_counter() - self.start_time
+
+    def snapshot(self):
+        # Stage durations so far plus the "total" time since the request started.
+        return {**self.durations, "total": self.elapsed()}
+
+
+def start_request():
+    request_stages = RequestStages()
+    _request_stages.set(request_stages)
+    return request_stages
+
+
+def current():
+    return _request_stages.get()
+
+
+def record(name, duration):
+    metrics.observe_histogram("question_stage_seconds", duration, help_text="Duration of the /question pipeline stages", stage=name)
+    request_stages = _request_stages.get()
+    if request_stages is not None:
+        request_stages.add(name, duration)
+
+
+@contextmanager
+def stage(name):
+    start_time = perf_counter()
+    try:
+        yield
+    finally:
+        record(name, perf_counter() - start_time)
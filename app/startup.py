@@ -0,0 +1,60 @@
+import logging
+import threading
+from time import perf_counter
+import metrics
+
+logger = logging.getLogger('gunicorn.error')
+
+
+class Startup:
+    """Timed init steps of a server process and its readiness.
+
+    Every step is logged with its duration, exported as the startup_step_seconds
+    gauge and listed by /readyz. The process is ready once run() passed all steps,
+    a failed step keeps it not ready and is reported with its error.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self.ready = False
+        self.failed_step = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._started = False
+        metrics.set_gauge("server_ready", 0, help_text="1 once all startup steps of the worker passed")
+
+    def step(self, name, function):
+        start_time = perf_counter()
+        try:
+            return function()
+        except Exception as e:
+            self.failed_step, self.error = name, repr(e)
+            logger.error(f"Startup step {name} failed: {e!r}")
+            raise
+        finally:
+            duration = perf_counter() - start_time
+            self.durations[name] = duration
+            metrics.set_gauge("startup_step_seconds", duration, help_text="Duration of the server startup steps", step=name)
+            logger.info(f"Startup step {name} took {duration:.3f}s.")
+
+    def run(self, steps):
+        # steps is a list of (name, function), run once per process.
+        with self._lock:
+            if self._started:
+                return self.ready
+            self._started = True
+            try:
+                for name, function in steps:
+                    self.step(name, function)
+            except Exception:
+                return False
+            self.ready = True
+            metrics.set_gauge("server_ready", 1, help_text="1 once all startup steps of the worker passed")
+            logger.info(f"Worker ready after {sum(self.durations.values()):.3f}s of startup steps.")
+            return True
+
+    def status(self):
+        status = {"ready": self.ready, "steps": {name: round(duration, 4) for name, duration in self.durations.items()}}
+        if self.failed_step is not None:
+            status.update({"failed_step": self.failed_step, "error": self.error})
+        return status
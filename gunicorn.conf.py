@@ -0,0 +1,20 @@
+# gunicorn settings of the API server, used by start_server.sh:
+# gunicorn --config=gunicorn.conf.py --chdir=app server:app
+import os
+
+# The master imports server.py once before forking the workers, so the embedding
+# model files are downloaded and the courier store is compiled only once.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+# covers loading and warming up the embedding model in post_worker_init
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+
+# server.py leaves the per worker startup steps to post_worker_init
+os.environ["SERVER_STARTUP_HOOK"] = "1"
+
+
+def post_worker_init(worker):
+    # Runs in the forked worker before it accepts requests: loads the onnxruntime
+    # session of the embedding model (not fork safe), warms it up and checks Postgres.
+    import server
+    if not server.start_worker():
+        worker.log.error(f"Worker startup failed, /readyz reports {server.startup.status()}")
@@ -3,6 +3,8 @@ set -e
 
 SETUP_DBS="false"
 SETUP_GRAFANA="false"
+SERVER="flask"
+PORT="9696"
 
 setup_databases() {
   echo "---Starting DB ingestion process..."
@@ -17,7 +19,11 @@ setup_monitoring() {
 
 start_application() {
   echo "--- 🚀 Starting iDelivery Support Backend Server ---"
-  gunicorn --bind=0.0.0.0:9696 --chdir=app --log-level=debug server:app
+  if [ "$SERVER" == "async" ]; then
+    cd app && uvicorn --host=0.0.0.0 --port="$PORT" --workers="${WEB_CONCURRENCY:-1}" --log-level=debug server_async:app
+  else
+    gunicorn --config=gunicorn.conf.py --bind=0.0.0.0:"$PORT" --chdir=app --log-level=debug server:app
+  fi
 }
 
 for arg in "$@"; do
@@ -28,6 +34,12 @@ for arg in "$@"; do
         setup_grafana=*)
             SETUP_GRAFANA="${arg#*=}"
             ;;
+        server=*)
+            SERVER="${arg#*=}"
+            ;;
+        port=*)
+            PORT="${arg#*=}"
+            ;;
         *)
             echo "Warning: Ignoring unknown argument: $arg. Use key=value format."
             ;;
@@ -38,6 +50,7 @@ echo "-----------------------------------------------------"
 echo "iDelivery Courier Support Platform Deployment Script"
 echo "Database Setup Requested: $SETUP_DBS"
 echo "Grafana Setup Requested: $SETUP_GRAFANA"
+echo "Server: $SERVER on port $PORT"
 echo "-----------------------------------------------------"
 
 if [ "$SETUP_DBS" == "true" ]; then